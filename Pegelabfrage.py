@@ -5,15 +5,34 @@
 # Erwartete Config-Datei: config-pegel.json (oder per --config Pfad angeben)
 
 import argparse
+import bisect
+import codecs
+import cProfile
+import csv
+import io
 import json
+import math
+import multiprocessing
+import os
+import pstats
+import re
 import sqlite3
 import sys
+import tempfile
+import threading
 import time
-from dataclasses import dataclass
-from datetime import datetime, timezone
+from array import array
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from contextlib import closing, contextmanager, redirect_stdout
+from dataclasses import dataclass, field, fields, replace
+from functools import partial
+from itertools import islice
+from datetime import datetime, timedelta, timezone
 from email.message import EmailMessage
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, TextIO, Tuple, Union
 
 import requests
 import smtplib
@@ -23,8 +42,22 @@ try:
 except Exception:
     ZoneInfo = None  # type: ignore
 
+try:
+    import numpy as np  # optional: schnelle Batch-Klassifikation
+except Exception:
+    np = None  # type: ignore
+
 
 HLNUG_LASTVALUES_INDEX = "https://www.hlnug.de/static/pegel/wiskiweb3/data/internet/layers/10/index.json"
+# Zeitreihen pro Station (WISKI-Web), Perioden: week / month / year
+HLNUG_STATION_TS_URL = "https://www.hlnug.de/static/pegel/wiskiweb3/data/internet/stations/0/{station_no}/{parameter}/{period}.json"
+HLNUG_STATION_TS_PERIODS: Tuple[Tuple[str, int], ...] = (("week", 7), ("month", 31), ("year", 366))
+HLNUG_PROVIDER = "hlnug"  # eingebaute Quelle; Stationen ohne "source" gehören dazu
+# Felder eines Index-Eintrags (Layout von index.json); andere Quellen werden beim Parsen darauf abgebildet
+INDEX_FIELDS: Tuple[str, ...] = (
+    "station_no", "station_id", "station_name", "stationparameter_name", "timestamp", "ts_value", "ts_unitsymbol",
+)
+USER_AGENT = "pegel-alarm/2.3"
 
 
 def get_app_dir() -> Path:
@@ -42,6 +75,26 @@ class StationConfig:
     parameter: str  # z.B. W
     thresholds_cm: Tuple[float, ...]  # Warnstufe 1..N (aufsteigend), z.B. 3 oder 4 Stufen
     level_names: Tuple[str, ...]      # Namen für Warnstufe 1..N
+    rise_cm_per_hour: float = 0.0     # Alarm "schneller Anstieg" ab dieser Steigung (0 = aus)
+    source: str = HLNUG_PROVIDER      # Name der Quelle (providers.<name>), von der die Messwerte kommen
+
+
+@dataclass(frozen=True)
+class ProviderConfig:
+    """
+    Eine Datenquelle für letzte Messwerte (Abschnitt providers.<name>).
+    type "hlnug": index.json im HLNUG-Layout. type "json": beliebige JSON/REST-Liste, deren Einträge
+    über fields (Index-Feld -> Pfad im Eintrag, Punkte für verschachtelte Objekte/Listen) auf das
+    Index-Layout abgebildet werden.
+    """
+    name: str
+    kind: str  # hlnug | json
+    url: str
+    timeout_seconds: int  # gilt für den ganzen Abruf (SourceFetcher), nicht nur für einzelne Socket-Operationen
+    items_path: Tuple[str, ...] = ()  # Pfad zur Liste der Einträge, () = Top-Level-Array
+    fields: Tuple[Tuple[str, Tuple[str, ...]], ...] = ()  # (Index-Feld, Pfad) für type "json"
+    parameter: str = ""  # fester Parameter, wenn die Quelle keinen liefert (z.B. nur Wasserstände)
+    unit: str = ""       # feste Einheit, wenn die Quelle keine liefert
 
 
 @dataclass(frozen=True)
@@ -49,14 +102,32 @@ class Settings:
     stations: List[StationConfig]
 
     db_path: Path
+    db_journal_mode: str  # wal (Default) | delete (z.B. für DB auf Netzlaufwerk)
+    # Aufbewahrung in Tagen (0 = unbegrenzt): Rohwerte, Stunden- und Tageswerte
+    raw_retention_days: int
+    hourly_retention_days: int
+    daily_retention_days: int
+    compact_interval_hours: float  # wie oft abgelaufene Zeilen gelöscht und Platz freigegeben wird
 
     mode: str  # once | daemon
     poll_interval_seconds: int
+    # Daemon-Takt: auf Uhrzeit ausgerichtet; adaptive_schedule (opt-in) passt ihn an den Veröffentlichungsrhythmus an
+    adaptive_schedule: bool
+    fast_poll_interval_seconds: int  # solange eine Station Stufe >= 1 hat oder steigt
+    calm_poll_interval_seconds: int  # nach calm_after_hours ohne Auffälligkeiten
+    calm_after_hours: float
     min_alert_interval_minutes: int
     request_timeout_seconds: int
+    stream_index: bool  # index.json inkrementell parsen und nur konfigurierte Stationen behalten
 
     rearm_below_hours: float  # Stunden unterhalb Schwelle, bevor erneuter Alarm für dieselbe Meldestufe möglich ist
 
+    # Trend (Anstiegsrate) je Station über ein festes Fenster der letzten Messwerte
+    trend_window_size: int  # Anzahl Werte im Fenster (z.B. 12 = 3 h bei 15-Minuten-Werten)
+    trend_min_samples: int  # so viele Werte mindestens, bevor die Steigung ausgewertet wird
+    forecast_method: str        # linear | exponential | off: Prognose der Zeit bis zur nächsten Schwelle
+    forecast_max_hours: float   # weiter entfernte Schwellen werden nicht prognostiziert
+
     email_enabled: bool
     mail_to: str
     mail_from: str
@@ -67,11 +138,27 @@ class Settings:
     smtp_password: str
     smtp_use_ssl: bool
     smtp_use_starttls: bool
+    # Outbox: fehlgeschlagene Mails mit exponentiellem Backoff erneut versuchen (Sekunden)
+    outbox_retry_base_seconds: int
+    outbox_retry_max_seconds: int
+    email_digest: bool  # alle Alarme eines Zyklus je Empfänger in einer Mail zusammenfassen
 
     # Mail-Verhalten
     alert_on_start: bool           # beim ersten Lauf (kein last_level) mailen, wenn Warnstufe>=1
     alert_on_level_increase: bool  # mailen bei Stufenanstieg
 
+    # Nachladen historischer Werte (Zeitreihen-Endpunkt pro Station)
+    backfill_on_start: bool     # beim Daemon-Start Lücken seit dem letzten gespeicherten Wert füllen (once: --backfill)
+    backfill_initial_days: int  # neue Station ohne Historie: so viele Tage nachladen
+    backfill_workers: int       # parallele Abrufe
+
+    # Metriken: Prometheus-Endpunkt (host:port, leer = aus) und JSON-Zeile pro Zyklus (Datei, None = aus)
+    metrics_listen: str
+    metrics_json_path: Optional[Path]
+
+    # Datenquellen nach Name (immer mit "hlnug"), siehe StationConfig.source
+    providers: Dict[str, ProviderConfig]
+
     debug: bool
 
 
@@ -191,6 +278,71 @@ def _parse_level_names_for_section(section_data: Dict[str, Any], section_name: s
     return tuple(f"Warnstufe {i}" for i in range(1, n_levels + 1))
 
 
+def _parse_rise_rate(section_data: Dict[str, Any], section_name: str, fallback: float) -> float:
+    """Optional: rise_cm_per_hour (Alarm bei schnellem Anstieg), 0 schaltet ab."""
+    if "rise_cm_per_hour" not in section_data:
+        return fallback
+    rate = float(section_data.get("rise_cm_per_hour") or 0.0)
+    if rate < 0:
+        raise ValueError(f"[{section_name}] rise_cm_per_hour muss >= 0 sein (0 = aus)")
+    return rate
+
+
+def _json_path(value: Any) -> Tuple[str, ...]:
+    """"a.b.0.c" -> ("a", "b", "0", "c"); leer -> ()."""
+    return tuple(p for p in str(value or "").strip().split(".") if p)
+
+
+def _parse_providers(cfg: Dict[str, Any], default_timeout: int) -> Dict[str, ProviderConfig]:
+    """
+    Abschnitt providers: { "<name>": {type, url, timeout_seconds, items, fields, parameter, unit} }.
+    "hlnug" ist immer vorhanden (URL und Timeout überschreibbar).
+    """
+    section = cfg.get("providers", {})
+    if not isinstance(section, dict):
+        section = {}
+    raw: Dict[str, Any] = {HLNUG_PROVIDER: {}}
+    raw.update(section)
+    providers: Dict[str, ProviderConfig] = {}
+    for name, pc in raw.items():
+        if not isinstance(pc, dict):
+            raise ValueError(f"providers.{name} muss ein Objekt sein")
+        kind = str(pc.get("type") or (HLNUG_PROVIDER if name == HLNUG_PROVIDER else "json")).strip().lower()
+        if kind not in ("hlnug", "json"):
+            raise ValueError(f"providers.{name}.type muss 'hlnug' oder 'json' sein")
+        url = str(pc.get("url") or (HLNUG_LASTVALUES_INDEX if kind == "hlnug" else "")).strip()
+        if not url:
+            raise ValueError(f"providers.{name}: url fehlt")
+        timeout = int(pc.get("timeout_seconds") or default_timeout)
+        if timeout < 1:
+            raise ValueError(f"providers.{name}.timeout_seconds muss >= 1 sein")
+        field_paths: Tuple[Tuple[str, Tuple[str, ...]], ...] = ()
+        if kind == "json":
+            fields_raw = pc.get("fields") or {}
+            if not isinstance(fields_raw, dict):
+                raise ValueError(f"providers.{name}.fields muss ein Objekt sein (Index-Feld -> Pfad)")
+            # gleichnamige Felder werden ohne Eintrag in fields direkt übernommen
+            aliases = {"parameter": "stationparameter_name", "value": "ts_value", "unit": "ts_unitsymbol"}
+            mapping = {k: (k,) for k in INDEX_FIELDS}
+            for key, path in fields_raw.items():
+                key = aliases.get(key, key)
+                if key not in INDEX_FIELDS:
+                    raise ValueError(f"providers.{name}.fields: unbekanntes Feld {key!r} (erlaubt: {', '.join(INDEX_FIELDS)})")
+                mapping[key] = _json_path(path)
+            field_paths = tuple(mapping.items())
+        providers[name] = ProviderConfig(
+            name=name,
+            kind=kind,
+            url=url,
+            timeout_seconds=timeout,
+            items_path=_json_path(pc.get("items")),
+            fields=field_paths,
+            parameter=str(pc.get("parameter") or "").strip(),
+            unit=str(pc.get("unit") or "").strip(),
+        )
+    return providers
+
+
 def load_settings(config_path: Path) -> Settings:
     if not config_path.exists():
         raise FileNotFoundError(f"Config-Datei nicht gefunden: {config_path}")
@@ -231,6 +383,20 @@ def load_settings(config_path: Path) -> Settings:
     global_level_names: Tuple[str, ...] = tuple(f"Warnstufe {i}" for i in range(1, len(fallback_thresholds) + 1))
     global_level_names = _parse_level_names_for_section(threshold_sec, "threshold", fallback=global_level_names, n_levels=len(fallback_thresholds))
 
+    # Trend: globale Anstiegsrate (pro Station überschreibbar) + Fenstergröße
+    trend_sec = cfg.get("trend", {})
+    if not isinstance(trend_sec, dict):
+        trend_sec = {}
+    fallback_rise = _parse_rise_rate(trend_sec, "trend", 0.0)
+    trend_window_size = int(trend_sec.get("window_size") or 12)
+    trend_min_samples = int(trend_sec.get("min_samples") or 4)
+
+    forecast_sec = cfg.get("forecast", {})
+    if not isinstance(forecast_sec, dict):
+        forecast_sec = {}
+    forecast_method = str(forecast_sec.get("method") or "linear").strip().lower()
+    forecast_max_hours = float(forecast_sec.get("max_hours") or 48)
+
     # Stationen: bevorzugt cfg['stations'] als Liste
     # Zusätzlich unterstützt: 1:1-INI->JSON Mapping mit Top-Level Keys "station:<Name>".
     stations: List[StationConfig] = []
@@ -270,6 +436,8 @@ def load_settings(config_path: Path) -> Settings:
                     parameter=parameter,
                     thresholds_cm=thresholds,
                     level_names=level_names,
+                    rise_cm_per_hour=_parse_rise_rate(st, name, fallback_rise),
+                    source=str(st.get("source") or HLNUG_PROVIDER).strip(),
                 )
             )
     elif station_sections:
@@ -301,6 +469,8 @@ def load_settings(config_path: Path) -> Settings:
                     parameter=parameter,
                     thresholds_cm=thresholds,
                     level_names=level_names,
+                    rise_cm_per_hour=_parse_rise_rate(st, name, fallback_rise),
+                    source=str(st.get("source") or HLNUG_PROVIDER).strip(),
                 )
             )
     else:
@@ -328,6 +498,8 @@ def load_settings(config_path: Path) -> Settings:
                 parameter=parameter,
                 thresholds_cm=thresholds,
                 level_names=level_names,
+                rise_cm_per_hour=_parse_rise_rate(st, "station", fallback_rise),
+                source=str(st.get("source") or HLNUG_PROVIDER).strip(),
             )
         )
 
@@ -336,6 +508,11 @@ def load_settings(config_path: Path) -> Settings:
     if not isinstance(storage, dict):
         storage = {}
     db_path = Path(str(storage.get("db_path") or "pegel.db")).expanduser()
+    db_journal_mode = str(storage.get("journal_mode") or "wal").strip().lower()
+    raw_retention_days = int(storage.get("raw_retention_days") or 0)
+    hourly_retention_days = int(storage.get("hourly_retention_days") or 0)
+    daily_retention_days = int(storage.get("daily_retention_days") or 0)
+    compact_interval_hours = float(storage.get("compact_interval_hours") or 24)
 
     # Runtime
     runtime = cfg.get("runtime", {})
@@ -347,8 +524,16 @@ def load_settings(config_path: Path) -> Settings:
     poll_interval_seconds_raw = int(runtime.get("poll_interval_seconds") or 0)
     poll_interval_seconds = poll_interval_seconds_raw if poll_interval_seconds_raw > 0 else poll_interval_minutes * 60
 
+    # opt-in: bestehende Daemon-Installationen behalten ihren festen Takt
+    adaptive_schedule = _as_bool(runtime.get("adaptive_schedule"), False)
+    fast_poll_interval_seconds = int(runtime.get("fast_poll_interval_seconds") or min(120, poll_interval_seconds))
+    calm_poll_interval_seconds = int(runtime.get("calm_poll_interval_seconds") or max(3600, poll_interval_seconds))
+    calm_after_hours = float(runtime.get("calm_after_hours") or 12)
+
     min_alert_interval_minutes = int(runtime.get("min_alert_interval_minutes") or 180)
     request_timeout_seconds = int(runtime.get("request_timeout_seconds") or 20)
+    stream_index = _as_bool(runtime.get("stream_index"), True)
+    providers = _parse_providers(cfg, request_timeout_seconds)
 
     rearm_below_hours = float(runtime.get("rearm_below_hours") or 6)
 
@@ -362,6 +547,9 @@ def load_settings(config_path: Path) -> Settings:
     email_enabled = _as_bool(email.get("enabled"), True)
     mail_to = str(email.get("to") or "").strip()
     mail_from = str(email.get("from") or "").strip()
+    outbox_retry_base_seconds = int(email.get("retry_base_seconds") or 60)
+    outbox_retry_max_seconds = int(email.get("retry_max_seconds") or 3600)
+    email_digest = _as_bool(email.get("digest"), False)
 
     smtp = cfg.get("smtp", {})
     if not isinstance(smtp, dict):
@@ -373,6 +561,20 @@ def load_settings(config_path: Path) -> Settings:
     smtp_use_ssl = _as_bool(smtp.get("use_ssl"), True)
     smtp_use_starttls = _as_bool(smtp.get("use_starttls"), False)
 
+    backfill = cfg.get("backfill", {})
+    if not isinstance(backfill, dict):
+        backfill = {}
+    backfill_on_start = _as_bool(backfill.get("on_start"), True)
+    backfill_initial_days = int(backfill.get("initial_days") or 7)
+    backfill_workers = int(backfill.get("workers") or 4)
+
+    metrics_sec = cfg.get("metrics", {})
+    if not isinstance(metrics_sec, dict):
+        metrics_sec = {}
+    metrics_listen = str(metrics_sec.get("listen") or "").strip()
+    metrics_json_raw = str(metrics_sec.get("json_path") or "").strip()
+    metrics_json_path = Path(metrics_json_raw).expanduser() if metrics_json_raw else None
+
     debug_sec = cfg.get("debug", {})
     if not isinstance(debug_sec, dict):
         debug_sec = {}
@@ -382,21 +584,67 @@ def load_settings(config_path: Path) -> Settings:
     app_dir = get_app_dir()
     if not db_path.is_absolute():
         db_path = (app_dir / db_path).resolve()
+    if metrics_json_path is not None and not metrics_json_path.is_absolute():
+        metrics_json_path = (app_dir / metrics_json_path).resolve()
 
     # Validierung Runtime
     if mode not in ("once", "daemon"):
         raise ValueError("runtime.mode muss 'once' oder 'daemon' sein")
     if poll_interval_seconds < 10:
         raise ValueError("Intervall zu klein (mindestens 10 Sekunden).")
+    if not (10 <= fast_poll_interval_seconds <= poll_interval_seconds <= calm_poll_interval_seconds):
+        raise ValueError(
+            "runtime: es muss gelten 10 <= fast_poll_interval_seconds <= Intervall <= calm_poll_interval_seconds"
+        )
+    if min(raw_retention_days, hourly_retention_days, daily_retention_days) < 0:
+        raise ValueError("storage.*_retention_days muss >= 0 sein (0 = unbegrenzt)")
+    if backfill_workers < 1:
+        raise ValueError("backfill.workers muss >= 1 sein")
+    if not (1 <= outbox_retry_base_seconds <= outbox_retry_max_seconds):
+        raise ValueError("email.retry_base_seconds muss >= 1 und <= email.retry_max_seconds sein")
+    if trend_min_samples < 2 or trend_window_size < trend_min_samples:
+        raise ValueError("trend: min_samples muss >= 2 und window_size >= min_samples sein")
+    if forecast_method not in ("linear", "exponential", "off"):
+        raise ValueError("forecast.method muss 'linear', 'exponential' oder 'off' sein")
+    if metrics_listen and not re.fullmatch(r"[\w.\-]*:\d+", metrics_listen):
+        raise ValueError("metrics.listen muss 'host:port' sein, z.B. 127.0.0.1:9108")
+    if db_journal_mode not in ("wal", "delete", "truncate", "persist"):
+        raise ValueError("storage.journal_mode muss 'wal', 'delete', 'truncate' oder 'persist' sein")
+    # station_no/parameter ist die Identität in stations, alert_state, last_seen und TrendTracker;
+    # zwei Quellen mit derselben Kennung würden dort zu einer Messreihe verschmelzen.
+    source_by_key: Dict[Tuple[str, str], str] = {}
+    for st in stations:
+        if st.source not in providers:
+            raise ValueError(f"{st.name}: source '{st.source}' ist nicht unter providers definiert")
+        other = source_by_key.setdefault((st.station_no, st.parameter), st.source)
+        if other != st.source:
+            raise ValueError(
+                f"{st.name}: station_no {st.station_no}/{st.parameter} kommt in den Quellen "
+                f"'{other}' und '{st.source}' vor (station_no/parameter muss quellenübergreifend eindeutig sein)"
+            )
 
     return Settings(
         stations=stations,
         db_path=db_path,
+        db_journal_mode=db_journal_mode,
+        raw_retention_days=raw_retention_days,
+        hourly_retention_days=hourly_retention_days,
+        daily_retention_days=daily_retention_days,
+        compact_interval_hours=compact_interval_hours,
         mode=mode,
         poll_interval_seconds=poll_interval_seconds,
+        adaptive_schedule=bool(adaptive_schedule),
+        fast_poll_interval_seconds=fast_poll_interval_seconds,
+        calm_poll_interval_seconds=calm_poll_interval_seconds,
+        calm_after_hours=calm_after_hours,
         min_alert_interval_minutes=int(min_alert_interval_minutes),
         request_timeout_seconds=int(request_timeout_seconds),
+        stream_index=bool(stream_index),
         rearm_below_hours=float(rearm_below_hours),
+        trend_window_size=trend_window_size,
+        trend_min_samples=trend_min_samples,
+        forecast_method=forecast_method,
+        forecast_max_hours=forecast_max_hours,
         email_enabled=bool(email_enabled),
         mail_to=mail_to,
         mail_from=mail_from,
@@ -406,8 +654,17 @@ def load_settings(config_path: Path) -> Settings:
         smtp_password=smtp_password,
         smtp_use_ssl=bool(smtp_use_ssl),
         smtp_use_starttls=bool(smtp_use_starttls),
+        outbox_retry_base_seconds=outbox_retry_base_seconds,
+        outbox_retry_max_seconds=outbox_retry_max_seconds,
+        email_digest=bool(email_digest),
         alert_on_start=bool(alert_on_start),
         alert_on_level_increase=bool(alert_on_level_increase),
+        backfill_on_start=bool(backfill_on_start),
+        backfill_initial_days=int(backfill_initial_days),
+        backfill_workers=int(backfill_workers),
+        metrics_listen=metrics_listen,
+        metrics_json_path=metrics_json_path,
+        providers=providers,
         debug=bool(debug),
     )
 
@@ -416,47 +673,362 @@ def _table_columns(con: sqlite3.Connection, table: str) -> List[str]:
     return [row[1] for row in cur.fetchall()]
 
 
-def init_db(db_path: Path) -> None:
-    db_path.parent.mkdir(parents=True, exist_ok=True)
-    with sqlite3.connect(db_path) as con:
+def _migrate_state_rows(con: sqlite3.Connection) -> None:
+    """
+    Übernimmt alte Key/Value-Zeilen aus state (armed:/below_since:/last_level:) nach alert_state
+    und löscht sie anschließend. Läuft nur, solange solche Zeilen existieren.
+    """
+    rows = con.execute(
+        "SELECT key, value FROM state "
+        "WHERE key LIKE 'armed:%' OR key LIKE 'below_since:%' OR key LIKE 'last_level:%'"
+    ).fetchall()
+    if not rows:
+        return
+
+    states: Dict[Tuple[str, str, int], AlertState] = {}
+    last_levels: Dict[Tuple[str, str], int] = {}
+    for key, value in rows:
+        kind, rest = key.split(":", 1)
+        value = str(value or "").strip()
+        if kind == "last_level":
+            station_no, _, param = rest.rpartition(":")
+            lvl = _parse_int_or_none(value)
+            if station_no and lvl is not None:
+                last_levels[(station_no, param)] = lvl
+            continue
+        parts = rest.rsplit(":", 2)
+        if len(parts) != 3 or _parse_int_or_none(parts[2]) is None:
+            continue
+        st = states.setdefault((parts[0], parts[1], int(parts[2])), AlertState())
+        if kind == "armed" and value:
+            st.armed = value.lower() in ("1", "true", "yes", "y", "on")
+        elif kind == "below_since" and value:
+            dt = _to_dt(value)
+            st.below_since = int(dt.timestamp()) if dt else None
+
+    for (station_no, param), lvl in last_levels.items():
+        matched = [st for (no, p, _), st in states.items() if no == station_no and p == param]
+        if not matched:
+            matched = [states.setdefault((station_no, param, 0), AlertState())]
+        for st in matched:
+            st.last_level = lvl
+
+    con.executemany(
+        "INSERT OR REPLACE INTO alert_state(station_no, parameter, threshold_idx, armed, below_since, last_alert_at, last_level) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(no, p, idx, *st.to_row()) for (no, p, idx), st in states.items()],
+    )
+    con.execute("DELETE FROM state WHERE key LIKE 'armed:%' OR key LIKE 'below_since:%' OR key LIKE 'last_level:%'")
+
+
+def _table_exists(con: sqlite3.Connection, table: str) -> bool:
+    row = con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    return row is not None
+
+
+def _migrate_measurements_legacy(con: sqlite3.Connection) -> None:
+    """
+    Überführt die alte measurements-Tabelle (Text-Spalten pro Zeile, ISO-Zeitstempel als Schlüssel)
+    in das kompakte Schema: stations/parameters + measurements(station_pk, param_pk, ts epoch).
+    Läuft in einer Transaktion; bei Abbruch bleibt die alte Tabelle unverändert.
+    """
+    # ältere Versionen hatten noch nicht alle Spalten
+    cols = _table_columns(con, "measurements")
+    for col in ("station_id_public", "station_name", "source", "unit"):
+        if col not in cols:
+            con.execute(f"ALTER TABLE measurements ADD COLUMN {col} TEXT")
+    if "level" not in cols:
+        con.execute("ALTER TABLE measurements ADD COLUMN level INTEGER")
+
+    con.execute("ALTER TABLE measurements RENAME TO measurements_legacy")
+    _create_measurement_tables(con)
+    con.execute(
+        """
+        INSERT OR IGNORE INTO stations(station_no, station_id_public, station_name, source)
+        SELECT station_no, MAX(station_id_public), MAX(station_name), MAX(source)
+        FROM measurements_legacy GROUP BY station_no
+        """
+    )
+    con.execute(
+        """
+        INSERT OR IGNORE INTO parameters(name, unit)
+        SELECT parameter, MAX(unit) FROM measurements_legacy GROUP BY parameter
+        """
+    )
+    con.execute(
+        """
+        INSERT OR IGNORE INTO measurements(station_pk, param_pk, ts, value, level)
+        SELECT s.station_pk, p.param_pk, CAST(strftime('%s', l.ts) AS INTEGER), l.value, l.level
+        FROM measurements_legacy l
+        JOIN stations s ON s.station_no = l.station_no
+        JOIN parameters p ON p.name = l.parameter
+        WHERE strftime('%s', l.ts) IS NOT NULL
+        """
+    )
+    con.execute("DROP TABLE measurements_legacy")
+
+
+def _create_measurement_tables(con: sqlite3.Connection) -> None:
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stations (
+            station_pk        INTEGER PRIMARY KEY,
+            station_no        TEXT NOT NULL UNIQUE,
+            station_id_public TEXT,
+            station_name      TEXT,
+            source            TEXT
+        )
+        """
+    )
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS parameters (
+            param_pk INTEGER PRIMARY KEY,
+            name     TEXT NOT NULL UNIQUE,
+            unit     TEXT
+        )
+        """
+    )
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS measurements (
+            station_pk INTEGER NOT NULL,
+            param_pk   INTEGER NOT NULL,
+            ts         INTEGER NOT NULL,  -- epoch s (UTC)
+            value      REAL NOT NULL,
+            level      INTEGER,
+            PRIMARY KEY (station_pk, param_pk, ts)
+        ) WITHOUT ROWID
+        """
+    )
+    # lesbare Sicht für Auswertungen von Hand (entspricht dem alten Tabellenlayout)
+    con.execute(
+        """
+        CREATE VIEW IF NOT EXISTS measurements_view AS
+        SELECT s.station_no, s.station_id_public, s.station_name, p.name AS parameter,
+               m.ts, datetime(m.ts, 'unixepoch') AS ts_utc, m.value, m.level, s.source, p.unit
+        FROM measurements m
+        JOIN stations s ON s.station_pk = m.station_pk
+        JOIN parameters p ON p.param_pk = m.param_pk
+        """
+    )
+
+
+ROLLUP_TABLES: Tuple[Tuple[str, int], ...] = (("measurements_hourly", 3600), ("measurements_daily", 86400))
+
+
+def _create_rollup_tables(con: sqlite3.Connection) -> None:
+    """
+    Verdichtete Werte je Stunde/Tag (UTC): Anzahl, Min, Max, Summe (Mittel = v_sum / n) und letzter Wert.
+    Tage sind UTC-Tage, d.h. in Hessen 01:00-01:00 (Sommerzeit 02:00-02:00) Ortszeit; history und
+    export geben sie deshalb als UTC-Datum aus.
+    Gepflegt per Trigger beim Einfügen in measurements, also inkrementell und nur für tatsächlich
+    neue Zeilen (INSERT OR IGNORE-Dubletten lösen keinen Trigger aus). Beim ersten Anlegen werden
+    vorhandene Messwerte einmalig verdichtet.
+    """
+    for table, width in ROLLUP_TABLES:
+        exists = _table_exists(con, table)
         con.execute(
-            """
-            CREATE TABLE IF NOT EXISTS measurements (
-                station_no TEXT NOT NULL,
-                station_id_public TEXT,
-                station_name TEXT,
-                parameter  TEXT NOT NULL,
-                ts         TEXT NOT NULL,
-                value      REAL NOT NULL,
-                level      INTEGER,
-                source     TEXT,
-                unit       TEXT,
-                PRIMARY KEY (station_no, parameter, ts)
-            )
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                station_pk INTEGER NOT NULL,
+                param_pk   INTEGER NOT NULL,
+                bucket     INTEGER NOT NULL,  -- epoch s, Beginn des Intervalls (UTC)
+                n          INTEGER NOT NULL,
+                v_min      REAL NOT NULL,
+                v_max      REAL NOT NULL,
+                v_sum      REAL NOT NULL,
+                last_ts    INTEGER NOT NULL,
+                v_last     REAL NOT NULL,
+                PRIMARY KEY (station_pk, param_pk, bucket)
+            ) WITHOUT ROWID
             """
         )
+        if not exists:
+            # v_last über den Primärschlüssel (station_pk, param_pk, last_ts), nicht als bare column
+            con.execute(
+                f"""
+                INSERT INTO {table}(station_pk, param_pk, bucket, n, v_min, v_max, v_sum, last_ts, v_last)
+                SELECT g.station_pk, g.param_pk, g.bucket, g.n, g.v_min, g.v_max, g.v_sum, g.last_ts, m.value
+                FROM (
+                    SELECT station_pk, param_pk, ts - ts % {width} AS bucket, COUNT(*) AS n, MIN(value) AS v_min,
+                           MAX(value) AS v_max, SUM(value) AS v_sum, MAX(ts) AS last_ts
+                    FROM measurements GROUP BY station_pk, param_pk, ts - ts % {width}
+                ) g
+                JOIN measurements m ON m.station_pk = g.station_pk AND m.param_pk = g.param_pk AND m.ts = g.last_ts
+                """
+            )
         con.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_rollup AFTER INSERT ON measurements
+            BEGIN
+                INSERT INTO {table}(station_pk, param_pk, bucket, n, v_min, v_max, v_sum, last_ts, v_last)
+                VALUES (NEW.station_pk, NEW.param_pk, NEW.ts - NEW.ts % {width}, 1, NEW.value, NEW.value, NEW.value, NEW.ts, NEW.value)
+                ON CONFLICT(station_pk, param_pk, bucket) DO UPDATE SET
+                    n = n + 1,
+                    v_min = MIN(v_min, excluded.v_min),
+                    v_max = MAX(v_max, excluded.v_max),
+                    v_sum = v_sum + excluded.v_sum,
+                    v_last = CASE WHEN excluded.last_ts >= last_ts THEN excluded.v_last ELSE v_last END,
+                    last_ts = MAX(last_ts, excluded.last_ts);
+            END
             """
-            CREATE TABLE IF NOT EXISTS state (
-                key   TEXT PRIMARY KEY,
-                value TEXT NOT NULL
+        )
+
+
+def _init_schema(con: sqlite3.Connection) -> None:
+    """Tabellen anlegen und Migrationen ausführen (einmal pro Prozess bzw. Verbindung)."""
+    migrated = False
+    if _table_exists(con, "measurements") and "station_no" in _table_columns(con, "measurements"):
+        con.execute("BEGIN IMMEDIATE")
+        _migrate_measurements_legacy(con)
+        con.commit()
+        migrated = True
+    _create_measurement_tables(con)
+    _create_rollup_tables(con)
+
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS state (
+            key   TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        """
+    )
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS alert_state (
+            station_no    TEXT NOT NULL,
+            parameter     TEXT NOT NULL,
+            threshold_idx INTEGER NOT NULL,
+            armed         INTEGER,  -- NULL = noch nie ausgewertet (alert_on_start)
+            below_since   INTEGER,  -- epoch s, seit wann durchgehend unterhalb (nur wenn disarmed)
+            last_alert_at INTEGER,  -- epoch s, letzter Alarm für diese Schwelle
+            last_level    INTEGER,  -- zuletzt berechnete Warnstufe der Station
+            PRIMARY KEY (station_no, parameter, threshold_idx)
+        ) WITHOUT ROWID
+        """
+    )
+    _migrate_state_rows(con)
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id              INTEGER PRIMARY KEY,
+            created_at      INTEGER NOT NULL,  -- epoch s, Zeitpunkt des Alarms
+            recipients      TEXT,              -- Empfänger beim Einreihen (NULL = email.to)
+            subject         TEXT NOT NULL,
+            body            TEXT NOT NULL,
+            attempts        INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at INTEGER NOT NULL,  -- epoch s, frühester nächster Versuch
+            last_error      TEXT
+        )
+        """
+    )
+    if "recipients" not in _table_columns(con, "outbox"):
+        con.execute("ALTER TABLE outbox ADD COLUMN recipients TEXT")
+    con.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox(next_attempt_at)")
+    con.commit()
+
+    if migrated:
+        # Platz der alten Tabelle freigeben
+        con.execute("VACUUM")
+
+
+def open_db(db_path: Path, journal_mode: str = "wal") -> sqlite3.Connection:
+    """
+    Öffnet die DB mit den Pragmas für den Dauerbetrieb:
+    - WAL: Leser (Export, Status-Anzeige) blockieren den Poller nicht und umgekehrt
+    - synchronous=NORMAL: im WAL-Modus sicher gegen Absturz der Anwendung, deutlich weniger fsyncs
+    - cache_size: ~8 MiB Page-Cache statt 2 MiB Default
+    """
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(db_path, timeout=30)
+    con.execute(f"PRAGMA journal_mode={journal_mode}")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("PRAGMA cache_size=-8192")
+    return con
+
+
+class Storage:
+    """
+    Eine SQLite-Verbindung pro Prozess; Schema und Migrationen nur beim Öffnen.
+    Hält die Dimensionstabellen (stations/parameters) im Speicher, damit das Schreiben
+    von Messwerten im Normalfall keine zusätzlichen Abfragen braucht.
+    """
+
+    def __init__(self, db_path: Path, journal_mode: str = "wal"):
+        self.db_path = db_path
+        self.con = open_db(db_path, journal_mode)
+        _init_schema(self.con)
+        self._load_dimensions()
+
+    def _load_dimensions(self) -> None:
+        self._stations: Dict[str, Tuple[int, Tuple[Any, ...]]] = {
+            no: (pk, (sid, name, source))
+            for pk, no, sid, name, source in self.con.execute(
+                "SELECT station_pk, station_no, station_id_public, station_name, source FROM stations"
             )
+        }
+        self._params: Dict[str, Tuple[int, Any]] = {
+            name: (pk, unit) for pk, name, unit in self.con.execute("SELECT param_pk, name, unit FROM parameters")
+        }
+
+    def station_pk(self, station_no: str, station_id_public: str, station_name: str, source: str) -> int:
+        """station_pk zur station_no; legt die Station an bzw. aktualisiert geänderte Stammdaten."""
+        meta = (station_id_public, station_name, source)
+        cached = self._stations.get(station_no)
+        if cached is not None and cached[1] == meta:
+            return cached[0]
+        self.con.execute(
             """
+            INSERT INTO stations(station_no, station_id_public, station_name, source) VALUES (?, ?, ?, ?)
+            ON CONFLICT(station_no) DO UPDATE SET
+                station_id_public = excluded.station_id_public,
+                station_name = excluded.station_name,
+                source = excluded.source
+            """,
+            (station_no, *meta),
+        )
+        pk = self.con.execute("SELECT station_pk FROM stations WHERE station_no = ?", (station_no,)).fetchone()[0]
+        self._stations[station_no] = (pk, meta)
+        return pk
+
+    def param_pk(self, name: str, unit: str) -> int:
+        """param_pk zum Parameternamen (z.B. W); legt den Parameter bei Bedarf an."""
+        cached = self._params.get(name)
+        if cached is not None and (cached[1] == unit or not unit):
+            return cached[0]
+        self.con.execute(
+            "INSERT INTO parameters(name, unit) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET unit = excluded.unit",
+            (name, unit),
         )
+        pk = self.con.execute("SELECT param_pk FROM parameters WHERE name = ?", (name,)).fetchone()[0]
+        self._params[name] = (pk, unit)
+        return pk
 
-        cols = _table_columns(con, "measurements")
-        migrations = [
-            ("station_id_public", "ALTER TABLE measurements ADD COLUMN station_id_public TEXT"),
-            ("station_name", "ALTER TABLE measurements ADD COLUMN station_name TEXT"),
-            ("level", "ALTER TABLE measurements ADD COLUMN level INTEGER"),
-            ("source", "ALTER TABLE measurements ADD COLUMN source TEXT"),
-            ("unit", "ALTER TABLE measurements ADD COLUMN unit TEXT"),
-        ]
-        for col, ddl in migrations:
-            if col not in cols:
-                con.execute(ddl)
+    def rollback(self) -> None:
+        """Rollback inkl. Neuladen der Dimensions-Caches (sonst blieben zurückgerollte PKs im Speicher)."""
+        self.con.rollback()
+        self._load_dimensions()
 
-        con.commit()
+    def lookup_station_pk(self, station_no: str) -> Optional[int]:
+        cached = self._stations.get(station_no)
+        return cached[0] if cached else None
+
+    def lookup_param_pk(self, name: str) -> Optional[int]:
+        cached = self._params.get(name)
+        return cached[0] if cached else None
+
+    def lookup_param_unit(self, name: str) -> str:
+        cached = self._params.get(name)
+        return (cached[1] or "") if cached else ""
+
+    def close(self) -> None:
+        self.con.close()
+
+
+def init_db(db_path: Path) -> None:
+    Storage(db_path).close()
 
 
 def db_get_state(con: sqlite3.Connection, key: str) -> Optional[str]:
@@ -475,11 +1047,304 @@ def db_set_state(con: sqlite3.Connection, key: str, value: str) -> None:
     )
 
 
+@dataclass
+class AlertState:
+    """Zustand einer Schwelle (Zeile in alert_state)."""
+    armed: Optional[bool] = None
+    below_since: Optional[int] = None
+    last_alert_at: Optional[int] = None
+    last_level: Optional[int] = None
+
+    def to_row(self) -> Tuple[Optional[int], Optional[int], Optional[int], Optional[int]]:
+        armed = None if self.armed is None else int(self.armed)
+        return armed, self.below_since, self.last_alert_at, self.last_level
+
+
+class AlertStateCache:
+    """
+    Alarm-Zustand aller Schwellen: einmal mit einer Abfrage aus alert_state laden, im Speicher
+    fortschreiben (im Daemon über alle Zyklen) und nach jedem Zyklus nur geänderte Zeilen mit
+    einem executemany zurückschreiben. Verglichen werden nur die seit dem letzten flush abgefragten
+    Zeilen, der Aufwand hängt also an der Zahl neuer Messwerte, nicht an der Zahl der Stationen.
+    """
+
+    def __init__(self, states: Dict[Tuple[str, str, int], AlertState]):
+        self._states = states
+        self._loaded = {k: v.to_row() for k, v in states.items()}
+        self._touched: Set[Tuple[str, str, int]] = set()
+
+    @classmethod
+    def load(cls, con: sqlite3.Connection) -> "AlertStateCache":
+        cur = con.execute(
+            "SELECT station_no, parameter, threshold_idx, armed, below_since, last_alert_at, last_level FROM alert_state"
+        )
+        states = {
+            (no, param, idx): AlertState(
+                armed=None if armed is None else bool(armed),
+                below_since=below_since,
+                last_alert_at=last_alert_at,
+                last_level=last_level,
+            )
+            for no, param, idx, armed, below_since, last_alert_at, last_level in cur.fetchall()
+        }
+        return cls(states)
+
+    def get(self, station_no: str, parameter: str, threshold_idx: int) -> AlertState:
+        key = (station_no, parameter, threshold_idx)
+        self._touched.add(key)
+        st = self._states.get(key)
+        if st is None:
+            st = self._states[key] = AlertState()
+        return st
+
+    def flush(self, con: sqlite3.Connection) -> int:
+        """Schreibt geänderte Zeilen (ohne Commit). Rückgabe: Anzahl geschriebener Zeilen."""
+        changed = []
+        for key in self._touched:
+            row = self._states[key].to_row()
+            if self._loaded.get(key) != row:
+                changed.append((*key, *row))
+        self._touched.clear()
+        if not changed:
+            return 0
+        con.executemany(
+            """
+            INSERT INTO alert_state(station_no, parameter, threshold_idx, armed, below_since, last_alert_at, last_level)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(station_no, parameter, threshold_idx) DO UPDATE SET
+                armed = excluded.armed,
+                below_since = excluded.below_since,
+                last_alert_at = excluded.last_alert_at,
+                last_level = excluded.last_level
+            """,
+            changed,
+        )
+        self._loaded.update({(r[0], r[1], r[2]): r[3:] for r in changed})
+        return len(changed)
+
+    def forget(self, con: sqlite3.Connection, station_no: str, parameter: str, indices: Optional[Iterable[int]] = None) -> None:
+        """
+        Zustand einer Station (nur die Schwellen-Indizes in indices, None = alle) verwerfen, im
+        Speicher und in alert_state (ohne Commit). Danach verhält sich die Schwelle wie neu konfiguriert.
+        """
+        keys = [k for k in self._states if k[0] == station_no and k[1] == parameter and (indices is None or k[2] in indices)]
+        for key in keys:
+            del self._states[key]
+            self._loaded.pop(key, None)
+            self._touched.discard(key)
+        _delete_alert_state(con, station_no, parameter, indices)
+
+
+def _delete_alert_state(con: sqlite3.Connection, station_no: str, parameter: str, indices: Optional[Iterable[int]]) -> None:
+    if indices is None:
+        con.execute("DELETE FROM alert_state WHERE station_no = ? AND parameter = ?", (station_no, parameter))
+    else:
+        con.executemany(
+            "DELETE FROM alert_state WHERE station_no = ? AND parameter = ? AND threshold_idx = ?",
+            [(station_no, parameter, idx) for idx in indices],
+        )
+
+
 def _debug_print(settings: Settings, msg: str) -> None:
     if settings.debug:
         print(msg)
 
 
+def _metric_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    esc = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, esc)) + "}"
+
+
+class Metrics:
+    """
+    Zähler, Gauges und Histogramme im Speicher (thread-sicher, je Aktualisierung nur ein kurzer Lock),
+    Ausgabe im Prometheus-Textformat. Zusätzlich die Phasen-Dauern des laufenden Zyklus für die
+    JSON-Zeile pro Zyklus (end_cycle).
+    render() liefert den Stand des letzten abgeschlossenen Zyklus bzw. Versands und formatiert nur
+    nach publish() neu; Abrufe zwischen zwei Zyklen kosten den Abfrage-Thread damit praktisch nichts.
+    """
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    HELP = {
+        "pegel_phase_seconds": ("histogram", "Dauer der Phasen eines Zyklus (fetch = http + decode, index, evaluate, commit, send)"),
+        "pegel_cycles_total": ("counter", "Abfrage-Zyklen nach Ergebnis (ok, not_modified, error)"),
+        "pegel_fetch_failures_total": ("counter", "Fehlgeschlagene oder zu langsame Abrufe je Quelle"),
+        "pegel_source_fetch_seconds": ("gauge", "Dauer bis zur Antwort je Quelle im letzten Zyklus"),
+        "pegel_new_samples_total": ("counter", "Neue Messwerte (ausgewertet und gespeichert)"),
+        "pegel_alerts_total": ("counter", "Eingereihte Alarme nach Art (threshold, rise)"),
+        "pegel_mails_sent_total": ("counter", "Versendete Mails"),
+        "pegel_mail_failures_total": ("counter", "Fehlgeschlagene Versandversuche"),
+        "pegel_data_age_seconds": ("gauge", "Alter des letzten Messwerts je Station/Parameter (jetzt - Messzeitpunkt)"),
+        "pegel_station_level": ("gauge", "Aktuelle Warnstufe je Station/Parameter"),
+        "pegel_last_cycle_timestamp_seconds": ("gauge", "Ende des letzten Zyklus (epoch s)"),
+    }
+
+    def __init__(self, json_path: Optional[Path] = None):
+        self.json_path = json_path
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._gauges: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._hists: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}  # Buckets..., sum, count
+        self._cycle: Dict[str, float] = {}
+        self.last_cycle_phases: Dict[str, float] = {}  # Phasen-Dauern des zuletzt abgeschlossenen Zyklus
+        self._version = 0
+        self._rendered: Tuple[int, str] = (-1, "")
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def set_many(self, name: str, values: Dict[Tuple[Tuple[str, str], ...], float]) -> None:
+        """Mehrere Gauges unter einem Lock setzen (z.B. ein Wert je Station); Schlüssel = sortierte Labels."""
+        with self._lock:
+            for labels, v in values.items():
+                self._gauges[(name, labels)] = v
+
+    def forget(self, **labels: str) -> None:
+        """Gauges mit allen angegebenen Labels entfernen (z.B. einer Station, die nicht mehr konfiguriert ist)."""
+        wanted = set(labels.items())
+        with self._lock:
+            for key in [k for k in self._gauges if wanted <= set(k[1])]:
+                del self._gauges[key]
+            self._version += 1
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        idx = bisect.bisect_left(self.BUCKETS, value)
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = [0.0] * (len(self.BUCKETS) + 2)
+            if idx < len(self.BUCKETS):
+                h[idx] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def record_phase(self, name: str, seconds: float) -> None:
+        """Dauer einer Phase: Histogramm pegel_phase_seconds + Summe für die JSON-Zeile des Zyklus."""
+        self.observe("pegel_phase_seconds", seconds, phase=name)
+        with self._lock:
+            self._cycle[name] = self._cycle.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(name, time.perf_counter() - t0)
+
+    def publish(self) -> None:
+        """Aktuellen Stand für den nächsten render() freigeben."""
+        with self._lock:
+            self._version += 1
+
+    def end_cycle(self, status: str, **fields: Any) -> None:
+        """Zyklus abschließen: Zähler/Zeitstempel setzen, veröffentlichen und ggf. eine JSON-Zeile anhängen."""
+        now = time.time()
+        self.inc("pegel_cycles_total", status=status)
+        self.set("pegel_last_cycle_timestamp_seconds", now)
+        with self._lock:
+            phases, self._cycle = self._cycle, {}
+            self.last_cycle_phases = phases
+            self._version += 1
+        if self.json_path is None:
+            return
+        line = {"ts": round(now, 3), "status": status, "phases": {k: round(v, 6) for k, v in phases.items()}, **fields}
+        try:
+            with self.json_path.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"Metriken: JSON-Zeile konnte nicht geschrieben werden: {e}", file=sys.stderr)
+
+    def render(self) -> str:
+        """Prometheus-Textformat (Version 0.0.4)."""
+        with self._lock:
+            version, cached = self._rendered
+            if version == self._version:
+                return cached
+            version = self._version
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            hists = {k: list(v) for k, v in self._hists.items()}
+        lines: List[str] = []
+        for name in sorted({k[0] for k in counters} | {k[0] for k in gauges} | {k[0] for k in hists}):
+            kind, help_text = self.HELP.get(name, ("untyped", name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (n, labels), v in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{_metric_labels(labels)} {v:g}")
+            for (n, labels), v in sorted(gauges.items()):
+                if n == name:
+                    lines.append(f"{name}{_metric_labels(labels)} {v:g}")
+            for (n, labels), h in sorted(hists.items()):
+                if n != name:
+                    continue
+                cumulative = 0.0
+                for bound, c in zip(self.BUCKETS, h):
+                    cumulative += c
+                    lines.append(f"{name}_bucket{_metric_labels(labels + (('le', f'{bound:g}'),))} {cumulative:g}")
+                lines.append(f"{name}_bucket{_metric_labels(labels + (('le', '+Inf'),))} {h[-1]:g}")
+                lines.append(f"{name}_sum{_metric_labels(labels)} {h[-2]:g}")
+                lines.append(f"{name}_count{_metric_labels(labels)} {h[-1]:g}")
+        text = "\n".join(lines) + "\n"
+        with self._lock:
+            if version >= self._rendered[0]:
+                self._rendered = (version, text)
+        return text
+
+
+class MetricsServer:
+    """
+    Lokaler HTTP-Endpunkt /metrics (Prometheus) in einem eigenen Thread. Liest nur einen
+    Schnappschuss von Metrics (kurzer Lock), die Abfrageschleife wird dadurch nicht aufgehalten.
+    """
+
+    def __init__(self, metrics: Metrics, listen: str):
+        host, port = listen.rsplit(":", 1)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # abgebrochene Abrufe (BrokenPipe/ConnectionReset) nicht als Traceback ausgeben
+                if not isinstance(sys.exc_info()[1], ConnectionError):
+                    super().handle_error(request, client_address)
+
+        self._httpd = Server((host or "127.0.0.1", int(port)), Handler)
+        self.address = self._httpd.server_address
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
 def _to_dt(ts: Any) -> Optional[datetime]:
     if ts is None:
         return None
@@ -537,53 +1402,711 @@ def _compute_level(value: float, thresholds: Tuple[float, ...]) -> int:
             break
     return level
 
-def fetch_index(settings: Settings) -> List[dict]:
+
+def classify_levels(values: Sequence[float], thresholds: Tuple[float, ...]) -> List[int]:
+    """
+    Batch-Variante von _compute_level für viele Werte mit denselben (aufsteigenden) Schwellen:
+    Warnstufe = Anzahl Schwellen <= Wert, per numpy.searchsorted bzw. bisect ohne NumPy.
+    NaN ergibt wie bei _compute_level Stufe 0.
+    """
+    if np is not None:
+        v = np.asarray(values, dtype=np.float64)
+        levels = np.searchsorted(np.asarray(thresholds, dtype=np.float64), v, side="right")
+        levels[np.isnan(v)] = 0
+        return levels.tolist()
+    return [bisect.bisect_right(thresholds, v) if v == v else 0 for v in values]
+
+
+def threshold_matrix(thresholds: Sequence[Tuple[float, ...]]) -> List[List[float]]:
+    """Schwellen mehrerer Stationen als Matrix (Zeile je Station), kürzere Zeilen mit +inf aufgefüllt."""
+    width = max((len(t) for t in thresholds), default=0)
+    return [list(t) + [float("inf")] * (width - len(t)) for t in thresholds]
+
+
+def classify_levels_matrix(values: Sequence[float], station_idx: Sequence[int], matrix: List[List[float]]) -> List[int]:
+    """
+    Warnstufen für Werte verschiedener Stationen in einem Durchlauf: values[i] gehört zur Station
+    station_idx[i], deren Schwellen in Zeile matrix[station_idx[i]] stehen (siehe threshold_matrix).
+    Mit NumPy vollständig vektorisiert (Vergleich gegen die Schwellenzeile, je Wert höchstens 4 Spalten).
+    """
+    if np is not None:
+        v = np.asarray(values, dtype=np.float64)
+        rows = np.asarray(matrix, dtype=np.float64)[np.asarray(station_idx, dtype=np.intp)]
+        return (v[:, None] >= rows).sum(axis=1).tolist()
+    return [bisect.bisect_right(matrix[i], v) if v == v else 0 for v, i in zip(values, station_idx)]
+
+
+TREND_ALERT_IDX = -1  # threshold_idx in alert_state für den Alarm "schneller Anstieg"
+
+
+class TrendWindow:
+    """
+    Ringpuffer fester Größe (array('d')) mit den letzten Messwerten einer Station.
+    Die Summen für die lineare Regression (Werte und ln(Werte) für die exponentielle Prognose)
+    werden je neuem Wert in O(1) fortgeschrieben (neuen Wert addieren, verdrängten abziehen). Zeiten in Stunden relativ zu einem Ursprung,
+    damit die Quadratsummen klein bleiben; nach jeweils `capacity` Werten werden Ursprung und
+    Summen einmal aus dem Puffer neu berechnet (begrenzt Rundungsfehler, amortisiert O(1)).
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.count = 0
+        self._ts = array("d", [0.0]) * capacity
+        self._v = array("d", [0.0]) * capacity
+        self._head = 0  # nächste Schreibposition
+        self._origin = 0.0
+        self._since_rebase = 0
+        self._sx = self._sy = self._sxx = self._sxy = 0.0
+        self._sl = self._sxl = 0.0  # Summen über ln(Wert), nur für Werte > 0
+        self._nonpos = 0            # Werte <= 0 im Fenster (dann keine exponentielle Prognose)
+
+    def _add(self, x: float, y: float, sign: float) -> None:
+        self._sx += sign * x
+        self._sy += sign * y
+        self._sxx += sign * x * x
+        self._sxy += sign * x * y
+        if y > 0:
+            ly = math.log(y)
+            self._sl += sign * ly
+            self._sxl += sign * x * ly
+        else:
+            self._nonpos += int(sign)
+
+    def _at(self, k: int) -> int:
+        """Pufferposition des k-ten Werts (0 = ältester)."""
+        return (self._head - self.count + k) % self.capacity
+
+    @property
+    def last_ts(self) -> Optional[float]:
+        return self._ts[self._at(self.count - 1)] if self.count else None
+
+    def push(self, ts: int, value: float) -> bool:
+        """Neuen Wert anhängen. Werte, die nicht neuer als der letzte sind, werden ignoriert (False)."""
+        if self.count:
+            if ts <= self._ts[self._at(self.count - 1)]:
+                return False
+        else:
+            self._origin = float(ts)
+        i = self._head
+        if self.count == self.capacity:
+            self._add((self._ts[i] - self._origin) / 3600.0, self._v[i], -1.0)
+        else:
+            self.count += 1
+        self._ts[i] = ts
+        self._v[i] = value
+        self._add((ts - self._origin) / 3600.0, value, 1.0)
+        self._head = (i + 1) % self.capacity
+        self._since_rebase += 1
+        if self._since_rebase >= self.capacity:
+            self._rebase()
+        return True
+
+    def _rebase(self) -> None:
+        self._origin = self._ts[self._at(0)]
+        self._sx = self._sy = self._sxx = self._sxy = 0.0
+        self._sl = self._sxl = 0.0
+        self._nonpos = 0
+        for k in range(self.count):
+            i = self._at(k)
+            self._add((self._ts[i] - self._origin) / 3600.0, self._v[i], 1.0)
+        self._since_rebase = 0
+
+    def slope(self) -> Optional[float]:
+        """Regressionsgerade über das Fenster: Steigung in Einheit/Stunde (None bei < 2 Werten)."""
+        n = self.count
+        if n < 2:
+            return None
+        den = n * self._sxx - self._sx * self._sx
+        if den <= 1e-12:
+            return None
+        return (n * self._sxy - self._sx * self._sy) / den
+
+    def log_slope(self) -> Optional[float]:
+        """Steigung von ln(Wert) je Stunde (exponentielles Modell), None bei Werten <= 0 im Fenster."""
+        n = self.count
+        if n < 2 or self._nonpos:
+            return None
+        den = n * self._sxx - self._sx * self._sx
+        if den <= 1e-12:
+            return None
+        return (n * self._sxl - self._sx * self._sl) / den
+
+    @property
+    def last_value(self) -> Optional[float]:
+        return self._v[self._at(self.count - 1)] if self.count else None
+
+    def hours_to(self, target: float, method: str = "linear") -> Optional[float]:
+        """
+        Geschätzte Stunden ab dem letzten Messwert, bis target erreicht wird (0 = bereits erreicht).
+        linear: Regressionsgerade; exponential: Regression über ln(Wert), ohne gültige Werte linear.
+        None, wenn der Trend nicht steigt.
+        """
+        v = self.last_value
+        if v is None:
+            return None
+        if v >= target:
+            return 0.0
+        if method == "exponential" and v > 0:
+            g = self.log_slope()
+            if g is not None:
+                return math.log(target / v) / g if g > 0 else None
+        b = self.slope()
+        if b is None or b <= 0:
+            return None
+        return (target - v) / b
+
+    def rise_rate(self) -> Optional[float]:
+        """Anstieg zwischen den letzten beiden Werten in Einheit/Stunde."""
+        if self.count < 2:
+            return None
+        a, b = self._at(self.count - 2), self._at(self.count - 1)
+        return (self._v[b] - self._v[a]) * 3600.0 / (self._ts[b] - self._ts[a])
+
+    def span_hours(self) -> float:
+        if self.count < 2:
+            return 0.0
+        return (self._ts[self._at(self.count - 1)] - self._ts[self._at(0)]) / 3600.0
+
+
+class TrendTracker:
+    """
+    Trendfenster aller Stationen (Anstiegsalarm und Prognose).
+    Beim Start einmal aus measurements aufgebaut (je Station die letzten window_size Werte),
+    danach nur noch mit den neuen Werten der Zyklen fortgeschrieben.
+    """
+
+    def __init__(self, windows: Dict[Tuple[str, str], TrendWindow]):
+        self._windows = windows
+
+    @classmethod
+    def load(cls, settings: Settings, storage: "Storage") -> "TrendTracker":
+        tracker = cls({})
+        for station in settings.stations:
+            tracker.add(settings, storage, station)
+        return tracker
+
+    def add(self, settings: Settings, storage: "Storage", station: StationConfig) -> None:
+        """Fenster einer Station aus den letzten window_size gespeicherten Werten aufbauen."""
+        w = self._windows[(station.station_no, station.parameter)] = TrendWindow(settings.trend_window_size)
+        station_pk = storage.lookup_station_pk(station.station_no)
+        param_pk = storage.lookup_param_pk(station.parameter)
+        if station_pk is None or param_pk is None:
+            return
+        rows = storage.con.execute(
+            "SELECT ts, value FROM measurements WHERE station_pk = ? AND param_pk = ? ORDER BY ts DESC LIMIT ?",
+            (station_pk, param_pk, settings.trend_window_size),
+        ).fetchall()
+        for ts, value in reversed(rows):
+            w.push(ts, value)
+
+    def remove(self, station_no: str, parameter: str) -> None:
+        self._windows.pop((station_no, parameter), None)
+
+    def get(self, station: StationConfig) -> Optional[TrendWindow]:
+        return self._windows.get((station.station_no, station.parameter))
+
+
+def _normalize_station_name(name: Any) -> str:
+    """Stationsname für Lookups: ohne Groß/Klein, einheitliche Bindestriche, Whitespace zusammengefasst."""
+    s = str(name or "").casefold()
+    s = re.sub(r"[\u2010-\u2015]", "-", s)
+    s = re.sub(r"\s*-\s*", " - ", s)
+    return " ".join(s.split())
+
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """
+    Inkrementeller Parser für ein JSON-Array auf Top-Level (UTF-8-Bytes in beliebigen Stücken).
+    Liefert Element für Element; im Speicher liegt nie mehr als ein Chunk plus ein Element.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    it = iter(chunks)
+    buf = ""
+    pos = 0
+    eof = False
+    state = "start"  # start -> first -> (value -> sep)* -> "]"
+
+    def read_more() -> None:
+        nonlocal buf, pos, eof
+        chunk = next(it, None)
+        buf = buf[pos:]
+        pos = 0
+        if chunk is None:
+            eof = True
+            buf += utf8.decode(b"", final=True)
+        else:
+            buf += utf8.decode(chunk)
+
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n":
+            pos += 1
+        if pos >= len(buf):
+            if eof:
+                raise RuntimeError("index.json unvollständig (Array nicht abgeschlossen).")
+            read_more()
+            continue
+
+        c = buf[pos]
+        if state == "start":
+            if c != "[":
+                raise RuntimeError("index.json hat unerwartete Struktur (kein Array).")
+            pos += 1
+            state = "first"
+        elif state == "sep":
+            if c == "]":
+                return
+            if c != ",":
+                raise RuntimeError(f"index.json: unerwartetes Zeichen {c!r} zwischen Array-Elementen")
+            pos += 1
+            state = "value"
+        else:
+            if state == "first" and c == "]":
+                return
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                end = -1
+            if end >= 0 and not eof:
+                # Zahlen/Literale enden erst am Trenner: "-2." oder "1e" am Chunk-Ende sind noch nicht fertig
+                nxt = end
+                while nxt < len(buf) and buf[nxt] in " \t\r\n":
+                    nxt += 1
+                if nxt >= len(buf) or buf[nxt] not in ",]":
+                    end = -1
+            if end < 0:
+                # Element (evtl.) abgeschnitten: nächsten Chunk anhängen und erneut versuchen
+                read_more()
+                continue
+            yield obj
+            pos = end
+            state = "sep"
+
+
+def _get_path(obj: Any, path: Tuple[str, ...]) -> Any:
+    """Wert unter einem Pfad aus _json_path (Schlüssel in Objekten, Ziffern als Listenindex); None, wenn nicht vorhanden."""
+    for key in path:
+        if isinstance(obj, dict):
+            obj = obj.get(key)
+        elif isinstance(obj, list) and key.isdigit() and int(key) < len(obj):
+            obj = obj[int(key)]
+        else:
+            return None
+    return obj
+
+
+def normalize_entry(provider: ProviderConfig, item: Any) -> Optional[dict]:
+    """Eintrag einer JSON-Quelle auf das Index-Layout (INDEX_FIELDS) abbilden; None, wenn kein Objekt."""
+    if not isinstance(item, dict):
+        return None
+    out = {key: (_get_path(item, path) if path else None) for key, path in provider.fields}
+    if provider.parameter and not out.get("stationparameter_name"):
+        out["stationparameter_name"] = provider.parameter
+    if provider.unit and not out.get("ts_unitsymbol"):
+        out["ts_unitsymbol"] = provider.unit
+    return out
+
+
+def _station_filter(stations: List[StationConfig]):
+    """Prädikat für Index-Einträge: True, wenn (station_no, parameter), station_id oder Name konfiguriert ist."""
+    wanted_pairs: Set[Tuple[str, str]] = {(s.station_no.strip(), s.parameter.strip()) for s in stations}
+    wanted_ids: Set[str] = {s.station_id_public.strip() for s in stations if s.station_id_public.strip()}
+    wanted_names: Set[str] = {_normalize_station_name(s.name) for s in stations}
+
+    def keep(item: Any) -> bool:
+        if not isinstance(item, dict):
+            return False
+        pair = (str(item.get("station_no", "")).strip(), str(item.get("stationparameter_name", "")).strip())
+        if pair in wanted_pairs:
+            return True
+        if str(item.get("station_id", "")).strip() in wanted_ids:
+            return True
+        return _normalize_station_name(item.get("station_name")) in wanted_names
+
+    return keep
+
+
+class IndexFetcher:
+    """
+    Langlebiger HTTP-Client für die letzten Messwerte einer Quelle (Default: HLNUG layers/10/index.json).
+    - eine requests.Session für alle Daemon-Zyklen (Keep-Alive, Connection-Pooling)
+    - Conditional GET über ETag / Last-Modified: bei 304 liefert fetch() None
+    - optional Streaming-Parse: nur Einträge der Stationen dieser Quelle werden behalten
+    - Quellen vom Typ "json" werden beim Parsen auf das Index-Layout abgebildet (normalize_entry)
+    - mit metrics: Phasen "http" (Warten auf Netz/Server) und "decode" (JSON-Parse) getrennt erfassen
+    """
+
+    local = False  # True: liest ohne Netz (kein Zeitlimit-Thread nötig, siehe SourceFetcher)
+
+    def __init__(
+        self,
+        settings: Settings,
+        url: Optional[str] = None,
+        metrics: Optional["Metrics"] = None,
+        provider: Optional[ProviderConfig] = None,
+    ):
+        self.settings = settings
+        self.provider = provider or settings.providers[HLNUG_PROVIDER]
+        self.url = url or self.provider.url
+        self.metrics = metrics
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self._session: Optional[requests.Session] = None
+        self._keep = _station_filter([s for s in settings.stations if s.source == self.provider.name])
+
+    def session(self) -> requests.Session:
+        """Gemeinsame Session (auch für weitere Abrufe wie das Nachladen von Zeitreihen)."""
+        if self._session is None:
+            session = requests.Session()
+            session.headers.update({"User-Agent": USER_AGENT, "Accept-Encoding": "gzip, deflate"})
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=max(4, self.settings.backfill_workers)
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._session = session
+        return self._session
+
+    def fetch(self) -> Optional[List[dict]]:
+        """Rückgabe: Liste von Dicts oder None, wenn sich der Index seit dem letzten Abruf nicht geändert hat."""
+        headers: Dict[str, str] = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        stream = self.settings.stream_index and not self.provider.items_path
+        t0 = time.perf_counter()
+        r = self.session().get(self.url, timeout=self.provider.timeout_seconds, headers=headers, stream=stream)
+        http_s = time.perf_counter() - t0
+        try:
+            _debug_print(self.settings, f"[DEBUG] GET {self.url} -> {r.status_code}")
+            if r.status_code == 304:
+                self._record(http_s, 0.0)
+                return None
+            r.raise_for_status()
+            t0 = time.perf_counter()
+            if stream:
+                chunks = _TimedChunks(r.iter_content(chunk_size=65536))
+                data = self._parse_stream(chunks)
+                http_s += chunks.seconds
+                decode_s = time.perf_counter() - t0 - chunks.seconds
+            else:
+                # ohne stream hat get() den Body schon vollständig geladen
+                data = self._parse_list(r.json())
+                decode_s = time.perf_counter() - t0
+        finally:
+            if stream:
+                r.close()
+        self._record(http_s, decode_s)
+
+        # Validatoren erst nach erfolgreichem Parse übernehmen, sonst bliebe ein kaputter Stand "unverändert"
+        self.etag = r.headers.get("ETag") or None
+        self.last_modified = r.headers.get("Last-Modified") or None
+        return data
+
+    def forget_validators(self) -> None:
+        """Nächsten Abruf ohne ETag/Last-Modified (vollständige Antwort statt 304)."""
+        self.etag = None
+        self.last_modified = None
+
+    def _parse_stream(self, chunks: Iterable[bytes]) -> List[dict]:
+        total = 0
+        data = []
+        items: Iterable[Any] = iter_json_array(chunks)
+        if self.provider.kind == "json":
+            items = (normalize_entry(self.provider, item) for item in items)
+        for item in items:
+            total += 1
+            if self._keep(item):
+                data.append(item)
+        _debug_print(self.settings, f"[DEBUG] {self.provider.name}: index entries: {total} (behalten: {len(data)})")
+        return data
+
+    def _parse_list(self, data: Any) -> List[dict]:
+        data = _get_path(data, self.provider.items_path)
+        if not isinstance(data, list):
+            where = ".".join(self.provider.items_path) or "Top-Level"
+            raise RuntimeError(f"{self.provider.name}: unerwartete Struktur (kein Array unter {where}).")
+        _debug_print(self.settings, f"[DEBUG] {self.provider.name}: index entries: {len(data)}")
+        if self.provider.kind == "json":
+            data = [e for e in (normalize_entry(self.provider, item) for item in data) if self._keep(e)]
+        return data
+
+    def _record(self, http_s: float, decode_s: float) -> None:
+        if self.metrics is not None:
+            self.metrics.record_phase("http", http_s)
+            if decode_s:
+                self.metrics.record_phase("decode", decode_s)
+
+    def close(self) -> None:
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+class _TimedChunks:
+    """Iterator über Chunks, der die Wartezeit auf das Netz (next()) aufsummiert."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._it = iter(chunks)
+        self.seconds = 0.0
+
+    def __iter__(self) -> "_TimedChunks":
+        return self
+
+    def __next__(self) -> bytes:
+        t0 = time.perf_counter()
+        try:
+            return next(self._it)
+        finally:
+            self.seconds += time.perf_counter() - t0
+
+
+class FileIndexFetcher(IndexFetcher):
+    """
+    Liest index.json aus gespeicherten Dateien statt über HTTP (reproduzierbare Läufe, --replay-index).
+    Jeder Abruf liefert die nächste Datei, nach der letzten wieder die erste.
+    """
+
+    local = True
+
+    def __init__(self, settings: Settings, paths: Sequence[Path], metrics: Optional["Metrics"] = None):
+        super().__init__(settings, paths[0].resolve().as_uri(), metrics)
+        self.paths = list(paths)
+        self._next = 0
+
+    def fetch(self) -> Optional[List[dict]]:
+        path = self.paths[self._next % len(self.paths)]
+        self._next += 1
+        _debug_print(self.settings, f"[DEBUG] Replay {path}")
+        t0 = time.perf_counter()
+        raw = path.read_bytes()
+        read_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        if self.settings.stream_index:
+            data = self._parse_stream([raw])
+        else:
+            data = self._parse_list(json.loads(raw))
+        self._record(read_s, time.perf_counter() - t0)
+        return data
+
+
+def fetch_index(settings: Settings, fetcher: Optional[IndexFetcher] = None) -> Optional[List[dict]]:
     """
     Lädt den aktuellen Index (letzte Messwerte) einmal pro Zyklus.
     Quelle: HLNUG WISKI-Web layers/10/index.json
-    Rückgabe: Liste von Dicts.
+    Rückgabe: Liste von Dicts, oder None bei 304 Not Modified (nur mit langlebigem fetcher möglich).
     """
-    session = requests.Session()
-    session.headers.update({"User-Agent": "pegel-alarm/2.3"})
-    r = session.get(HLNUG_LASTVALUES_INDEX, timeout=settings.request_timeout_seconds)
-    _debug_print(settings, f"[DEBUG] GET {HLNUG_LASTVALUES_INDEX} -> {r.status_code}")
-    r.raise_for_status()
-    data = r.json()
-    if not isinstance(data, list):
-        raise RuntimeError("index.json hat unerwartete Struktur (kein Array).")
-    _debug_print(settings, f"[DEBUG] index entries: {len(data)}")
-    return data
+    if fetcher is not None:
+        return fetcher.fetch()
+    fetcher = IndexFetcher(settings)
+    try:
+        return fetcher.fetch()
+    finally:
+        fetcher.close()
+
 
-def build_index_map(arr: List[dict]) -> Dict[Tuple[str, str], dict]:
+class SourceFetcher:
     """
-    Map: (station_no, parameter) -> item.
+    Abruf aller Quellen, die von den konfigurierten Stationen genutzt werden (je Quelle ein IndexFetcher).
+    Die Abrufe laufen in eigenen Threads (auch bei nur einer Quelle, damit das Zeitlimit hart gilt), und
+    fetch() liefert die Ergebnisse in der Reihenfolge ihres Eintreffens: die Stationen einer schnellen
+    Quelle werden ausgewertet, während eine langsame noch lädt. Überschreitet eine Quelle ihr
+    timeout_seconds, zählt sie in diesem Zyklus als Fehler; ihr Abruf läuft im Hintergrund zu Ende und
+    wird erst danach neu gestartet. Lokale Quellen (FileIndexFetcher) werden allein im aufrufenden Thread gelesen.
     """
-    m: Dict[Tuple[str, str], dict] = {}
-    for item in arr:
+
+    def __init__(self, settings: Settings, metrics: Optional["Metrics"] = None):
+        self.settings = settings
+        self.stations: Dict[str, List[StationConfig]] = {}
+        for st in settings.stations:
+            self.stations.setdefault(st.source, []).append(st)
+        # HLNUG immer, auch ohne eigene Stationen: dessen Session dient dem Nachladen von Zeitreihen
+        self.fetchers: Dict[str, IndexFetcher] = {
+            name: IndexFetcher(settings, metrics=metrics, provider=settings.providers[name])
+            for name in dict.fromkeys([HLNUG_PROVIDER, *self.stations])
+        }
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._late: Dict[str, Future] = {}  # Abrufe, die ihr Zeitlimit überschritten haben und noch laufen
+
+    def fetch(self) -> Iterator[Tuple[str, Optional[List[dict]], Optional[Exception]]]:
+        """Je Quelle (Name, Einträge oder None bei 304, Fehler oder None), sobald das Ergebnis vorliegt."""
+        name = next(iter(self.stations), None)
+        if len(self.stations) == 1 and self.fetchers[name].local:
+            # nur gespeicherte Dateien (kein Netz): im aufrufenden Thread, ohne Pool (cProfile sieht den Parse)
+            try:
+                yield name, self.fetchers[name].fetch(), None
+            except Exception as e:
+                yield name, None, e
+            return
+
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=len(self.stations), thread_name_prefix="fetch")
+        futures: Dict[Future, str] = {}
+        deadlines: Dict[Future, float] = {}
+        still_running: List[str] = []
+        start = time.monotonic()
+        for name in self.stations:
+            fetcher = self.fetchers[name]
+            late = self._late.get(name)
+            if late is not None:
+                if not late.done():
+                    still_running.append(name)
+                    continue
+                # das verspätete Ergebnis wurde verworfen: ohne ETag abrufen, sonst käme nur 304 ohne die Daten
+                del self._late[name]
+                fetcher.forget_validators()
+            fut = self._pool.submit(fetcher.fetch)
+            futures[fut] = name
+            deadlines[fut] = start + fetcher.provider.timeout_seconds
+        for name in still_running:
+            yield name, None, TimeoutError("Abruf aus einem früheren Zyklus läuft noch")
+
+        try:
+            while futures:
+                timeout = max(0.0, min(deadlines.values()) - time.monotonic())
+                done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    name = futures.pop(fut)
+                    del deadlines[fut]
+                    exc = fut.exception()
+                    yield name, None if exc is not None else fut.result(), exc
+                now = time.monotonic()
+                for fut in [f for f, t in deadlines.items() if t <= now and not f.done()]:
+                    name = futures.pop(fut)
+                    del deadlines[fut]
+                    self._late[name] = fut
+                    limit = self.fetchers[name].provider.timeout_seconds
+                    yield name, None, TimeoutError(f"keine vollständige Antwort innerhalb von {limit} s")
+        finally:
+            # Abbruch durch den Aufrufer (Fehler beim Auswerten): laufende Abrufe wie verspätete behandeln
+            for fut, name in futures.items():
+                self._late[name] = fut
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        for fetcher in self.fetchers.values():
+            fetcher.close()
+
+
+class StationIndex:
+    """
+    Index über die Einträge von index.json, einmal pro Abruf aufgebaut.
+    Schlüssel (jeweils mit Parameter):
+      - primär:   station_no
+      - sekundär: station_id (öffentliche ID), normalisierter station_name
+    Alle Lookups sind O(1). Mehrere unterschiedliche Einträge unter einem Schlüssel
+    werden nicht stillschweigend aufgelöst, sondern als mehrdeutig gemeldet.
+    """
+
+    def __init__(self, source: str = "layers:10:index") -> None:
+        self.source = source  # Herkunft der Einträge (stations.source in der DB)
+        self.by_no: Dict[Tuple[str, str], List[dict]] = {}
+        self.by_id: Dict[Tuple[str, str], List[dict]] = {}
+        self.by_name: Dict[Tuple[str, str], List[dict]] = {}
+        self.size = 0
+
+    @staticmethod
+    def _add(m: Dict[Tuple[str, str], List[dict]], key: Tuple[str, str], item: dict) -> None:
+        bucket = m.get(key)
+        if bucket is None:
+            m[key] = [item]
+        elif item not in bucket:
+            # exakte Duplikate (identische Einträge) zählen nicht als Mehrdeutigkeit
+            bucket.append(item)
+
+    def add(self, item: Any) -> None:
         if not isinstance(item, dict):
-            continue
-        station_no = str(item.get("station_no", "")).strip()
+            return
         param = str(item.get("stationparameter_name", "")).strip()
-        if station_no and param:
-            m[(station_no, param)] = item
-    return m
+        if not param:
+            return
+        self.size += 1
+        station_no = str(item.get("station_no", "")).strip()
+        station_id = str(item.get("station_id", "")).strip()
+        name = _normalize_station_name(item.get("station_name"))
+        if station_no:
+            self._add(self.by_no, (station_no, param), item)
+        if station_id:
+            self._add(self.by_id, (station_id, param), item)
+        if name:
+            self._add(self.by_name, (name, param), item)
+
+    def duplicates(self) -> List[str]:
+        """Schlüssel mit mehreren unterschiedlichen Einträgen (für Debug-Ausgaben)."""
+        out = []
+        for label, m in (("station_no", self.by_no), ("station_id", self.by_id), ("name", self.by_name)):
+            for (k, param), bucket in m.items():
+                if len(bucket) > 1:
+                    out.append(f"{label}={k}/{param} ({len(bucket)} Einträge)")
+        return out
+
+    def lookup(self, station: StationConfig) -> Optional[dict]:
+        """
+        Sucht den Eintrag zur Station: station_no, dann station_id_public, dann Name.
+        Ist station_no konfiguriert, zählen Treffer über ID/Name nur mit derselben station_no
+        (sonst käme bei einem Ausfall der Station ein gleichnamiger anderer Pegel zurück).
+        Rückgabe None, wenn nichts passt; RuntimeError bei mehrdeutigem Treffer.
+        """
+        param = station.parameter.strip()
+        station_no = str(station.station_no).strip()
+        candidates = (
+            ("station_no", self.by_no, station_no),
+            ("station_id", self.by_id, str(station.station_id_public).strip()),
+            ("name", self.by_name, _normalize_station_name(station.name)),
+        )
+        for label, m, k in candidates:
+            if not k:
+                continue
+            bucket = m.get((k, param))
+            if bucket and station_no and label != "station_no":
+                bucket = [it for it in bucket if str(it.get("station_no", "")).strip() == station_no]
+            if not bucket:
+                continue
+            if len(bucket) > 1:
+                found = ", ".join(
+                    f"no={it.get('station_no')}/id={it.get('station_id')}/ts={it.get('timestamp')}" for it in bucket
+                )
+                raise RuntimeError(f"Mehrdeutiger Treffer für {station.name} über {label}={k}/{param}: {found}")
+            return bucket[0]
+        return None
 
+    def __len__(self) -> int:
+        return self.size
 
-def latest_for_station(index_map: Dict[Tuple[str, str], dict], station: StationConfig) -> Tuple[str, float, str, str]:
-    """Rückgabe: (timestamp_iso, value, source, unit)"""
-    key = (str(station.station_no).strip(), station.parameter.strip())
-    item = index_map.get(key)
 
-    # fallback über station_id_public, falls station_no/param nicht matched
-    if not item and station.station_id_public:
-        wanted_id = str(station.station_id_public).strip()
-        for (_, param), it in index_map.items():
-            if param != station.parameter:
-                continue
-            if str(it.get("station_id", "")).strip() == wanted_id:
-                item = it
-                break
+def build_index_map(arr: List[dict], source: str = "layers:10:index") -> StationIndex:
+    """Baut den StationIndex (station_no / station_id / Name -> Eintrag) für einen Abruf."""
+    index = StationIndex(source)
+    for item in arr:
+        index.add(item)
+    return index
+
+
+def index_source(provider: ProviderConfig) -> str:
+    """Herkunftsangabe für die DB: bei HLNUG wie bisher "layers:10:index", sonst der Name der Quelle."""
+    return "layers:10:index" if provider.kind == "hlnug" else provider.name
+
+
+@dataclass(frozen=True)
+class MeasurementRecord:
+    """Letzter Messwert einer Station, unabhängig von der Quelle."""
+    station_no: str
+    parameter: str
+    ts: datetime
+    value: float
+    unit: str
+    source: str
+
 
+def latest_for_station(index_map: StationIndex, station: StationConfig) -> MeasurementRecord:
+    """Eintrag der Station aus dem Index als MeasurementRecord; RuntimeError, wenn er fehlt oder nicht parsebar ist."""
+    item = index_map.lookup(station)
     if not item:
         raise RuntimeError(
             f"Station nicht im index.json gefunden: {station.name} (no={station.station_no}, param={station.parameter})"
@@ -599,7 +2122,7 @@ def latest_for_station(index_map: Dict[Tuple[str, str], dict], station: StationC
     if dt is None or fv is None:
         raise RuntimeError(f"timestamp/value nicht parsebar für {station.name}: timestamp={ts!r}, ts_value={val!r}")
 
-    return dt.isoformat(), float(fv), "layers:10:index", unit
+    return MeasurementRecord(station.station_no, station.parameter, dt, float(fv), unit, index_map.source)
 
 
 def _email_config_ok(settings: Settings) -> bool:
@@ -609,26 +2132,630 @@ def _email_config_ok(settings: Settings) -> bool:
     return all(x.strip() for x in required)
 
 
-def send_email(settings: Settings, subject: str, body: str) -> None:
+class SmtpTransport:
+    """
+    Eine authentifizierte SMTP-Verbindung für mehrere Mails (z.B. alle fälligen Mails eines
+    Outbox-Durchlaufs): Verbindung/TLS/Login nur beim ersten Versand. Eine wiederverwendete
+    Verbindung wird vor dem Senden per NOOP geprüft und bei Abbruch (Server-Timeout, Verbindungslimit)
+    neu aufgebaut. Fehler beim Senden selbst werden nicht wiederholt: ob der Server die Mail schon
+    angenommen hat, ist dann unklar, und ein zweiter Versand ergäbe eine doppelte Meldung (die Outbox
+    versucht es nach ihrem Backoff erneut).
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.connections = 0
+        self._smtp: Optional[smtplib.SMTP] = None
+
+    def _connect(self) -> smtplib.SMTP:
+        settings = self.settings
+        if settings.smtp_use_ssl:
+            s = smtplib.SMTP_SSL(settings.smtp_host, settings.smtp_port, timeout=20)
+        else:
+            s = smtplib.SMTP(settings.smtp_host, settings.smtp_port, timeout=20)
+        try:
+            if not settings.smtp_use_ssl:
+                s.ehlo()
+                if settings.smtp_use_starttls:
+                    s.starttls()
+                    s.ehlo()
+            s.login(settings.smtp_user, settings.smtp_password)
+        except BaseException:
+            s.close()
+            raise
+        self.connections += 1
+        return s
+
+    def send(self, msg: EmailMessage) -> None:
+        if self._smtp is not None:
+            try:
+                self._smtp.noop()
+            except (smtplib.SMTPException, OSError):
+                self._drop()
+        if self._smtp is None:
+            self._smtp = self._connect()
+        try:
+            self._smtp.send_message(msg)
+        except (smtplib.SMTPException, OSError):
+            self._drop()
+            raise
+
+    def _drop(self) -> None:
+        if self._smtp is not None:
+            try:
+                self._smtp.close()
+            finally:
+                self._smtp = None
+
+    def close(self) -> None:
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        finally:
+            self._drop()
+
+
+def send_email(
+    settings: Settings, subject: str, body: str, transport: Optional[SmtpTransport] = None, recipients: Optional[str] = None
+) -> None:
+    """Eine Mail senden; mit transport über dessen (wiederverwendete) Verbindung, sonst mit eigener."""
     msg = EmailMessage()
     msg["From"] = settings.mail_from
-    msg["To"] = settings.mail_to
+    msg["To"] = recipients or settings.mail_to
     msg["Subject"] = subject
     msg.set_content(body)
 
-    if settings.smtp_use_ssl:
-        with smtplib.SMTP_SSL(settings.smtp_host, settings.smtp_port, timeout=20) as s:
-            s.login(settings.smtp_user, settings.smtp_password)
-            s.send_message(msg)
+    if transport is not None:
+        transport.send(msg)
         return
+    transport = SmtpTransport(settings)
+    try:
+        transport.send(msg)
+    finally:
+        transport.close()
+
+
+def digest_outbox_rows(rows: List[Tuple[int, str, str, str, int]]) -> List[Tuple[int, str, str, str, int]]:
+    """
+    Fasst die Outbox-Zeilen eines Zyklus zu einer Mail zusammen (alle gehen an email.to):
+    Übersicht der Betreffzeilen, danach die einzelnen Meldungen.
+    """
+    if len(rows) <= 1:
+        return list(rows)
+    subjects = [r[2] for r in rows]
+    subject = f"{len(rows)} Pegel-Meldungen: " + "; ".join(subjects)
+    if len(subject) > 200:
+        subject = subject[:199] + "…"
+    sep = "\n" + "-" * 60 + "\n\n"
+    body = (
+        f"Zusammenfassung ({len(rows)} Meldungen):\n"
+        + "".join(f"  - {subj}\n" for subj in subjects)
+        + sep
+        + sep.join(r[3] for r in rows)
+    )
+    return [(rows[0][0], rows[0][1], subject, body, rows[0][4])]
+
+
+def _outbox_backoff(settings: Settings, attempts: int) -> int:
+    """Wartezeit nach dem n-ten Fehlversuch: base, 2*base, 4*base, ... begrenzt auf retry_max_seconds."""
+    return min(settings.outbox_retry_max_seconds, settings.outbox_retry_base_seconds * 2 ** min(attempts - 1, 30))
+
+
+def drain_outbox(
+    settings: Settings, con: sqlite3.Connection, now: Optional[float] = None, metrics: Optional[Metrics] = None
+) -> Tuple[int, bool, Optional[float]]:
+    """
+    Versendet fällige Mails aus der outbox (älteste zuerst); versendete Zeilen werden gelöscht.
+    Alle Mails eines Durchlaufs teilen sich eine SMTP-Verbindung (SmtpTransport).
+    Beim ersten Fehler wird die Zeile mit exponentiellem Backoff zurückgestellt und der Durchlauf
+    beendet (Mailserver vermutlich gestört) – es geht keine Mail verloren.
+    Rückgabe: (versendet, Fehler aufgetreten, Sekunden bis zum nächsten fälligen Eintrag oder None).
+    """
+    t = time.time() if now is None else now
+    sent = 0
+    due = con.execute(
+        "SELECT id, recipients, subject, body, attempts FROM outbox WHERE next_attempt_at <= ? ORDER BY id", (int(t),)
+    ).fetchall()
+    transport = SmtpTransport(settings)
+    try:
+        for oid, recipients, subject, body, attempts in due:
+            t_send = time.perf_counter()
+            try:
+                send_email(settings, subject, body, transport, recipients)
+            except Exception as e:
+                if metrics is not None:
+                    metrics.record_phase("send", time.perf_counter() - t_send)
+                    metrics.inc("pegel_mail_failures_total")
+                attempts += 1
+                delay = _outbox_backoff(settings, attempts)
+                con.execute(
+                    "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                    (attempts, int(t) + delay, str(e)[:500], oid),
+                )
+                con.commit()
+                print(
+                    f"***Pegel-Warnung*** Fehler beim Senden der E-Mail (Versuch {attempts}, "
+                    f"nächster in {delay}s): {e}",
+                    file=sys.stderr,
+                )
+                return sent, True, float(delay)
+            if metrics is not None:
+                metrics.record_phase("send", time.perf_counter() - t_send)
+                metrics.inc("pegel_mails_sent_total")
+            con.execute("DELETE FROM outbox WHERE id = ?", (oid,))
+            con.commit()
+            sent += 1
+            print(f"***Pegel-Warnung*** E-Mail gesendet: {subject}")
+    finally:
+        transport.close()
+        if metrics is not None and due:
+            metrics.publish()
+    (next_at,) = con.execute("SELECT MIN(next_attempt_at) FROM outbox").fetchone()
+    return sent, False, None if next_at is None else max(0.0, next_at - t)
+
+
+class OutboxDispatcher:
+    """
+    Versendet die outbox unabhängig vom Abfrage-Zyklus, damit ein langsamer oder gestörter
+    Mailserver die Abfrage nicht aufhält.
+    - background=True (Daemon): eigener Thread mit eigener DB-Verbindung; wird nach jedem Zyklus
+      geweckt, wartet nach Fehlern den Backoff ab und versendet beim Start liegengebliebene Mails.
+    - background=False (once, Tests): notify() versendet direkt im aufrufenden Thread.
+    """
+
+    def __init__(self, settings: Settings, background: bool, metrics: Optional[Metrics] = None):
+        self.settings = settings
+        self.metrics = metrics
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if background and _email_config_ok(settings):
+            self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+            self._thread.start()
+
+    def notify(self, con: sqlite3.Connection) -> None:
+        """Nach dem Commit eines Zyklus aufrufen (con = Verbindung des Pollers, nur ohne Thread genutzt)."""
+        if not _email_config_ok(self.settings):
+            return
+        if self._thread is None:
+            drain_outbox(self.settings, con, metrics=self.metrics)
+        else:
+            self._wake.set()
+
+    def _run(self) -> None:
+        con = open_db(self.settings.db_path, self.settings.db_journal_mode)
+        try:
+            while not self._stop.is_set():
+                self._wake.clear()
+                try:
+                    _, failed, wait = drain_outbox(self.settings, con, metrics=self.metrics)
+                except sqlite3.Error as e:
+                    print(f"Outbox: DB-Fehler: {e}", file=sys.stderr)
+                    con.rollback()
+                    failed, wait = True, float(self.settings.outbox_retry_base_seconds)
+                if failed:
+                    # Backoff abwarten, neue Einträge gehen danach mit raus
+                    self._stop.wait(wait)
+                else:
+                    self._wake.wait(wait)
+        finally:
+            con.close()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+
+@dataclass
+class CycleSummary:
+    """Kurzfassung eines Abfrage-Zyklus für den PollScheduler."""
+    newest_ts: Optional[int]  # jüngster Messzeitpunkt (epoch s) über alle Stationen
+    max_level: int            # höchste Warnstufe
+    rising: bool              # mindestens eine Station steigt (Prognose oder schneller Anstieg)
+
+
+@dataclass
+class CycleTotals:
+    """Summen eines Zyklus über die Stationsgruppen aller Quellen (check_once)."""
+    evaluated: bool = False  # mindestens eine Quelle hat neue Daten geliefert
+    new_samples: int = 0
+    alerts: int = 0
+    station_errors: bool = False
+    max_data_age: float = 0.0
+    summary: CycleSummary = field(default_factory=lambda: CycleSummary(None, 0, False))
+
+
+class PollScheduler:
+    """
+    Takt des Daemon-Modus ohne Drift (nächster Termin aus der Uhrzeit, nicht aus sleep nach dem Zyklus):
+    - ohne gelernten Rhythmus: auf Vielfache des Intervalls ausgerichtet (z.B. :00/:15/:30/:45)
+    - lernt aus den Messzeitpunkten den Veröffentlichungsrhythmus (kleinster Abstand neuer Werte)
+      und die Verzögerung bis zur Veröffentlichung: jede Abfrage liefert eine obere Schranke
+      (jüngster Wert ist sichtbar) und eine untere (nächster Wert noch nicht); solange die Schranken
+      weit auseinander liegen, wird in der Mitte abgefragt, danach kurz nach dem erwarteten Termin
+    - normal werden Termine übersprungen, solange sie näher als poll_interval_seconds liegen;
+      nach calm_after_hours ohne Auffälligkeiten gilt calm_poll_interval_seconds
+    - bei Stufe >= 1 oder steigendem Pegel wird kein Termin übersprungen (schneller als der Rhythmus
+      bringt keine neuen Werte), ein ausbleibender Wert wird alle fast_poll_interval_seconds nachgefragt
+    - sonst wird ein ausbleibender Wert ab fast_poll_interval_seconds verdoppelnd (bis zum Intervall) nachgefragt
+    - ohne adaptive_schedule: fester, ausgerichteter Takt poll_interval_seconds
+    """
+
+    MARGIN_SECONDS = 30  # Sicherheitsabstand nach dem erwarteten Veröffentlichungszeitpunkt
+
+    def __init__(self, settings: Settings, history: int = 8):
+        self.settings = settings
+        self._diffs: deque = deque(maxlen=history)
+        self._lag_hi: deque = deque(maxlen=history)  # Verzögerung höchstens ...
+        self._lag_lo: deque = deque(maxlen=history)  # Verzögerung mehr als ...
+        self._last_ts: Optional[int] = None
+        self._urgent = False
+        self._calm_since: Optional[float] = None
+        self._misses = 0
+
+    def observe(self, summary: Optional[CycleSummary], now: float) -> None:
+        """Nach jedem Zyklus aufrufen (summary None: 304 oder Fehler, keine neuen Werte)."""
+        newest = summary.newest_ts if summary is not None else None
+        if summary is not None:
+            self._urgent = summary.max_level >= 1 or summary.rising
+            if self._urgent:
+                self._calm_since = None
+            elif self._calm_since is None:
+                self._calm_since = now
+        if newest is not None and (self._last_ts is None or newest > self._last_ts):
+            if self._last_ts is not None:
+                self._diffs.append(newest - self._last_ts)
+            self._last_ts = newest
+            self._misses = 0
+        else:
+            self._misses += 1
+        if newest is not None:
+            self._lag_hi.append(max(0.0, now - newest))
+            cadence = self.cadence
+            if cadence is not None and now - (newest + cadence) > 0:
+                # nur aussagekräftige untere Schranken (Abfrage vor der nächsten Veröffentlichung)
+                self._lag_lo.append(now - (newest + cadence))
+                if max(self._lag_lo) > min(self._lag_hi):
+                    # widersprüchlich (Verzögerung schwankt/hat sich geändert): untere Schranken verwerfen
+                    self._lag_lo.clear()
+
+    @property
+    def cadence(self) -> Optional[float]:
+        """Gelernter Rhythmus: kleinster Abstand neuer Werte (übersprungene Termine ergeben Vielfache)."""
+        if len(self._diffs) < 2:
+            return None
+        return float(max(60, min(self._diffs)))
+
+    def lag_estimate(self) -> Optional[float]:
+        """Geschätzte Verzögerung Messzeitpunkt -> Veröffentlichung (Mitte der Schranken, bis diese eng sind)."""
+        if not self._lag_hi:
+            return None
+        hi = min(self._lag_hi)
+        lo = max(self._lag_lo, default=0.0)
+        if hi - lo <= 2 * self.MARGIN_SECONDS:
+            return hi
+        return (lo + hi) / 2
+
+    def interval(self, now: float) -> int:
+        s = self.settings
+        if self._urgent:
+            return s.fast_poll_interval_seconds
+        if self._calm_since is not None and now - self._calm_since >= s.calm_after_hours * 3600:
+            return s.calm_poll_interval_seconds
+        return s.poll_interval_seconds
+
+    def next_poll(self, now: float) -> float:
+        """Nächster Abfragezeitpunkt (epoch s) ab now."""
+        if not self.settings.adaptive_schedule:
+            interval = self.settings.poll_interval_seconds
+            return (math.floor(now / interval) + 1) * interval
+        interval = self.interval(now)
+        cadence = self.cadence
+        lag = self.lag_estimate()
+        if cadence is None or lag is None or self._last_ts is None:
+            return (math.floor(now / interval) + 1) * interval
+
+        offset = self._last_ts + lag + self.MARGIN_SECONDS
+        fast = self.settings.fast_poll_interval_seconds
+        if now >= offset + cadence:
+            # erwarteter Wert überfällig: zügig nachfragen, außer bei Stufe >= 1/Anstieg bei Ausbleiben seltener
+            retry = fast if self._urgent else min(interval, fast * 2 ** min(max(self._misses - 1, 0), 16))
+            return (math.floor(now / retry) + 1) * retry
+        if self._urgent:
+            # nächster erwarteter Termin, keiner wird übersprungen
+            k = math.floor((now - offset) / cadence) + 1
+        else:
+            # erster erwarteter Termin mit mindestens (interval - cadence) Abstand: Termine werden übersprungen
+            k = math.ceil((now + interval - cadence - offset) / cadence)
+        return offset + max(1, k) * cadence
+
+
+# Settings, die eine laufende Instanz nicht übernehmen kann (DB-Verbindung, Betriebsart, Metrik-Port)
+RESTART_FIELDS = ("db_path", "db_journal_mode", "mode", "metrics_listen")
+# Settings des Mail-Versands: Änderung startet den OutboxDispatcher neu
+MAIL_FIELDS = (
+    "email_enabled", "mail_to", "mail_from", "smtp_host", "smtp_port", "smtp_user", "smtp_password",
+    "smtp_use_ssl", "smtp_use_starttls", "outbox_retry_base_seconds", "outbox_retry_max_seconds", "email_digest",
+)
+
+
+def _fetch_identity(settings: Settings) -> Tuple[Any, ...]:
+    """Was ein SourceFetcher aus den Settings übernimmt; gleich = bestehende Sessions/ETags weiterverwenden."""
+    return (
+        [(st.station_no, st.parameter, st.station_id_public, st.name, st.source) for st in settings.stations],
+        settings.providers,
+        settings.stream_index,
+    )
+
+
+def _format_thresholds(thresholds: Sequence[float]) -> str:
+    return "/".join(f"{th:g}" for th in thresholds)
 
-    with smtplib.SMTP(settings.smtp_host, settings.smtp_port, timeout=20) as s:
-        s.ehlo()
-        if settings.smtp_use_starttls:
-            s.starttls()
-            s.ehlo()
-        s.login(settings.smtp_user, settings.smtp_password)
-        s.send_message(msg)
+
+class PollContext:
+    """
+    Langlebige Objekte eines Prozesses: HTTP-Clients je Quelle, DB-Verbindung und Mail-Versand (outbox).
+    Im Daemon-Modus einmal angelegt und über alle Zyklen wiederverwendet; mit
+    background_dispatch=True versendet ein eigener Thread die Mails.
+    """
+
+    def __init__(self, settings: Settings, background_dispatch: bool = False):
+        self.settings = settings
+        self.metrics = Metrics(settings.metrics_json_path)
+        self.sources = SourceFetcher(settings, self.metrics)
+        self._storage: Optional[Storage] = None
+        self._trends: Optional[TrendTracker] = None
+        self.last_cycle: Optional[CycleSummary] = None  # Ergebnis des letzten check_once (für PollScheduler)
+        # zuletzt verarbeiteter Messwert je (station_no, parameter): (ts epoch, Warnstufe)
+        self.last_seen: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        self._alert_state: Optional[AlertStateCache] = None
+        if background_dispatch:
+            self.open_storage()  # Schema (outbox) anlegen, bevor der Versand-Thread die DB öffnet
+        self.metrics_server: Optional[MetricsServer] = None  # nur im Daemon-Modus mit metrics.listen
+        self._background_dispatch = background_dispatch
+        self.dispatcher = OutboxDispatcher(settings, background_dispatch, self.metrics)
+
+    @property
+    def fetcher(self) -> IndexFetcher:
+        """Abruf der HLNUG-Quelle (auch die Session für das Nachladen von Zeitreihen)."""
+        return self.sources.fetchers[HLNUG_PROVIDER]
+
+    @fetcher.setter
+    def fetcher(self, fetcher: IndexFetcher) -> None:
+        self.sources.fetchers[HLNUG_PROVIDER] = fetcher
+
+    @property
+    def storage(self) -> Storage:
+        # erst beim ersten Bedarf öffnen (bei 304 wird die DB nicht angefasst)
+        return self.open_storage()
+
+    def open_storage(self) -> Storage:
+        """DB öffnen und Schema anlegen, falls noch nicht geschehen."""
+        if self._storage is None:
+            self._storage = Storage(self.settings.db_path, self.settings.db_journal_mode)
+        return self._storage
+
+    @property
+    def trends(self) -> TrendTracker:
+        # Trendfenster einmal pro Prozess aus der DB aufbauen, danach im Speicher fortschreiben
+        if self._trends is None:
+            self._trends = TrendTracker.load(self.settings, self.storage)
+        return self._trends
+
+    @property
+    def alert_state(self) -> AlertStateCache:
+        if self._alert_state is None:
+            self._alert_state = AlertStateCache.load(self.storage.con)
+        return self._alert_state
+
+    def discard_cycle(self) -> None:
+        """Nach Rollback: Alarm-Zustand beim nächsten Zyklus neu aus der DB laden."""
+        self._alert_state = None
+
+    def reload(self, new: Settings) -> List[str]:
+        """
+        Neue Settings zwischen zwei Zyklen übernehmen (Daemon, ConfigWatcher). Zurückgesetzt wird nur
+        der Zustand entfernter Stationen (alert_state, last_seen, Trendfenster) und geänderter
+        Schwellen bzw. Anstiegsraten (deren alert_state-Zeilen; der aktuelle Messwert wird danach
+        erneut ausgewertet). Einstellungen aus RESTART_FIELDS bleiben bis zum Neustart unverändert.
+        Rückgabe: Protokollzeilen der Änderungen (leer = nichts geändert).
+        """
+        old = self.settings
+        changes: List[str] = []
+        for name in RESTART_FIELDS:
+            if getattr(new, name) != getattr(old, name):
+                changes.append(f"{name}: {getattr(new, name)} wird erst nach einem Neustart übernommen")
+        new = replace(new, **{name: getattr(old, name) for name in RESTART_FIELDS})
+
+        old_st = {(st.station_no, st.parameter): st for st in old.stations}
+        new_st = {(st.station_no, st.parameter): st for st in new.stations}
+        removed = [key for key in old_st if key not in new_st]
+        added = [key for key in new_st if key not in old_st]
+        reset: Dict[Tuple[str, str], List[int]] = {}
+        for key in removed:
+            changes.append(f"- Station {old_st[key].name} ({key[0]}/{key[1]})")
+        for key in added:
+            changes.append(f"+ Station {new_st[key].name} ({key[0]}/{key[1]})")
+        for key, st in new_st.items():
+            prev = old_st.get(key)
+            if prev is None:
+                continue
+            th_old, th_new = prev.thresholds_cm, st.thresholds_cm
+            indices = [i for i in range(max(len(th_old), len(th_new))) if th_old[i:i + 1] != th_new[i:i + 1]]
+            if indices:
+                changes.append(f"~ Station {st.name}: Schwellen {_format_thresholds(th_old)} -> {_format_thresholds(th_new)} cm")
+            if prev.rise_cm_per_hour != st.rise_cm_per_hour:
+                indices.append(TREND_ALERT_IDX)
+                changes.append(f"~ Station {st.name}: Anstieg {prev.rise_cm_per_hour:g} -> {st.rise_cm_per_hour:g} cm/h")
+            if indices:
+                reset[key] = indices
+            for name in ("name", "station_id_public", "level_names", "source"):
+                if getattr(prev, name) != getattr(st, name):
+                    changes.append(f"~ Station {st.name}: {name} {getattr(prev, name)!r} -> {getattr(st, name)!r}")
+        for f in fields(Settings):
+            if f.name in ("stations", *RESTART_FIELDS) or getattr(old, f.name) == getattr(new, f.name):
+                continue
+            if f.name == "smtp_password":
+                changes.append("smtp_password geändert")
+            elif f.name == "providers":
+                names = sorted(n for n in {*old.providers, *new.providers} if old.providers.get(n) != new.providers.get(n))
+                changes.append(f"providers geändert: {', '.join(names)}")
+            else:
+                changes.append(f"{f.name}: {getattr(old, f.name)} -> {getattr(new, f.name)}")
+        if not changes:
+            self.settings = new
+            return changes
+
+        # Alarm-Zustand: entfernte Stationen ganz, geänderte Schwellen einzeln
+        if removed or reset:
+            con = self.storage.con
+            try:
+                for key in removed:
+                    self._forget_alert_state(con, key, None)
+                for key, indices in reset.items():
+                    self._forget_alert_state(con, key, indices)
+                con.commit()
+            except BaseException:
+                self.storage.rollback()
+                self.discard_cycle()
+                raise
+        for key in (*removed, *reset):
+            self.last_seen.pop(key, None)
+        for key in removed:
+            self.metrics.forget(station_no=key[0], parameter=key[1])
+        for key, st in new_st.items():
+            if key in old_st and old_st[key].name != st.name:
+                self.metrics.forget(station_no=key[0], parameter=key[1])
+
+        # Trendfenster: bei neuer Fenstergröße alle neu aufbauen, sonst nur hinzugekommene/entfernte
+        if self._trends is not None:
+            if new.trend_window_size != old.trend_window_size:
+                self._trends = None
+            else:
+                for key in removed:
+                    self._trends.remove(*key)
+                for key in added:
+                    self._trends.add(new, self.storage, new_st[key])
+
+        # Abruf: neuer Filter/neue Quellen nur, wenn sich Stationen oder Quellen geändert haben
+        if _fetch_identity(old) != _fetch_identity(new):
+            self.sources.close()
+            self.sources = SourceFetcher(new, self.metrics)
+
+        self.metrics.json_path = new.metrics_json_path
+        if any(getattr(old, name) != getattr(new, name) for name in MAIL_FIELDS):
+            self.dispatcher.stop()
+            self.dispatcher = OutboxDispatcher(new, self._background_dispatch, self.metrics)
+        else:
+            self.dispatcher.settings = new
+        self.settings = new
+        return changes
+
+    def _forget_alert_state(self, con: sqlite3.Connection, key: Tuple[str, str], indices: Optional[List[int]]) -> None:
+        if self._alert_state is not None:
+            self._alert_state.forget(con, key[0], key[1], indices)
+        else:
+            _delete_alert_state(con, key[0], key[1], indices)
+
+    def close(self) -> None:
+        self.dispatcher.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            self.metrics_server = None
+        self.sources.close()
+        if self._storage is not None:
+            self._storage.close()
+            self._storage = None
+
+
+class ConfigWatcher:
+    """
+    Beobachtet die Config-Datei im Daemon-Modus (Änderungszeit und Größe, alle interval Sekunden;
+    portabel, auch für die Windows-EXE). Eine geänderte Datei wird erst gelesen, wenn sie eine Runde
+    lang unverändert war (Editor schreibt noch), und im Watcher-Thread geparst und validiert
+    (load_settings). Gültige Settings liegen bis take() bereit, changed weckt die Daemon-Schleife
+    (die es vor take() zurücksetzt).
+    Bei einem Fehler bleibt die alte Config aktiv; gemeldet wird einmal je Dateistand.
+    """
+
+    def __init__(
+        self, path: Path, interval: float = 2.0, start: bool = True, changed: Optional[threading.Event] = None
+    ):
+        self.path = path
+        self.interval = interval
+        self.changed = changed or threading.Event()  # mehrere Watcher können ein Wecksignal teilen
+        self._lock = threading.Lock()
+        self._pending: Optional[Settings] = None
+        self._loaded = self._seen = self._stat()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if start:
+            self._thread = threading.Thread(target=self._run, name="config-watch", daemon=True)
+            self._thread.start()
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = self.path.stat()
+        except OSError:
+            return None  # z.B. während der Editor die Datei ersetzt
+        return st.st_mtime_ns, st.st_size
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def poll(self) -> bool:
+        """Eine Prüfung; True, wenn neue gültige Settings bereitgelegt wurden."""
+        stamp = self._stat()
+        if stamp is None or stamp == self._loaded:
+            self._seen = stamp
+            return False
+        if stamp != self._seen:
+            self._seen = stamp
+            return False
+        self._loaded = stamp
+        try:
+            settings = load_settings(self.path)
+        except Exception as e:
+            print(f"Config {self.path.name} geändert, aber ungültig – alte Config bleibt aktiv: {e}", file=sys.stderr)
+            return False
+        with self._lock:
+            self._pending = settings
+        self.changed.set()
+        return True
+
+    def take(self) -> Optional[Settings]:
+        """Bereitliegende Settings abholen (None, wenn keine)."""
+        with self._lock:
+            settings, self._pending = self._pending, None
+        return settings
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval + 1)
+            self._thread = None
+
+
+def apply_reload(ctx: PollContext, new: Settings, label: str = "Config") -> Settings:
+    """Neue Settings übernehmen und die Änderungen protokollieren; Rückgabe: die jetzt aktiven Settings."""
+    try:
+        changes = ctx.reload(new)
+    except Exception as e:
+        print(f"{label}: Übernahme fehlgeschlagen – alte Config bleibt aktiv: {e}", file=sys.stderr)
+        return ctx.settings
+    if changes:
+        print(f"{label} neu geladen ({len(changes)} Änderungen):")
+        for line in changes:
+            print(f"  {line}")
+    return ctx.settings
 
 
 def _parse_int_or_none(s: Optional[str]) -> Optional[int]:
@@ -643,148 +2770,1801 @@ def _parse_int_or_none(s: Optional[str]) -> Optional[int]:
         return None
 
 
-def check_once(settings: Settings) -> int:
-    init_db(settings.db_path)
+def _format_hours(hours: float) -> str:
+    if hours < 1:
+        return f"{max(1, round(hours * 60))} min"
+    return f"{hours:.1f} h"
+
+
+def forecast_thresholds(
+    settings: Settings, station: StationConfig, window: Optional[TrendWindow]
+) -> List[Tuple[int, float]]:
+    """
+    Prognose für alle noch nicht erreichten Schwellen der Station aus dem Trendfenster (O(1) je Schwelle):
+    Liste (Schwellen-Index, Stunden ab letztem Messwert), nur bei steigendem Trend und innerhalb
+    forecast_max_hours.
+    """
+    if settings.forecast_method == "off" or window is None or window.count < settings.trend_min_samples:
+        return []
+    out: List[Tuple[int, float]] = []
+    for th_idx, th in enumerate(station.thresholds_cm):
+        hours = window.hours_to(th, settings.forecast_method)
+        if hours is None or hours > settings.forecast_max_hours:
+            break  # höhere Schwellen liegen noch weiter entfernt
+        if hours > 0:
+            out.append((th_idx, hours))
+    return out
+
+
+def _forecast_text(
+    settings: Settings, station: StationConfig, window: TrendWindow, forecast: List[Tuple[int, float]], dt: datetime, unit: str
+) -> str:
+    """Prognose-Abschnitt für den Mail-Text inkl. Leerzeile (leer ohne Prognose)."""
+    if not forecast:
+        return ""
+    lines = [f"Prognose ({settings.forecast_method}, Trend über {window.count} Werte / {window.span_hours():.1f} h):"]
+    for th_idx, hours in forecast:
+        name = station.level_names[th_idx] if th_idx < len(station.level_names) else f"Meldestufe {th_idx + 1}"
+        eta = _format_local(dt + timedelta(hours=hours))
+        lines.append(
+            f"  Meldestufe {th_idx + 1} ({name}, {station.thresholds_cm[th_idx]:.1f}{unit}): "
+            f"in ca. {_format_hours(hours)} (ca. {eta})"
+        )
+    return "\n".join(lines) + "\n\n"
+
+
+def _alert_due(settings: Settings, st: AlertState, above: bool, ts_epoch: int) -> bool:
+    """
+    Arm/Re-Arm-Logik einer Alarmbedingung (Schwelle oder schneller Anstieg) auf Basis von
+    Messzeitpunkten. True, wenn jetzt alarmiert werden soll: Bedingung erfüllt und scharf.
+    Erneut scharf erst, wenn die Bedingung rearm_below_hours am Stück nicht erfüllt war.
+    """
+    armed = st.armed is not False  # NULL (noch nie ausgewertet) zählt als scharf
+
+    # Bedingung nicht erfüllt: ggf. Re-Arm nach Ablauf der Zeit
+    if not above:
+        if not armed:
+            if st.below_since is None:
+                st.below_since = ts_epoch
+            elif ts_epoch - st.below_since >= settings.rearm_below_hours * 3600:
+                st.armed = True
+                st.below_since = None
+        else:
+            # aufgeräumt halten
+            st.below_since = None
+        return False
+
+    # Ab hier: Bedingung erfüllt -> nicht mehr kontinuierlich unterhalb
+    st.below_since = None
+
+    if not armed:
+        return False
+
+    # Erstlauf-Unterdrückung (optional)
+    if st.armed is None and not settings.alert_on_start:
+        st.armed = False
+        return False
+    return True
+
+
+def _alert_name(station: StationConfig, th_idx: int) -> str:
+    if th_idx == TREND_ALERT_IDX:
+        return "Schneller Anstieg"
+    return station.level_names[th_idx] if th_idx < len(station.level_names) else f"Meldestufe {th_idx + 1}"
+
+
+def evaluate_sample(
+    settings: Settings,
+    station: StationConfig,
+    state_for: Callable[[int], AlertState],
+    value: float,
+    ts_epoch: int,
+    level: int,
+    slope: Optional[float],
+) -> List[int]:
+    """
+    Alarm-Zustandsautomat für einen neuen Messwert einer Station, ohne Seiteneffekte außer auf die
+    übergebenen AlertState-Objekte (state_for(th_idx) liefert den Zustand je Schwelle bzw.
+    TREND_ALERT_IDX). Rückgabe: fällige Alarme (Schwellen-Index, zuletzt ggf. TREND_ALERT_IDX).
+    Der Aufrufer markiert ausgelöste Alarme mit _mark_fired (check_once: beim Einreihen der Mail).
+    """
+    due = []
+    for th_idx, th in enumerate(station.thresholds_cm):
+        st = state_for(th_idx)
+        st.last_level = level  # für Anzeige/Verlauf
+        if _alert_due(settings, st, value >= th, ts_epoch):
+            due.append(th_idx)
+    # Schneller Anstieg: Steigung der Regressionsgeraden über das Trendfenster
+    if slope is not None and station.rise_cm_per_hour > 0:
+        st = state_for(TREND_ALERT_IDX)
+        st.last_level = level
+        if _alert_due(settings, st, slope >= station.rise_cm_per_hour, ts_epoch):
+            due.append(TREND_ALERT_IDX)
+    return due
+
+
+def _mark_fired(st: AlertState, ts_epoch: int) -> None:
+    """Alarm ausgelöst: disarmen, bis die Re-Arm-Bedingung erfüllt ist."""
+    st.armed = False
+    st.last_alert_at = ts_epoch
+
+
+def _queue_alert(
+    settings: Settings,
+    st: AlertState,
+    now: datetime,
+    ts_epoch: int,
+    station_name: str,
+    alert_name: str,
+    subject: str,
+    body: str,
+    outbox_rows: List[Tuple[int, str, str, str, int]],
+) -> None:
+    """
+    E-Mail für die outbox vormerken (geschrieben in derselben Transaktion wie der Alarm-Zustand)
+    und disarmen, bis die Re-Arm-Bedingung erfüllt ist. Versand und Wiederholung: OutboxDispatcher.
+    now (Uhrzeit) gilt nur für die outbox; last_alert_at ist wie bei replay der Messzeitpunkt ts_epoch.
+    """
+    if not _email_config_ok(settings):
+        print(
+            f"WARNUNG: {station_name} ({alert_name}), aber E-Mail/SMTP-Konfig unvollständig.",
+            file=sys.stderr,
+        )
+        return
+    now_epoch = int(now.timestamp())
+    outbox_rows.append((now_epoch, settings.mail_to, subject, body, now_epoch))
+    _mark_fired(st, ts_epoch)
+    print(f"***Pegel-Warnung*** E-Mail eingereiht: {station_name} / {alert_name}")
 
-    arr = fetch_index(settings)
-    index_map = build_index_map(arr)
 
+def check_once(settings: Settings, ctx: Optional[PollContext] = None) -> int:
+    """
+    Ein Abfrage-Zyklus. Im Daemon-Modus wird ein langlebiger PollContext übergeben,
+    damit HTTP-Verbindung, ETag/Last-Modified, DB-Verbindung und Alarm-Zustand erhalten bleiben.
+    Stationen, deren Messzeitpunkt seit dem letzten Zyklus unverändert ist (ctx.last_seen), werden
+    nur angezeigt: kein Zustandsautomat, kein INSERT, keine Mail. Das ist auch für das Re-Arm
+    korrekt, denn dessen Frist (rearm_below_hours) läuft über die Messzeitpunkte und kann daher nur
+    mit einem neuen Messwert ablaufen.
+    Bei mehreren Quellen werden deren Stationen gruppenweise ausgewertet und gespeichert, sobald die
+    jeweilige Quelle geantwortet hat (SourceFetcher); fällt eine Quelle aus, laufen die anderen normal.
+    """
+    if ctx is None:
+        ctx = PollContext(settings)
+        try:
+            return check_once(settings, ctx)
+        finally:
+            ctx.close()
+
+    ctx.last_cycle = None
+    metrics = ctx.metrics
+    sources = ctx.sources
+    multi = len(sources.stations) > 1
     now = datetime.now(timezone.utc)
+    totals = CycleTotals()
+    errors: List[Exception] = []
+    not_modified = 0
+    fetch_s = 0.0
+    t_start = time.perf_counter()
+    results = sources.fetch()
+    try:
+        while True:
+            t0 = time.perf_counter()
+            result = next(results, None)
+            fetch_s += time.perf_counter() - t0
+            if result is None:
+                break
+            provider, arr, err = result
+            stations = sources.stations.get(provider, [])
+            if err is not None:
+                metrics.inc("pegel_fetch_failures_total", provider=provider)
+                errors.append(err)
+                if multi:
+                    print(f"Fehler beim Abruf der Quelle '{provider}' ({len(stations)} Stationen): {err}", file=sys.stderr)
+                continue
+            metrics.set("pegel_source_fetch_seconds", time.perf_counter() - t_start, provider=provider)
+            if arr is None:
+                not_modified += 1
+                if multi:
+                    print(f"Quelle '{provider}' unverändert (HTTP 304) – ihre Stationen werden übersprungen.")
+                continue
+            with metrics.phase("index"):
+                index_map = build_index_map(arr, index_source(settings.providers[provider]))
+            evaluate_stations(settings, ctx, stations, index_map, now, totals)
+    except BaseException:
+        metrics.record_phase("fetch", fetch_s)
+        metrics.end_cycle("error")
+        raise
+    metrics.record_phase("fetch", fetch_s)
+
+    if len(errors) == len(sources.stations):
+        metrics.end_cycle("error")
+        raise errors[0]
+    if not totals.evaluated:
+        # 304 Not Modified: keine neuen Messwerte -> Parsen und Auswertung überspringen
+        print("Index unverändert (HTTP 304) – keine neuen Messwerte, Auswertung übersprungen.")
+        metrics.end_cycle("not_modified")
+        return 1 if errors else 0
+
+    _debug_print(settings, f"[DEBUG] neue Messwerte: {totals.new_samples} von {len(settings.stations)} Stationen")
+    ctx.last_cycle = totals.summary
+    # Versand im Hintergrund-Thread wird dem Zyklus zugerechnet, in dem er endet
+    metrics.inc("pegel_new_samples_total", totals.new_samples)
+    metrics.end_cycle(
+        "ok",
+        stations=len(settings.stations),
+        new_samples=totals.new_samples,
+        alerts=totals.alerts,
+        station_errors=totals.station_errors or bool(errors),
+        max_data_age_seconds=round(totals.max_data_age, 1),
+    )
+
+    return 1 if (totals.station_errors or errors) else 0
+
+
+def evaluate_stations(
+    settings: Settings,
+    ctx: PollContext,
+    stations: List[StationConfig],
+    index_map: StationIndex,
+    now: datetime,
+    totals: CycleTotals,
+    records: Optional[Dict[Tuple[str, str], Union[MeasurementRecord, Exception]]] = None,
+) -> None:
+    """
+    Wertet Stationen gegen den Index einer Quelle aus: Ausgabe, Trend, Alarme und Speichern in einer
+    Transaktion (Messwerte + Alarm-Zustand + Outbox), danach Mail-Versand anstoßen.
+    records: bereits aufgelöste Einträge je (station_no, parameter) bzw. der Fehler beim Auflösen
+    (Mehrmandanten-Betrieb: einmal je Station statt je Mandant); ohne records wird im Index gesucht.
+    Ergebnisse werden in totals aufsummiert. Bei einem DB-Fehler wird die Transaktion verworfen.
+    """
+    metrics = ctx.metrics
+    if settings.debug:
+        for dup in index_map.duplicates():
+            print(f"[DEBUG] index.json mehrdeutig: {dup}")
+
     any_fail = False
-    
+
     prefix = "Station: "
     name_width = len(prefix) + max(len(s.name) for s in settings.stations)  # dynamisch je nach längster Station
     value_width = 6  # z.B. "110.0" passt, ggf. 7 wenn du >999 erwartest
-    time_width = 16  # "HH:MM TT:MM:JJJJ" = 16 Zeichen    
-        
-    with sqlite3.connect(settings.db_path) as con:
-        for station in settings.stations:
+    time_width = 16  # "HH:MM TT:MM:JJJJ" = 16 Zeichen
+
+    con = ctx.storage.con
+    trends = ctx.trends
+    summary = totals.summary
+    seen_updates: Dict[Tuple[str, str], Tuple[int, int]] = {}
+    ages: Dict[Tuple[Tuple[str, str], ...], float] = {}
+    levels: Dict[Tuple[Tuple[str, str], ...], float] = {}
+    now_epoch = now.timestamp()
+    t_eval = time.perf_counter()
+    try:
+        state = ctx.alert_state
+        measurement_rows: List[Tuple[Any, ...]] = []
+        outbox_rows: List[Tuple[int, str, str, str, int]] = []
+        for station in stations:
             try:
-                ts_iso, value, source, unit = latest_for_station(index_map, station)
-                dt = _to_dt(ts_iso) or now
+                if records is None:
+                    rec = latest_for_station(index_map, station)
+                else:
+                    resolved = records[(station.station_no, station.parameter)]
+                    if isinstance(resolved, Exception):
+                        raise resolved
+                    rec = resolved
+                dt, value, unit = rec.ts, rec.value, rec.unit
                 unit_disp = f" {unit}".rstrip()
                 time_disp = _format_local(dt)
-
-                level = _compute_level(value, station.thresholds_cm)
+                ts_epoch = int(dt.timestamp())
+                seen_key = (station.station_no, station.parameter)
+                seen = ctx.last_seen.get(seen_key)
+                is_new = seen is None or seen[0] != ts_epoch
+
+                level = _compute_level(value, station.thresholds_cm) if is_new else seen[1]
+                labels = (("parameter", station.parameter), ("station", station.name), ("station_no", station.station_no))
+                ages[labels] = now_epoch - ts_epoch
+                levels[labels] = level
                 level_text = "OK" if level == 0 else f"{level} ({station.level_names[level-1] if (level-1) < len(station.level_names) else f'Warnstufe {level}'})"
 
+                # Trend: neuen Wert ins Fenster (gleicher Zeitstempel wie im Vorzyklus -> ignoriert)
+                window = trends.get(station)
+                slope: Optional[float] = None
+                if window is not None:
+                    window.push(ts_epoch, value)
+                    if window.count >= settings.trend_min_samples:
+                        slope = window.slope()
+
                 # Ausgabe (immer)
                 display_name = f"{prefix}{station.name}"
                 unit_disp = (unit or "cm").strip()  # falls mal leer
+                trend_text = "" if slope is None else f" | Trend: {slope:+.1f} {unit_disp}/h"
+                forecast = forecast_thresholds(settings, station, window)
+                if forecast:
+                    th_idx, hours = forecast[0]
+                    trend_text += f" | Prognose: Stufe {th_idx + 1} in {_format_hours(hours)}"
+                forecast_body = _forecast_text(settings, station, window, forecast, dt, unit_disp) if forecast else ""
+                summary.newest_ts = ts_epoch if summary.newest_ts is None else max(summary.newest_ts, ts_epoch)
+                summary.max_level = max(summary.max_level, level)
+                summary.rising = summary.rising or bool(forecast) or (
+                    slope is not None and station.rise_cm_per_hour > 0 and slope >= station.rise_cm_per_hour
+                )
                 print(
                     f"{display_name:<{name_width}} | "
                     f"Pegel: {value:>{value_width}.1f} {unit_disp:<3} | "
                     f"Zeitpunkt des Messwertes: {time_disp:<{time_width}} | "
-                    f"Pegel-Stufe: {level_text}"
-                )
-
-                # DB speichern
-                con.execute(
-                    "INSERT OR IGNORE INTO measurements(station_no, station_id_public, station_name, parameter, ts, value, level, source, unit) "
-                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                    (
-                        station.station_no,
-                        station.station_id_public,
-                        station.name,
-                        station.parameter,
-                        ts_iso,
-                        value,
-                        level,
-                        source,
-                        unit,
-                    ),
+                    f"Pegel-Stufe: {level_text}{trend_text}"
                 )
-                # State (pro Station/Parameter/Schwelle):
-                # - E-Mail beim Erreichen/Überschreiten jeder Schwelle (Flanke).
-                # - Wiederholung für dieselbe Schwelle erst, wenn der Pegel mindestens rearm_below_hours
-                #   am Stück unterhalb dieser Schwelle war und danach erneut überschreitet.
-                key_last_level = f"last_level:{station.station_no}:{station.parameter}"
-
-                for th_idx, th in enumerate(station.thresholds_cm):
-                    level_name = station.level_names[th_idx] if th_idx < len(station.level_names) else f"Meldestufe {th_idx + 1}"
-                    key_armed = f"armed:{station.station_no}:{station.parameter}:{th_idx}"
-                    key_below_since = f"below_since:{station.station_no}:{station.parameter}:{th_idx}"
-
-                    armed_str = db_get_state(con, key_armed)
-                    armed = True
-                    if armed_str is not None and str(armed_str).strip() != "":
-                        armed = str(armed_str).strip().lower() in ("1", "true", "yes", "y", "on")
-
-                    below_since_str = db_get_state(con, key_below_since)
-                    below_since_dt = _to_dt(below_since_str) if below_since_str else None
-
-                    # Unterhalb der Schwelle: ggf. Re-Arm nach Ablauf der Zeit
-                    if value < th:
-                        if not armed:
-                            if below_since_dt is None:
-                                db_set_state(con, key_below_since, dt.isoformat())
-                            else:
-                                if (dt - below_since_dt).total_seconds() >= settings.rearm_below_hours * 3600:
-                                    db_set_state(con, key_armed, "1")
-                                    db_set_state(con, key_below_since, "")
-                        else:
-                            # aufgeräumt halten
-                            if below_since_str:
-                                db_set_state(con, key_below_since, "")
-                        continue
-
-                    # Ab hier: value >= th  (oberhalb der Schwelle)
-                    if below_since_str:
-                        # Nicht mehr kontinuierlich unterhalb
-                        db_set_state(con, key_below_since, "")
-
-                    if not armed:
-                        continue
-
-                    # Erstlauf-Unterdrückung (optional)
-                    if armed_str is None and not settings.alert_on_start:
-                        db_set_state(con, key_armed, "0")
-                        continue
-
-                    # E-Mail bei Schwellen-Erreichen
-                    if _email_config_ok(settings):
-                        subject = f"{level_name} {station.name}: {value:.1f}{unit_disp} (>= {th:.1f}{unit_disp})"
+                if not is_new:
+                    continue  # kein neuer Messwert: schon gespeichert und ausgewertet
+
+                # DB speichern (gesammelt, ein executemany am Zyklusende)
+                # Herkunft aus der eigenen Quelle des Mandanten, nicht aus dem (im Hub ggf. umbenannten) Index
+                source = index_source(settings.providers[station.source])
+                station_pk = ctx.storage.station_pk(station.station_no, station.station_id_public, station.name, source)
+                param_pk = ctx.storage.param_pk(station.parameter, unit)
+                measurement_rows.append((station_pk, param_pk, ts_epoch, value, level))
+                # State (pro Station/Parameter/Schwelle, Tabelle alert_state), siehe evaluate_sample:
+                # - E-Mail beim Erreichen/Überschreiten jeder Schwelle (Flanke) und bei schnellem Anstieg.
+                # - Wiederholung erst, wenn die Bedingung mindestens rearm_below_hours am Stück
+                #   nicht erfüllt war und danach erneut eintritt.
+                state_for = partial(state.get, station.station_no, station.parameter)
+                for th_idx in evaluate_sample(settings, station, state_for, value, ts_epoch, level, slope):
+                    alert_name = _alert_name(station, th_idx)
+                    if th_idx != TREND_ALERT_IDX:
+                        # E-Mail bei Schwellen-Erreichen
+                        kind = "threshold"
+                        th = station.thresholds_cm[th_idx]
+                        subject = f"{alert_name} {station.name}: {value:.1f}{unit_disp} (>= {th:.1f}{unit_disp})"
                         body = (
                             f"Pegel-Meldung (HLNUG-Messdaten)\n\n"
                             f"Station: {station.name}\n"
-                            f"Meldestufe: {th_idx + 1} ({level_name})\n"
+                            f"Meldestufe: {th_idx + 1} ({alert_name})\n"
                             f"Schwelle: {th:.1f}{unit_disp}\n"
                             f"Messwert: {value:.1f}{unit_disp}\n"
                             f"Zeitpunkt der Messdaten: {time_disp}\n\n"
-                            f"Station-ID (Web): {station.station_id_public}\n"
-                            f"Station-No (Daten): {station.station_no}\n"
-                            f"Quelle: Pegelwarnung via E-Mail V1.0 - © Marcel Mück\n"
                         )
-                        try:
-                            send_email(settings, subject, body)
-                            print(f"***Pegel-Warnung*** E-Mail gesendet: {station.name} / {level_name}")
-                            # Nach erfolgreichem Versand disarmen, bis Re-Arm-Bedingung erfüllt ist
-                            db_set_state(con, key_armed, "0")
-                        except Exception as e:
-                            print(f"***Pegel-Warnung*** Fehler beim Senden der E-Mail: {e}", file=sys.stderr)
                     else:
-                        print(
-                            f"WARNUNG: {station.name} ({level_name}), aber E-Mail/SMTP-Konfig unvollständig.",
-                            file=sys.stderr,
+                        kind = "rise"
+                        rate = station.rise_cm_per_hour
+                        rise = window.rise_rate()
+                        rise_disp = "-" if rise is None else f"{rise:+.1f}{unit_disp}/h"
+                        subject = f"{alert_name} {station.name}: {slope:+.1f}{unit_disp}/h (>= {rate:.1f}{unit_disp}/h)"
+                        body = (
+                            f"Pegel-Meldung (HLNUG-Messdaten)\n\n"
+                            f"Station: {station.name}\n"
+                            f"Meldung: {alert_name}\n"
+                            f"Anstieg (Trend über {window.count} Werte / {window.span_hours():.1f} h): {slope:+.1f}{unit_disp}/h\n"
+                            f"Anstieg seit dem letzten Messwert: {rise_disp}\n"
+                            f"Alarm ab: {rate:.1f}{unit_disp}/h\n"
+                            f"Messwert: {value:.1f}{unit_disp} (aktuelle Stufe: {level_text})\n"
+                            f"Zeitpunkt der Messdaten: {time_disp}\n\n"
                         )
-
-                # last_level weiterhin speichern (für Anzeige/Verlauf)
-                db_set_state(con, key_last_level, str(level))
-
+                    body += (
+                        f"{forecast_body}"
+                        f"Station-ID (Web): {station.station_id_public}\n"
+                        f"Station-No (Daten): {station.station_no}\n"
+                        f"Quelle: Pegelwarnung via E-Mail V1.0 - © Marcel Mück\n"
+                    )
+                    _queue_alert(settings, state_for(th_idx), now, ts_epoch, station.name, alert_name, subject, body, outbox_rows)
+                    metrics.inc("pegel_alerts_total", kind=kind)
+
+                seen_updates[seen_key] = (ts_epoch, level)
             except Exception as e:
                 any_fail = True
                 print(f"Fehler bei Station '{station.name}': {e}", file=sys.stderr)
 
+        metrics.record_phase("evaluate", time.perf_counter() - t_eval)
+        metrics.set_many("pegel_data_age_seconds", ages)
+        metrics.set_many("pegel_station_level", levels)
+        n_alerts = len(outbox_rows)
+        t_commit = time.perf_counter()
+
+        # Messwerte + geänderter Zustand + neue Mails in einer Transaktion
+        if measurement_rows:
+            con.executemany(
+                "INSERT OR IGNORE INTO measurements(station_pk, param_pk, ts, value, level) VALUES (?, ?, ?, ?, ?)",
+                measurement_rows,
+            )
+        n_state = state.flush(con)
+        _debug_print(settings, f"[DEBUG] alert_state: {n_state} Zeilen geschrieben")
+        if outbox_rows:
+            if settings.email_digest:
+                outbox_rows = digest_outbox_rows(outbox_rows)
+            con.executemany(
+                "INSERT INTO outbox(created_at, recipients, subject, body, next_attempt_at) VALUES (?, ?, ?, ?, ?)",
+                outbox_rows,
+            )
+        con.commit()
+        metrics.record_phase("commit", time.perf_counter() - t_commit)
+    except BaseException:
+        ctx.storage.rollback()
+        ctx.discard_cycle()
+        raise
+
+    ctx.last_seen.update(seen_updates)
+    ctx.dispatcher.notify(con)
+    totals.evaluated = True
+    totals.new_samples += len(seen_updates)
+    totals.alerts += n_alerts
+    totals.station_errors = totals.station_errors or any_fail
+    totals.max_data_age = max(totals.max_data_age, max(ages.values(), default=0.0))
+
+
+def _parse_station_timeseries(payload: Any) -> List[Tuple[datetime, float]]:
+    """
+    WISKI-Web Zeitreihen-JSON: Liste von Zeitreihen-Objekten mit "data": [[timestamp, value], ...].
+    Es wird die erste Zeitreihe mit Daten verwendet; Lücken (null) werden übersprungen.
+    """
+    series = payload if isinstance(payload, list) else [payload]
+    for ts_obj in series:
+        if not isinstance(ts_obj, dict):
+            continue
+        data = ts_obj.get("data")
+        if not isinstance(data, list) or not data:
+            continue
+        out: List[Tuple[datetime, float]] = []
+        for row in data:
+            if not isinstance(row, (list, tuple)) or len(row) < 2:
+                continue
+            dt = _to_dt(row[0])
+            fv = _try_float(row[1])
+            if dt is not None and fv is not None:
+                out.append((dt, fv))
+        return out
+    return []
+
+
+def fetch_station_history(
+    settings: Settings, session: requests.Session, station: StationConfig, t_from: datetime, t_to: datetime
+) -> List[Tuple[int, float]]:
+    """
+    Holt die Zeitreihe einer Station über den WISKI-Zeitreihen-Endpunkt (kleinste passende Periode)
+    und liefert (epoch s, Wert) im Bereich [t_from, t_to].
+    """
+    age_days = (datetime.now(timezone.utc) - t_from).total_seconds() / 86400
+    period = HLNUG_STATION_TS_PERIODS[-1][0]
+    for name, days in HLNUG_STATION_TS_PERIODS:
+        if age_days <= days:
+            period = name
+            break
+
+    url = HLNUG_STATION_TS_URL.format(station_no=station.station_no, parameter=station.parameter, period=period)
+    r = session.get(url, timeout=settings.request_timeout_seconds)
+    _debug_print(settings, f"[DEBUG] GET {url} -> {r.status_code}")
+    r.raise_for_status()
+    lo, hi = t_from.timestamp(), t_to.timestamp()
+    return [(int(dt.timestamp()), v) for dt, v in _parse_station_timeseries(r.json()) if lo <= dt.timestamp() <= hi]
+
+
+def backfill(
+    settings: Settings,
+    ctx: PollContext,
+    ranges: List[Tuple[StationConfig, datetime, datetime]],
+    batch_size: int = 5000,
+) -> Dict[str, int]:
+    """
+    Lädt historische Werte für (Station, von, bis) nach: Abrufe parallel (backfill_workers),
+    Schreiben im Hauptthread per executemany in einer Transaktion pro Station, Dubletten per INSERT OR IGNORE.
+    Rückgabe: Station -> Anzahl neu gespeicherter Werte.
+    """
+    storage = ctx.storage
+    session = ctx.fetcher.session()
+    result: Dict[str, int] = {}
+    if not ranges:
+        return result
+
+    oldest = max(days for _, days in HLNUG_STATION_TS_PERIODS)
+    with ThreadPoolExecutor(max_workers=settings.backfill_workers) as pool:
+        futures = {
+            pool.submit(fetch_station_history, settings, session, st, t_from, t_to): (st, t_from, t_to)
+            for st, t_from, t_to in ranges
+        }
+        for fut in as_completed(futures):
+            st, t_from, t_to = futures[fut]
+            try:
+                values = fut.result()
+            except Exception as e:
+                print(f"Backfill {st.name}: Fehler beim Abruf: {e}", file=sys.stderr)
+                continue
+            if (datetime.now(timezone.utc) - t_from).days > oldest:
+                print(f"Backfill {st.name}: Zeitreihen-Endpunkt reicht nur {oldest} Tage zurück.", file=sys.stderr)
+
+            con = storage.con
+            try:
+                # vorhandene Stammdaten nicht überschreiben, nur fehlende anlegen
+                station_pk = storage.lookup_station_pk(st.station_no)
+                if station_pk is None:
+                    station_pk = storage.station_pk(st.station_no, st.station_id_public, st.name, "stations:ts")
+                param_pk = storage.lookup_param_pk(st.parameter)
+                if param_pk is None:
+                    param_pk = storage.param_pk(st.parameter, "")
+                inserted = 0
+                for i in range(0, len(values), batch_size):
+                    # rowcount zählt nur die eingefügten Zeilen, nicht die Rollup-Trigger
+                    inserted += con.executemany(
+                        "INSERT OR IGNORE INTO measurements(station_pk, param_pk, ts, value, level) VALUES (?, ?, ?, ?, ?)",
+                        [
+                            (station_pk, param_pk, ts, v, _compute_level(v, st.thresholds_cm))
+                            for ts, v in values[i : i + batch_size]
+                        ],
+                    ).rowcount
+                con.commit()
+            except BaseException:
+                storage.rollback()
+                raise
+            result[st.name] = inserted
+            print(
+                f"Backfill {st.name}: {len(values)} Werte abgerufen, {inserted} neu gespeichert "
+                f"({_format_local(t_from)} – {_format_local(t_to)})"
+            )
+    return result
+
+
+def detect_gaps(
+    settings: Settings, storage: Storage, now: datetime
+) -> List[Tuple[StationConfig, datetime, datetime]]:
+    """
+    Lücken seit dem letzten gespeicherten Wert je Station (länger als 2 Poll-Intervalle, mind. 30 min).
+    Stationen ohne Historie bekommen backfill_initial_days.
+    """
+    min_gap = max(2 * settings.poll_interval_seconds, 1800)
+    ranges: List[Tuple[StationConfig, datetime, datetime]] = []
+    for st in settings.stations:
+        if st.source != HLNUG_PROVIDER:
+            continue  # der Zeitreihen-Endpunkt gibt es nur bei HLNUG
+        station_pk = storage.lookup_station_pk(st.station_no)
+        param_pk = storage.lookup_param_pk(st.parameter)
+        last_ts = None
+        if station_pk is not None and param_pk is not None:
+            last_ts = storage.con.execute(
+                "SELECT MAX(ts) FROM measurements WHERE station_pk = ? AND param_pk = ?", (station_pk, param_pk)
+            ).fetchone()[0]
+        if last_ts is None:
+            ranges.append((st, now - timedelta(days=settings.backfill_initial_days), now))
+        elif now.timestamp() - last_ts > min_gap:
+            ranges.append((st, datetime.fromtimestamp(last_ts, tz=timezone.utc), now))
+    return ranges
+
+
+def compact_storage(settings: Settings, storage: Storage, now: datetime) -> Dict[str, int]:
+    """
+    Löscht Zeilen jenseits der Aufbewahrung (Rohwerte und Rollups getrennt) und gibt Platz frei.
+    Gelöscht wird je Zeitreihe über den Primärschlüssel (station_pk, param_pk, ts), nicht per Full-Scan.
+    Zeitreihen aus den Dimensionstabellen (stations x parameters), nicht aus einer der Wertetabellen:
+    sonst blieben Rohwerte einer Station liegen, deren Tageswerte schon gelöscht sind
+    (z.B. daily_retention_days < raw_retention_days).
+    Rückgabe: Tabelle -> Anzahl gelöschter Zeilen.
+    """
+    con = storage.con
+    deleted: Dict[str, int] = {}
+    series = con.execute("SELECT station_pk, param_pk FROM stations CROSS JOIN parameters").fetchall()
+    retention = (
+        ("measurements", "ts", settings.raw_retention_days),
+        ("measurements_hourly", "bucket", settings.hourly_retention_days),
+        ("measurements_daily", "bucket", settings.daily_retention_days),
+    )
+    try:
+        for table, col, days in retention:
+            if days <= 0:
+                continue
+            cutoff = int(now.timestamp()) - days * 86400
+            deleted[table] = con.executemany(
+                f"DELETE FROM {table} WHERE station_pk = ? AND param_pk = ? AND {col} < ?",
+                [(station_pk, param_pk, cutoff) for station_pk, param_pk in series],
+            ).rowcount
+        db_set_state(con, "last_compaction", str(int(now.timestamp())))
         con.commit()
+    except BaseException:
+        storage.rollback()
+        raise
+
+    if any(deleted.values()):
+        if con.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # einmalig auf inkrementelles Auto-Vacuum umstellen (erfordert ein volles VACUUM)
+            con.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            con.execute("VACUUM")
+        else:
+            con.execute("PRAGMA incremental_vacuum")
+    return deleted
+
+
+def maybe_compact(settings: Settings, storage: Storage, now: datetime) -> None:
+    """Kompaktierung, wenn eine Aufbewahrung konfiguriert und compact_interval_hours abgelaufen ist."""
+    if not (settings.raw_retention_days or settings.hourly_retention_days or settings.daily_retention_days):
+        return
+    last = _parse_int_or_none(db_get_state(storage.con, "last_compaction"))
+    if last is not None and now.timestamp() - last < settings.compact_interval_hours * 3600:
+        return
+    deleted = compact_storage(settings, storage, now)
+    _debug_print(settings, f"[DEBUG] Kompaktierung: {deleted}")
+
+
+def _parse_cli_time(s: str) -> datetime:
+    """Datum/Zeit von der Kommandozeile (ISO, z.B. 2026-02-01 oder 2026-02-01T06:00); ohne Zone: Europe/Berlin."""
+    dt = _to_dt(s)
+    if dt is None:
+        raise ValueError(f"Ungültige Zeitangabe: {s!r} (erwartet ISO-Format, z.B. 2026-02-01)")
+    if dt.tzinfo is None:
+        tz = ZoneInfo("Europe/Berlin") if ZoneInfo is not None else timezone.utc
+        dt = dt.replace(tzinfo=tz)
+    return dt
+
+
+def _select_stations(settings: Settings, wanted: str) -> List[StationConfig]:
+    """Station per Name, station_no oder station_id_public auswählen; 'all' = alle konfigurierten."""
+    if wanted.strip().lower() == "all":
+        return list(settings.stations)
+    key = wanted.strip()
+    norm = _normalize_station_name(key)
+    out = [
+        st for st in settings.stations
+        if key in (st.station_no, st.station_id_public) or _normalize_station_name(st.name) == norm
+    ]
+    if not out:
+        raise ValueError(f"Station nicht in der Config: {wanted!r}")
+    return out
+
+
+@dataclass(frozen=True)
+class HistorySeries:
+    """Eine gespeicherte Zeitreihe (Station + Parameter) für Abfragen/Export."""
+    station_pk: int
+    param_pk: int
+    station_no: str
+    station_name: str
+    parameter: str
+    unit: str
+    thresholds_cm: Optional[Tuple[float, ...]]  # aus der aktuellen Config, None wenn nicht konfiguriert
+
+
+HISTORY_TABLES = {"raw": "measurements", "hourly": "measurements_hourly", "daily": "measurements_daily"}
+HISTORY_COLUMNS = {
+    "raw": ["station_no", "station_name", "parameter", "unit", "ts", "value"],
+    "hourly": ["station_no", "station_name", "parameter", "unit", "ts", "n", "v_min", "v_max", "v_mean", "v_last"],
+    "daily": ["station_no", "station_name", "parameter", "unit", "ts", "n", "v_min", "v_max", "v_mean", "v_last"],
+}
+
+
+def history_series(settings: Settings, storage: Storage, station: str = "all", parameter: Optional[str] = None) -> List[HistorySeries]:
+    """
+    Gespeicherte Zeitreihen, gefiltert nach Station (Name, station_no, station_id_public oder 'all')
+    und optional Parameter. Enthält auch Stationen, die nicht (mehr) in der Config stehen.
+    """
+    thresholds = {(st.station_no, st.parameter): st.thresholds_cm for st in settings.stations}
+    rows = storage.con.execute(
+        """
+        SELECT s.station_pk, p.param_pk, s.station_no, s.station_id_public, s.station_name, p.name, p.unit
+        FROM stations s CROSS JOIN parameters p
+        WHERE EXISTS (SELECT 1 FROM measurements m WHERE m.station_pk = s.station_pk AND m.param_pk = p.param_pk)
+           OR EXISTS (SELECT 1 FROM measurements_daily d WHERE d.station_pk = s.station_pk AND d.param_pk = p.param_pk)
+        ORDER BY s.station_name, p.name
+        """
+    ).fetchall()
+    key = station.strip()
+    norm = _normalize_station_name(key)
+    out = []
+    for station_pk, param_pk, no, sid, name, param, unit in rows:
+        if key.lower() != "all" and key not in (no, sid) and _normalize_station_name(name) != norm:
+            continue
+        if parameter and param != parameter:
+            continue
+        out.append(HistorySeries(station_pk, param_pk, no, name or "", param, unit or "", thresholds.get((no, param))))
+    return out
+
+
+def iter_history(
+    con: sqlite3.Connection,
+    series: List[HistorySeries],
+    t_from: int,
+    t_to: int,
+    resolution: str = "raw",
+    with_level: bool = False,
+    chunk_size: int = 5000,
+) -> Iterator[Tuple[Any, ...]]:
+    """
+    Zeilen im Bereich [t_from, t_to) (epoch s) je Zeitreihe, Spalten wie HISTORY_COLUMNS[resolution]
+    (+ level). Bereichsabfrage über den Primärschlüssel (station_pk, param_pk, ts) der WITHOUT-ROWID-Tabellen,
+    der die Werte mit enthält (covering); gelesen wird blockweise per fetchmany, der Speicherbedarf ist konstant.
+    level wird mit _compute_level aus den aktuellen Schwellen berechnet (bei Rollups aus v_max).
+    """
+    table = HISTORY_TABLES[resolution]
+    if resolution == "raw":
+        sql = f"SELECT ts, value FROM {table} WHERE station_pk = ? AND param_pk = ? AND ts >= ? AND ts < ? ORDER BY ts"
+    else:
+        sql = (
+            f"SELECT bucket, n, v_min, v_max, v_sum / n, v_last FROM {table} "
+            "WHERE station_pk = ? AND param_pk = ? AND bucket >= ? AND bucket < ? ORDER BY bucket"
+        )
+    level_col = 1 if resolution == "raw" else 3
+    for s in series:
+        head = (s.station_no, s.station_name, s.parameter, s.unit)
+        cur = con.execute(sql, (s.station_pk, s.param_pk, t_from, t_to))
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                if with_level:
+                    level = _compute_level(row[level_col], s.thresholds_cm) if s.thresholds_cm else None
+                    yield head + tuple(row) + (level,)
+                else:
+                    yield head + tuple(row)
+
+
+_LOCAL_TZ: Any = None
+
+
+def _iso_local(epoch: int) -> str:
+    """ISO-Zeitstempel in Europe/Berlin (Fallback UTC) für Exporte."""
+    global _LOCAL_TZ
+    if _LOCAL_TZ is None:
+        _LOCAL_TZ = timezone.utc
+        if ZoneInfo is not None:
+            try:
+                _LOCAL_TZ = ZoneInfo("Europe/Berlin")
+            except Exception:
+                pass
+    return datetime.fromtimestamp(epoch, tz=_LOCAL_TZ).isoformat()
+
+
+def _iso_utc_day(epoch: int) -> str:
+    """Datum eines Tages-Rollups (UTC-Tag, siehe _create_rollup_tables)."""
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).date().isoformat()
+
+
+def _arrow_schema(pa: Any, columns: List[str]) -> Any:
+    types = {"station_no": pa.string(), "station_name": pa.string(), "parameter": pa.string(), "unit": pa.string(),
+             "ts": pa.timestamp("s", tz="UTC"), "n": pa.int64(), "level": pa.int8()}
+    return pa.schema([(c, types.get(c, pa.float64())) for c in columns])
+
+
+def write_export(
+    rows: Iterable[Tuple[Any, ...]],
+    columns: List[str],
+    fmt: str,
+    out: Optional[Path],
+    chunk_size: int = 5000,
+    utc_days: bool = False,
+) -> int:
+    """
+    Schreibt Zeilen gestreamt als csv, jsonl, parquet oder arrow (IPC-Stream).
+    csv/jsonl ohne out -> stdout; parquet/arrow benötigen pyarrow und eine Ausgabedatei.
+    utc_days: ts als UTC-Datum statt als lokaler Zeitstempel (Tages-Rollups).
+    Rückgabe: Anzahl geschriebener Zeilen.
+    """
+    ts_idx = columns.index("ts")
+    fmt_ts = _iso_utc_day if utc_days else _iso_local
+    n = 0
+    if fmt in ("csv", "jsonl"):
+        f: TextIO = open(out, "w", encoding="utf-8", newline="") if out else sys.stdout
+        try:
+            if fmt == "csv":
+                w = csv.writer(f)
+                w.writerow(columns)
+                for row in rows:
+                    row = list(row)
+                    row[ts_idx] = fmt_ts(row[ts_idx])
+                    w.writerow(row)
+                    n += 1
+            else:
+                for row in rows:
+                    rec = dict(zip(columns, row))
+                    rec["ts"] = fmt_ts(rec["ts"])
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                    n += 1
+        finally:
+            if out:
+                f.close()
+        return n
+
+    if fmt not in ("parquet", "arrow"):
+        raise ValueError(f"Unbekanntes Exportformat: {fmt}")
+    if out is None:
+        raise ValueError(f"Format {fmt} benötigt --out DATEI")
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError(f"Format {fmt} benötigt das Paket pyarrow (pip install pyarrow)")
+
+    schema = _arrow_schema(pa, columns)
+    if fmt == "parquet":
+        writer = pyarrow.parquet.ParquetWriter(str(out), schema)
+    else:
+        writer = pyarrow.ipc.new_stream(str(out), schema)
+    try:
+        it = iter(rows)
+        while True:
+            batch = list(islice(it, chunk_size))
+            if not batch:
+                break
+            arrays = [pa.array(list(col), type=schema.field(i).type) for i, col in enumerate(zip(*batch))]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            n += len(batch)
+    finally:
+        writer.close()
+    return n
+
+
+def _history_range(args: argparse.Namespace, default_days: Optional[int]) -> Tuple[int, int]:
+    t_to = _parse_cli_time(args.t_to) if args.t_to else datetime.now(timezone.utc)
+    if args.t_from:
+        t_from = _parse_cli_time(args.t_from)
+    elif default_days is not None:
+        t_from = t_to - timedelta(days=default_days)
+    else:
+        t_from = datetime.fromtimestamp(0, tz=timezone.utc)
+    return int(t_from.timestamp()), int(t_to.timestamp())
+
+
+def run_history(settings: Settings, storage: Storage, args: argparse.Namespace) -> int:
+    """Subcommand history: Werte einer Station als Tabelle auf der Konsole (Default: letzte 24 h)."""
+    series = history_series(settings, storage, args.station, args.param)
+    if not series:
+        print(f"Keine gespeicherten Werte für Station {args.station!r}.", file=sys.stderr)
+        return 1
+    t_from, t_to = _history_range(args, default_days=1)
+    columns = HISTORY_COLUMNS[args.resolution] + (["level"] if args.level else [])
+    ts_idx = columns.index("ts")
+    n = 0
+    for row in iter_history(storage.con, series, t_from, t_to, args.resolution, args.level):
+        values = " | ".join(
+            f"{c}={v:.1f}" if isinstance(v, float) else f"{c}={v}"
+            for c, v in zip(columns[ts_idx + 1 :], row[ts_idx + 1 :])
+        )
+        if args.resolution == "daily":
+            when = datetime.fromtimestamp(row[ts_idx], tz=timezone.utc).strftime("%d.%m.%Y (UTC)")
+        else:
+            when = _format_local(datetime.fromtimestamp(row[ts_idx], tz=timezone.utc))
+        print(f"{row[1]} ({row[2]}) | {when} | {values}")
+        n += 1
+    _debug_print(settings, f"[DEBUG] history: {n} Zeilen")
+    return 0
+
+
+def run_export(settings: Settings, storage: Storage, args: argparse.Namespace) -> int:
+    """Subcommand export: alle (oder ausgewählte) Zeitreihen gestreamt als CSV/JSONL/Parquet/Arrow."""
+    series = history_series(settings, storage, args.station, args.param)
+    t_from, t_to = _history_range(args, default_days=None)
+    columns = HISTORY_COLUMNS[args.resolution] + (["level"] if args.level else [])
+    out = Path(args.out) if args.out else None
+    n = write_export(
+        iter_history(storage.con, series, t_from, t_to, args.resolution, args.level),
+        columns, args.format, out, utc_days=args.resolution == "daily",
+    )
+    if out:
+        print(f"Export: {n} Zeilen aus {len(series)} Zeitreihen nach {out}", file=sys.stderr)
+    return 0
+
+
+def reclassify(settings: Settings, storage: Storage, station: str = "all", chunk_size: int = 50000, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Schreibt die Spalte level in measurements nach den aktuellen Schwellen neu (z.B. nach Änderung
+    von thresholds_cm). Blockweise per Keyset-Pagination über den Primärschlüssel, Klassifikation
+    mit classify_levels, nur geänderte Zeilen werden aktualisiert; ein Commit pro Block.
+    Rückgabe: Station -> Anzahl geänderter Zeilen.
+    """
+    con = storage.con
+    changed: Dict[str, int] = {}
+    for s in history_series(settings, storage, station):
+        if s.thresholds_cm is None:
+            continue  # Station nicht (mehr) in der Config: keine Schwellen bekannt
+        n_changed = 0
+        last_ts = -(2 ** 62)
+        while True:
+            rows = con.execute(
+                "SELECT ts, value, level FROM measurements WHERE station_pk = ? AND param_pk = ? AND ts > ? "
+                "ORDER BY ts LIMIT ?",
+                (s.station_pk, s.param_pk, last_ts, chunk_size),
+            ).fetchall()
+            if not rows:
+                break
+            levels = classify_levels([r[1] for r in rows], s.thresholds_cm)
+            updates = [(lvl, s.station_pk, s.param_pk, r[0]) for r, lvl in zip(rows, levels) if r[2] != lvl]
+            if updates and not dry_run:
+                con.executemany(
+                    "UPDATE measurements SET level = ? WHERE station_pk = ? AND param_pk = ? AND ts = ?", updates
+                )
+                con.commit()
+            n_changed += len(updates)
+            last_ts = rows[-1][0]
+        changed[s.station_name] = n_changed
+    return changed
+
+
+def run_reclassify(settings: Settings, storage: Storage, args: argparse.Namespace) -> int:
+    """Subcommand reclassify: Warnstufen aller gespeicherten Werte nach aktuellen Schwellen neu berechnen."""
+    t0 = time.perf_counter()
+    changed = reclassify(settings, storage, args.station, args.chunk, args.dry_run)
+    for name, n in changed.items():
+        print(f"{name}: {n} Werte {'würden geändert' if args.dry_run else 'geändert'}")
+    print(f"Reclassify: {sum(changed.values())} Werte in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    return 0
+
+
+@dataclass(frozen=True)
+class AlertEvent:
+    """Ein Alarm, der bei der Wiedergabe historischer Messwerte ausgelöst worden wäre."""
+    ts: int  # epoch s des auslösenden Messwerts
+    station: StationConfig
+    th_idx: int  # Index in thresholds_cm oder TREND_ALERT_IDX (schneller Anstieg)
+    value: float
+    level: int
+
+
+def _replay_loop(
+    settings: Settings, station: StationConfig, ts: Sequence[int], values: Sequence[float], cold_start: bool
+) -> List[AlertEvent]:
+    """Referenz: jeden Messwert wie check_once durch TrendWindow und evaluate_sample schicken."""
+    states: Dict[int, AlertState] = {}
+
+    def state_for(idx: int) -> AlertState:
+        st = states.get(idx)
+        if st is None:
+            st = states[idx] = AlertState(armed=None if cold_start else True)
+        return st
+
+    window = TrendWindow(settings.trend_window_size)
+    events = []
+    for t, v in zip(ts, values):
+        t = int(t)
+        if not window.push(t, v):
+            continue
+        slope = window.slope() if window.count >= settings.trend_min_samples else None
+        level = _compute_level(v, station.thresholds_cm)
+        for th_idx in evaluate_sample(settings, station, state_for, v, t, level, slope):
+            _mark_fired(states[th_idx], t)
+            events.append(AlertEvent(t, station, th_idx, float(v), level))
+    return events
+
+
+def _rolling_slopes(ts: Any, values: Any, window: int, first: int) -> Any:
+    """
+    Steigung der Regressionsgeraden (Einheit/Stunde) über die letzten `window` Werte je Position,
+    wie TrendWindow.slope(); Positionen vor `first` und ohne Steigung sind NaN.
+    """
+    n = len(ts)
+    x = (ts - ts[0]) / 3600.0
+    out = np.full(n, np.nan)
+
+    def fill(xs: Any, ys: Any, at: Any) -> None:
+        xs = xs - xs[:, :1]  # Ursprung je Fenster, wie TrendWindow (kleine Quadratsummen)
+        k = xs.shape[1]
+        sx, sy = xs.sum(axis=1), ys.sum(axis=1)
+        den = k * (xs * xs).sum(axis=1) - sx * sx
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out[at] = np.where(den > 1e-12, (k * (xs * ys).sum(axis=1) - sx * sy) / den, np.nan)
+
+    for k in range(max(first, 1), min(window - 1, n)):  # Anlauf: Fenster noch nicht voll
+        fill(x[None, : k + 1], values[None, : k + 1], slice(k, k + 1))
+    if n >= window:
+        view = np.lib.stride_tricks.sliding_window_view
+        fill(view(x, window), view(values, window), slice(window - 1, n))
+    out[:first] = np.nan
+    return out
+
+
+def _fire_positions(ts: Any, cond: Any, armed: Optional[bool], rearm_s: float, alert_on_start: bool) -> List[int]:
+    """
+    Arm/Re-Arm-Logik von _alert_due über Läufe gleicher Bedingung statt je Messwert:
+    ein Lauf "erfüllt" löst an seinem ersten Wert aus, wenn scharf; ein Lauf "nicht erfüllt" macht
+    wieder scharf, wenn darin ein späterer Wert mindestens rearm_s nach dem ersten liegt.
+    """
+    n = len(cond)
+    if n == 0:
+        return []
+    change = np.flatnonzero(cond[1:] != cond[:-1]) + 1
+    starts = np.concatenate(([0], change)).tolist()
+    ends = np.concatenate((change, [n])).tolist()
+    fired = []
+    for a, b in zip(starts, ends):
+        if cond[a]:
+            if armed is None:
+                if alert_on_start:
+                    fired.append(a)
+                armed = False
+            elif armed:
+                fired.append(a)
+                armed = False
+        elif armed is False and b - a >= 2 and ts[b - 1] - ts[a] >= rearm_s:
+            armed = True
+    return fired
+
+
+def replay_series(
+    settings: Settings, station: StationConfig, ts: Sequence[int], values: Sequence[float], cold_start: bool = False
+) -> List[AlertEvent]:
+    """
+    Alle Alarme, die check_once für diese Messwerte (aufsteigende Zeitpunkte) ausgelöst hätte –
+    ohne DB, Mail oder Ausgabe; vorausgesetzt, E-Mail ist konfiguriert (Alarm disarmt).
+    cold_start: Zustand wie bei einer neuen DB (alert_on_start gilt), sonst alle Schwellen scharf.
+    Mit NumPy über Läufe gleicher Bedingung (Aufwand ~ Zahl der Wechsel), sonst Wert für Wert.
+    """
+    if np is None:
+        return _replay_loop(settings, station, ts, values, cold_start)
+    t = np.asarray(ts, dtype=np.int64)
+    v = np.asarray(values, dtype=np.float64)
+    if len(t) > 1 and not (t[1:] > t[:-1]).all():
+        # wie TrendWindow.push: nur echt neuere Zeitpunkte zählen
+        keep = np.concatenate(([True], t[1:] > np.maximum.accumulate(t)[:-1]))
+        t, v = t[keep], v[keep]
+    armed0: Optional[bool] = None if cold_start else True
+    rearm_s = settings.rearm_below_hours * 3600
+    hits: List[Tuple[int, int]] = []  # (Position, th_idx)
+    for th_idx, th in enumerate(station.thresholds_cm):
+        hits += [(pos, th_idx) for pos in _fire_positions(t, v >= th, armed0, rearm_s, settings.alert_on_start)]
+    if station.rise_cm_per_hour > 0 and len(t) >= settings.trend_min_samples:
+        slopes = _rolling_slopes(t, v, settings.trend_window_size, settings.trend_min_samples - 1)
+        valid = np.flatnonzero(~np.isnan(slopes))  # ohne Steigung wird der Zustand nicht angefasst
+        cond = slopes[valid] >= station.rise_cm_per_hour
+        for pos in _fire_positions(t[valid], cond, armed0, rearm_s, settings.alert_on_start):
+            hits.append((int(valid[pos]), TREND_ALERT_IDX))
+    # Reihenfolge wie evaluate_sample: je Messwert Schwellen aufsteigend, dann Anstieg
+    hits.sort(key=lambda h: (h[0], h[1] if h[1] != TREND_ALERT_IDX else len(station.thresholds_cm)))
+    return [
+        AlertEvent(int(t[pos]), station, th_idx, float(v[pos]), _compute_level(float(v[pos]), station.thresholds_cm))
+        for pos, th_idx in hits
+    ]
+
+
+def _load_index_archive(settings: Settings, paths: Sequence[Path]) -> Dict[StationConfig, Tuple[List[int], List[float]]]:
+    """Zeitreihen je Station aus gespeicherten index.json-Dateien (Reihenfolge egal, Duplikate entfallen)."""
+    points: Dict[StationConfig, Dict[int, float]] = {st: {} for st in settings.stations}
+    for path in paths:
+        try:
+            index_map = build_index_map(json.loads(path.read_bytes()))
+        except (OSError, ValueError) as e:
+            print(f"Replay: {path} übersprungen: {e}", file=sys.stderr)
+            continue
+        for st in settings.stations:
+            try:
+                rec = latest_for_station(index_map, st)
+            except Exception:
+                continue
+            points[st][int(rec.ts.timestamp())] = rec.value
+    return {st: (sorted(p), [p[t] for t in sorted(p)]) for st, p in points.items() if p}
+
+
+def replay(
+    settings: Settings,
+    storage: Optional[Storage],
+    station: str = "all",
+    t_from: int = -(2 ** 62),
+    t_to: int = 2 ** 62,
+    archive: Optional[Sequence[Path]] = None,
+    cold_start: bool = False,
+) -> Tuple[List[AlertEvent], int]:
+    """
+    Historische Messwerte (measurements bzw. index.json-Archiv) durch den Alarm-Zustandsautomaten
+    schicken. Rückgabe: (Alarme nach Zeit sortiert, Anzahl verarbeiteter Messwerte).
+    """
+    selected = _select_stations(settings, station)
+    if archive:
+        series = _load_index_archive(settings, archive)
+        series = {
+            st: ([t for t in ts if t_from <= t < t_to], [v for t, v in zip(ts, vals) if t_from <= t < t_to])
+            for st, (ts, vals) in series.items()
+            if st in selected
+        }
+    else:
+        series = {}
+        for st in selected:
+            spk = storage.lookup_station_pk(st.station_no)
+            ppk = storage.lookup_param_pk(st.parameter)
+            if spk is None or ppk is None:
+                continue
+            rows = storage.con.execute(
+                "SELECT ts, value FROM measurements WHERE station_pk = ? AND param_pk = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                (spk, ppk, t_from, t_to),
+            ).fetchall()
+            series[st] = ([r[0] for r in rows], [r[1] for r in rows])
+    events: List[AlertEvent] = []
+    n_values = 0
+    for st, (ts, values) in series.items():
+        n_values += len(ts)
+        events += replay_series(settings, st, ts, values, cold_start)
+    events.sort(key=lambda e: e.ts)
+    return events, n_values
+
+
+def run_replay(settings: Settings, storage: Optional[Storage], args: argparse.Namespace) -> int:
+    """Subcommand replay: Alarme ausgeben, die für die gespeicherten Messwerte ausgelöst worden wären."""
+    t0 = time.perf_counter()
+    t_from = int(_parse_cli_time(args.t_from).timestamp()) if args.t_from else -(2 ** 62)
+    t_to = int(_parse_cli_time(args.t_to).timestamp()) if args.t_to else 2 ** 62
+    archive = _expand_archive(args.index) if args.index else None
+    events, n_values = replay(settings, storage, args.station, t_from, t_to, archive, args.cold_start)
+    for e in events:
+        # Einheit wie bei history/export aus parameters.unit (Archiv ohne DB: keine Einheit)
+        unit = storage.lookup_param_unit(e.station.parameter) if storage is not None else ""
+        unit_disp = f" {unit}".rstrip()
+        if e.th_idx == TREND_ALERT_IDX:
+            detail = f"Anstieg >= {e.station.rise_cm_per_hour:.1f}{unit_disp}/h"
+        else:
+            detail = f">= {e.station.thresholds_cm[e.th_idx]:.1f}{unit_disp}"
+        when = datetime.fromtimestamp(e.ts, timezone.utc)
+        if args.format == "jsonl":
+            print(json.dumps({
+                "ts": when.isoformat(),
+                "station": e.station.name,
+                "station_no": e.station.station_no,
+                "parameter": e.station.parameter,
+                "alert": _alert_name(e.station, e.th_idx),
+                "threshold": None if e.th_idx == TREND_ALERT_IDX else e.station.thresholds_cm[e.th_idx],
+                "value": e.value,
+                "level": e.level,
+            }, ensure_ascii=False))
+        else:
+            print(f"{_format_local(when)} | {e.station.name} | {_alert_name(e.station, e.th_idx)} ({detail}) | {e.value:.1f}{unit_disp}")
+    print(
+        f"Replay: {len(events)} Alarme aus {n_values} Messwerten in {time.perf_counter() - t0:.2f}s",
+        file=sys.stderr,
+    )
+    return 0
+
+
+def _expand_archive(items: Sequence[str]) -> List[Path]:
+    """Dateien und Verzeichnisse (alle *.json darin) eines index.json-Archivs."""
+    out: List[Path] = []
+    for item in items:
+        p = Path(item)
+        out += sorted(p.glob("*.json")) if p.is_dir() else [p]
+    return out
+
+
+@dataclass(frozen=True)
+class FloodEvent:
+    """Zusammenhängender Zeitraum mit Pegel >= Ereignis-Schwelle (für tune)."""
+    start: int
+    peak: int
+    end: int
+    peak_value: float
+
+
+def flood_events(ts: Sequence[int], values: Sequence[float], level: float, merge_gap_s: int = 6 * 3600) -> List[FloodEvent]:
+    """Ereignisse (Werte >= level); Unterbrechungen kürzer als merge_gap_s gehören zum selben Ereignis."""
+    events: List[FloodEvent] = []
+    cur: Optional[List[Any]] = None  # [start, peak_ts, last_ts, peak_value]
+    for t, v in zip(ts, values):
+        if v < level:
+            continue
+        t = int(t)
+        if cur is not None and t - cur[2] <= merge_gap_s:
+            cur[2] = t
+            if v > cur[3]:
+                cur[1], cur[3] = t, v
+            continue
+        if cur is not None:
+            events.append(FloodEvent(cur[0], cur[1], cur[2], cur[3]))
+        cur = [t, t, t, v]
+    if cur is not None:
+        events.append(FloodEvent(cur[0], cur[1], cur[2], cur[3]))
+    return events
+
+
+def score_alerts(
+    alerts: Sequence[AlertEvent], floods: Sequence[FloodEvent], lookback_s: int, flap_s: int
+) -> Dict[str, Any]:
+    """
+    Kennzahlen einer Parameter-Kombination:
+    - alerts: Alarme gesamt und je Stufe
+    - flapping: erneuter Alarm derselben Stufe weniger als flap_s nach dem vorigen
+    - Ereignisse getroffen/verpasst: erster Alarm höchstens lookback_s vor dem Scheitel bis zum Scheitel;
+      lead: Vorlauf (Scheitel - erster Alarm) in Stunden, Median/Minimum über die getroffenen Ereignisse
+    """
+    per_level: Dict[int, int] = {}
+    last: Dict[int, int] = {}
+    flapping = 0
+    for a in alerts:
+        per_level[a.th_idx] = per_level.get(a.th_idx, 0) + 1
+        prev = last.get(a.th_idx)
+        if prev is not None and a.ts - prev < flap_s:
+            flapping += 1
+        last[a.th_idx] = a.ts
+    times = [a.ts for a in alerts]
+    leads: List[float] = []
+    for ev in floods:
+        k = bisect.bisect_left(times, ev.peak - lookback_s)
+        if k < len(times) and times[k] <= ev.peak:
+            leads.append((ev.peak - times[k]) / 3600.0)
+    leads.sort()
+    return {
+        "alerts": len(alerts),
+        "per_level": [per_level.get(i, 0) for i in range(max(per_level, default=-1) + 1)],
+        "flapping": flapping,
+        "events": len(floods),
+        "hit": len(leads),
+        "missed": len(floods) - len(leads),
+        "lead_median_h": leads[len(leads) // 2] if leads else None,
+        "lead_min_h": leads[0] if leads else None,
+    }
+
+
+# Zustand der tune-Worker (einmal je Prozess über den Initializer gesetzt)
+_TUNE: Dict[str, Any] = {}
+
+
+def _tune_init(settings: Settings, station: StationConfig, history: Any, floods: List[FloodEvent], lookback_s: int, flap_s: int) -> None:
+    """
+    Initializer der tune-Worker: Historie genau einmal je Prozess übernehmen. Mit NumPy liegt sie in
+    einem SharedMemory-Block des Hauptprozesses (history = (Name, Anzahl), nur Sichten, keine Kopie),
+    sonst als array('d')-Paar.
+    """
+    if isinstance(history[0], str):
+        from multiprocessing import shared_memory
+
+        shm = shared_memory.SharedMemory(name=history[0])
+        n = history[1]
+        _TUNE["shm"] = shm  # Referenz halten, sonst wird der Block geschlossen
+        ts = np.ndarray((n,), dtype=np.int64, buffer=shm.buf)
+        values = np.ndarray((n,), dtype=np.float64, buffer=shm.buf, offset=n * 8)
+    else:
+        ts, values = history
+    _TUNE.update(settings=settings, station=station, ts=ts, values=values, floods=floods, lookback_s=lookback_s, flap_s=flap_s)
+
+
+def _tune_eval(combo: Tuple[Tuple[float, ...], float]) -> Dict[str, Any]:
+    thresholds, rearm_h = combo
+    t = _TUNE
+    settings = replace(t["settings"], rearm_below_hours=rearm_h)
+    station = replace(t["station"], thresholds_cm=thresholds, rise_cm_per_hour=0.0)
+    alerts = replay_series(settings, station, t["ts"], t["values"])
+    res = score_alerts(alerts, t["floods"], t["lookback_s"], t["flap_s"])
+    res.update(thresholds=list(thresholds), rearm_h=rearm_h)
+    return res
+
+
+def tune(
+    settings: Settings,
+    station: StationConfig,
+    ts: Sequence[int],
+    values: Sequence[float],
+    threshold_sets: Sequence[Tuple[float, ...]],
+    rearm_hours: Sequence[float],
+    event_level: float,
+    lookback_h: float = 48.0,
+    flap_h: float = 24.0,
+    workers: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Bewertet alle Kombinationen threshold_sets x rearm_hours für eine Station auf ihrer Historie
+    (replay_series je Kombination, Kennzahlen siehe score_alerts). Die Historie wird einmal dekodiert
+    und von allen Worker-Prozessen gemeinsam genutzt; kleine Raster laufen ohne Pool.
+    """
+    combos = [(tuple(th), float(h)) for th in threshold_sets for h in rearm_hours]
+    floods = flood_events(ts, values, event_level)
+    lookback_s, flap_s = int(lookback_h * 3600), int(flap_h * 3600)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(combos)))
+    shm = None
+    if np is not None:
+        n = len(ts)
+        from multiprocessing import shared_memory
+
+        shm = shared_memory.SharedMemory(create=True, size=max(1, n * 16))
+        np.ndarray((n,), dtype=np.int64, buffer=shm.buf)[:] = ts
+        np.ndarray((n,), dtype=np.float64, buffer=shm.buf, offset=n * 8)[:] = values
+        history: Any = (shm.name, n)
+    else:
+        history = (array("q", ts), array("d", values))
+    init_args = (settings, station, history, floods, lookback_s, flap_s)
+    try:
+        if workers == 1 or len(combos) < 8:
+            _tune_init(*init_args)
+            try:
+                return [_tune_eval(c) for c in combos]
+            finally:
+                _TUNE.clear()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_tune_init, initargs=init_args) as pool:
+            return list(pool.map(_tune_eval, combos, chunksize=max(1, len(combos) // (workers * 4))))
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+
+def _parse_range(spec: str) -> List[float]:
+    """'a:b:step' (inklusive b) oder 'x,y,z' -> Liste von Zahlen."""
+    if ":" in spec:
+        a, b, step = (float(x) for x in spec.split(":"))
+        if step <= 0:
+            raise ValueError(f"Schrittweite muss > 0 sein: {spec!r}")
+        n = int(math.floor((b - a) / step + 1e-9)) + 1
+        return [round(a + i * step, 6) for i in range(max(0, n))]
+    return [float(x) for x in spec.split(",") if x.strip()]
+
+
+def run_tune(settings: Settings, storage: Storage, args: argparse.Namespace) -> int:
+    """Subcommand tune: Raster aus Schwellen-Sätzen und Re-Arm-Dauern auf der Historie einer Station bewerten."""
+    stations = _select_stations(settings, args.station)
+    if len(stations) != 1:
+        raise SystemExit(f"tune: --station muss genau eine Station wählen ({len(stations)} gefunden)")
+    station = stations[0]
+    t_from = int(_parse_cli_time(args.t_from).timestamp()) if args.t_from else -(2 ** 62)
+    t_to = int(_parse_cli_time(args.t_to).timestamp()) if args.t_to else 2 ** 62
+
+    t0 = time.perf_counter()
+    spk = storage.lookup_station_pk(station.station_no)
+    ppk = storage.lookup_param_pk(station.parameter)
+    rows = [] if spk is None or ppk is None else storage.con.execute(
+        "SELECT ts, value FROM measurements WHERE station_pk = ? AND param_pk = ? AND ts >= ? AND ts < ? ORDER BY ts",
+        (spk, ppk, t_from, t_to),
+    ).fetchall()
+    if not rows:
+        raise SystemExit(f"tune: keine Messwerte für {station.name} im Zeitraum")
+    ts = array("q", (r[0] for r in rows))
+    values = array("d", (r[1] for r in rows))
+
+    base = station.thresholds_cm
+    sets: List[Tuple[float, ...]] = [tuple(_parse_range(x)) for x in args.set or []]
+    for off in _parse_range(args.offset) if args.offset else []:
+        sets.append(tuple(round(th + off, 3) for th in base))
+    for f in _parse_range(args.scale) if args.scale else []:
+        sets.append(tuple(round(th * f, 3) for th in base))
+    if not args.set and not args.offset and not args.scale:
+        sets.append(base)
+    sets = list(dict.fromkeys(sets))  # Reihenfolge behalten, Duplikate entfernen
+    for th in sets:
+        if not th or any(b <= a for a, b in zip(th, th[1:])):
+            raise SystemExit(f"tune: Schwellen müssen aufsteigend sein: {th}")
+    rearms = _parse_range(args.rearm) if args.rearm else [settings.rearm_below_hours]
+    event_level = args.event_level if args.event_level is not None else base[-1]
+
+    results = tune(settings, station, ts, values, sets, rearms, event_level, args.lookback, args.flap, args.workers)
+    elapsed = time.perf_counter() - t0
+    # beste zuerst: wenig verpasste Ereignisse, dann wenig Flattern, wenig Alarme, langer Vorlauf
+    results.sort(key=lambda r: (r["missed"], r["flapping"], r["alerts"], -(r["lead_median_h"] or 0.0)))
+    current = (tuple(base), float(settings.rearm_below_hours))
+
+    if args.format == "jsonl":
+        for r in results[: args.top]:
+            print(json.dumps(r, ensure_ascii=False))
+    else:
+        print(
+            f"Station: {station.name} | {len(values)} Messwerte | Ereignisse (>= {event_level:.1f} cm): "
+            f"{results[0]['events'] if results else 0} | Vorlauf bis {args.lookback:g} h, Flattern < {args.flap:g} h"
+        )
+        print(f"  {'Schwellen (cm)':<28} {'Re-Arm':>6} {'Alarme':>6} {'je Stufe':<16} {'Flattern':>8} {'verpasst':>8} {'Vorlauf':>8}")
+        for r in results[: args.top]:
+            mark = "*" if (tuple(r["thresholds"]), r["rearm_h"]) == current else " "
+            th = "/".join(f"{x:g}" for x in r["thresholds"])
+            lead = "-" if r["lead_median_h"] is None else f"{r['lead_median_h']:.1f} h"
+            per_level = "/".join(str(x) for x in r["per_level"]) or "-"
+            print(
+                f"{mark} {th:<28} {r['rearm_h']:>5g}h {r['alerts']:>6} {per_level:<16} "
+                f"{r['flapping']:>8} {r['missed']:>4}/{r['events']:<3} {lead:>8}"
+            )
+        print("  * = aktuelle Config")
+    print(f"Tune: {len(results)} Kombinationen in {elapsed:.2f}s", file=sys.stderr)
+    return 0
+
+
+@dataclass(eq=False)
+class Tenant:
+    """
+    Ein Mandant im Mehrmandanten-Betrieb: eigene Config (Stationen, Schwellen, Empfänger) und eigene DB.
+    Identität ist das Objekt (eq=False, hashbar); name dient nur der Ausgabe.
+    """
+    name: str
+    settings: Settings
+    ctx: PollContext
+
+
+class TenantHub:
+    """
+    Mehrmandanten-Betrieb: N Configs in einem Prozess. Gleiche Quellen (gleiche URL und Abbildung)
+    werden über alle Mandanten zusammengefasst und pro Zyklus einmal abgerufen, geparst und indiziert.
+    subscribers (Quelle -> (station_no, parameter) -> [(Mandant, Station)]) verteilt neue Messwerte:
+    ausgewertet werden nur Mandanten mit einem neuen Messwert einer ihrer Stationen.
+    """
 
+    def __init__(self, tenants: List[Tenant]):
+        self.tenants = tenants
+        self.metrics = Metrics()  # gemeinsamer Abruf (fetch/http/decode/index je Zyklus)
+        self.sources: Optional[SourceFetcher] = None
+        self._merge()
+        self.last_cycle: Optional[CycleSummary] = None
+        self.metrics_server: Optional[MetricsServer] = None
+
+    def _merge(self) -> None:
+        """Quellen und Abonnements aus den aktuellen Settings der Mandanten (neu) aufbauen."""
+        tenants = self.tenants
+        upstream_of: Dict[ProviderConfig, str] = {}
+        providers: Dict[str, ProviderConfig] = {}
+        stations: Dict[Tuple[str, str, str], StationConfig] = {}
+        self.subscribers: Dict[str, Dict[Tuple[str, str], List[Tuple[Tenant, StationConfig]]]] = {}
+        for tenant in tenants:
+            for st in tenant.settings.stations:
+                provider = tenant.settings.providers[st.source]
+                key = replace(provider, name="", timeout_seconds=0)
+                name = upstream_of.get(key)
+                if name is None:
+                    name = provider.name if provider.name not in providers else f"{provider.name}-{len(providers) + 1}"
+                    upstream_of[key] = name
+                    providers[name] = replace(provider, name=name)
+                elif provider.timeout_seconds > providers[name].timeout_seconds:
+                    providers[name] = replace(providers[name], timeout_seconds=provider.timeout_seconds)
+                stations.setdefault((name, st.station_no, st.parameter), replace(st, source=name))
+                self.subscribers.setdefault(name, {}).setdefault((st.station_no, st.parameter), []).append((tenant, st))
+        base = tenants[0].settings
+        providers.setdefault(HLNUG_PROVIDER, base.providers[HLNUG_PROVIDER])
+        # Abruf-Settings: alle unterschiedlichen Stationen (für den Streaming-Filter) und Quellen
+        self.settings = replace(
+            base,
+            stations=list(stations.values()),
+            providers=providers,
+            debug=any(t.settings.debug for t in tenants),
+        )
+        # nur bei geänderten Stationen/Quellen neu aufbauen (sonst gingen Sessions und ETags verloren)
+        if self.sources is None or _fetch_identity(self.sources.settings) != _fetch_identity(self.settings):
+            if self.sources is not None:
+                self.sources.close()
+            self.sources = SourceFetcher(self.settings, self.metrics)
+        # Takt nach dem Mandanten mit dem kürzesten Intervall
+        self.scheduler_settings = min((t.settings for t in tenants), key=lambda st: st.poll_interval_seconds)
+
+    def reload(self, tenant: Tenant, new: Settings) -> None:
+        """Geänderte Config eines Mandanten übernehmen (zwischen zwei Zyklen) und Abonnements neu verteilen."""
+        tenant.settings = apply_reload(tenant.ctx, new, label=f"[{tenant.name}] Config")
+        self._merge()
+
+    def close(self) -> None:
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            self.metrics_server = None
+        self.sources.close()
+        for tenant in self.tenants:
+            tenant.ctx.close()
+
+
+def _affected_tenants(
+    subscribers: Dict[Tuple[str, str], List[Tuple[Tenant, StationConfig]]], index_map: StationIndex
+) -> Tuple[Dict[Tenant, List[StationConfig]], Dict[Tuple[str, str], Union[MeasurementRecord, Exception]]]:
+    """
+    Mandanten mit neuen Messwerten und deren betroffene Stationen, dazu der aufgelöste Eintrag (bzw. der
+    Fehler) je Station für evaluate_stations: Lookup einmal je Station, nicht je Mandant.
+    Fehlt ein Eintrag, ist jeder abonnierende Mandant in jedem Zyklus betroffen, damit der Fehler wie im
+    Einzelbetrieb gemeldet wird.
+    """
+    affected: Dict[Tenant, List[StationConfig]] = {}
+    records: Dict[Tuple[str, str], Union[MeasurementRecord, Exception]] = {}
+    for key, subs in subscribers.items():
+        try:
+            rec = records[key] = latest_for_station(index_map, subs[0][1])
+            ts_epoch: Optional[int] = int(rec.ts.timestamp())
+        except Exception as e:
+            records[key] = e
+            ts_epoch = None
+        for tenant, st in subs:
+            seen = tenant.ctx.last_seen.get(key)
+            if ts_epoch is None or seen is None or seen[0] != ts_epoch:
+                affected.setdefault(tenant, []).append(st)
+    return affected, records
+
+
+def check_tenants(hub: TenantHub) -> int:
+    """
+    Ein Zyklus im Mehrmandanten-Betrieb: jede Quelle einmal abrufen und indizieren, dann nur die
+    betroffenen Stationen der betroffenen Mandanten auswerten (je Mandant eine Transaktion in dessen DB).
+    Fehler eines Mandanten (z.B. DB gesperrt) halten die anderen nicht auf.
+    """
+    metrics = hub.metrics
+    now = datetime.now(timezone.utc)
+    totals: Dict[Tenant, CycleTotals] = {}
+    any_fail = False
+    fetch_s = 0.0
+    results = hub.sources.fetch()
+    while True:
+        t0 = time.perf_counter()
+        result = next(results, None)
+        fetch_s += time.perf_counter() - t0
+        if result is None:
+            break
+        provider, arr, err = result
+        subscribers = hub.subscribers.get(provider, {})
+        if err is not None:
+            any_fail = True
+            metrics.inc("pegel_fetch_failures_total", provider=provider)
+            failed = {t for subs in subscribers.values() for t, _ in subs}
+            for tenant in failed:
+                totals.setdefault(tenant, CycleTotals()).station_errors = True
+            print(f"Fehler beim Abruf der Quelle '{provider}' ({len(failed)} Mandanten): {err}", file=sys.stderr)
+            continue
+        if arr is None:
+            print(f"Quelle '{provider}' unverändert (HTTP 304) – Auswertung übersprungen.")
+            continue
+        with metrics.phase("index"):
+            index_map = build_index_map(arr, index_source(hub.settings.providers[provider]))
+            affected, records = _affected_tenants(subscribers, index_map)
+        _debug_print(
+            hub.settings,
+            f"[DEBUG] {provider}: {len(subscribers)} Stationen, betroffene Mandanten: {len(affected)}",
+        )
+        for tenant in hub.tenants:
+            stations = affected.get(tenant)
+            if not stations:
+                continue
+            name = tenant.name
+            print(f"[{name}]")
+            tenant_totals = totals.setdefault(tenant, CycleTotals())
+            try:
+                evaluate_stations(tenant.settings, tenant.ctx, stations, index_map, now, tenant_totals, records)
+            except Exception as e:
+                tenant_totals.station_errors = True
+                print(f"Fehler bei Mandant '{name}': {e}", file=sys.stderr)
+    metrics.record_phase("fetch", fetch_s)
+
+    summaries = []
+    for tenant in hub.tenants:
+        t = totals.get(tenant)
+        if t is None:
+            tenant.ctx.metrics.end_cycle("not_modified")
+            continue
+        any_fail = any_fail or t.station_errors
+        if t.evaluated:
+            tenant.ctx.last_cycle = t.summary
+            summaries.append(t.summary)
+        tenant.ctx.metrics.inc("pegel_new_samples_total", t.new_samples)
+        tenant.ctx.metrics.end_cycle(
+            "ok" if t.evaluated else "error",
+            stations=len(tenant.settings.stations),
+            new_samples=t.new_samples,
+            alerts=t.alerts,
+            station_errors=t.station_errors,
+            max_data_age_seconds=round(t.max_data_age, 1),
+        )
+    hub.last_cycle = None
+    if summaries:
+        newest = [s.newest_ts for s in summaries if s.newest_ts is not None]
+        hub.last_cycle = CycleSummary(
+            max(newest) if newest else None,
+            max(s.max_level for s in summaries),
+            any(s.rising for s in summaries),
+        )
+    metrics.end_cycle(
+        "ok" if summaries else "not_modified",
+        tenants=len(hub.tenants),
+        evaluated_tenants=sum(t.evaluated for t in totals.values()),
+        new_samples=sum(t.new_samples for t in totals.values()),
+    )
     return 1 if any_fail else 0
 
 
+def _tenant_names(paths: Sequence[Path]) -> List[str]:
+    """
+    Eindeutige Anzeigenamen: Dateiname ohne .json, bei Gleichnamigen (z.B. acme/config-pegel.json und
+    globex/config-pegel.json) mit Verzeichnis, notfalls der vollständige Pfad.
+    """
+    names = [p.stem for p in paths]
+    for candidate in (lambda p: f"{p.parent.name}/{p.stem}", lambda p: str(p.resolve())):
+        counts = Counter(names)
+        names = [candidate(p) if counts[n] > 1 else n for p, n in zip(paths, names)]
+    return names
+
+
+def load_tenants(paths: Sequence[Path]) -> List[Tenant]:
+    """
+    Configs laden (Name: siehe _tenant_names); jede Config braucht eine eigene DB, dieselbe Datei
+    darf nur einmal vorkommen. Mails werden im Hintergrund versendet, sobald eine Config runtime.mode=daemon hat.
+    """
+    resolved = [Path(p).resolve() for p in paths]
+    dup = next((p for p, n in Counter(resolved).items() if n > 1), None)
+    if dup is not None:
+        raise SystemExit(f"Mandant {dup}: Config mehrfach angegeben")
+    loaded: List[Tuple[str, Settings]] = []
+    by_db: Dict[Path, str] = {}
+    for path, name in zip(paths, _tenant_names(resolved)):
+        try:
+            settings = load_settings(path)
+        except Exception as e:
+            raise SystemExit(f"Mandant {path}: {e}")
+        if settings.db_path in by_db:
+            raise SystemExit(f"Mandant {name}: storage.db_path {settings.db_path} wird schon von {by_db[settings.db_path]} genutzt")
+        by_db[settings.db_path] = name
+        loaded.append((name, settings))
+    daemon = any(settings.mode == "daemon" for _, settings in loaded)
+    return [Tenant(name, settings, PollContext(settings, background_dispatch=daemon)) for name, settings in loaded]
+
+
+def run_tenants(paths: Sequence[Path]) -> int:
+    """
+    Mehrmandanten-Betrieb (--tenants): Daemon, sobald eine Config runtime.mode=daemon hat, sonst ein Zyklus.
+    Der Metrik-Endpunkt (metrics.listen der ersten Config, die ihn setzt) zeigt den gemeinsamen Abruf;
+    Zyklus-Zeilen (metrics.json_path) schreibt jeder Mandant selbst.
+    """
+    configs = _expand_archive([str(p) for p in paths])
+    if not configs:
+        raise SystemExit("--tenants: keine Config-Dateien gefunden")
+    tenants = load_tenants(configs)
+    daemon = any(t.settings.mode == "daemon" for t in tenants)
+    hub = TenantHub(tenants)
+    watchers: List[ConfigWatcher] = []
+    try:
+        print(
+            f"Mandanten: {len(tenants)} | Stationen: {len(hub.settings.stations)} verschieden, "
+            f"{sum(len(t.settings.stations) for t in tenants)} insgesamt | Quellen: {', '.join(hub.sources.stations)}"
+        )
+        for tenant in tenants:
+            if daemon and tenant.settings.backfill_on_start:
+                try:
+                    backfill(tenant.settings, tenant.ctx, detect_gaps(tenant.settings, tenant.ctx.storage, datetime.now(timezone.utc)))
+                except Exception as e:
+                    print(f"Backfill beim Start fehlgeschlagen ({tenant.name}): {e}", file=sys.stderr)
+
+        if not daemon:
+            rc = check_tenants(hub)
+            for tenant in tenants:
+                maybe_compact(tenant.settings, tenant.ctx.storage, datetime.now(timezone.utc))
+            return rc
+
+        listen = next((t.settings.metrics_listen for t in tenants if t.settings.metrics_listen), "")
+        if listen:
+            try:
+                hub.metrics_server = MetricsServer(hub.metrics, listen)
+                print(f"Metriken: http://{hub.metrics_server.address[0]}:{hub.metrics_server.address[1]}/metrics")
+            except OSError as e:
+                print(f"Metriken-Endpunkt konnte nicht gestartet werden: {e}", file=sys.stderr)
+        scheduler = PollScheduler(hub.scheduler_settings)
+        changed = threading.Event()  # gemeinsames Wecksignal aller Config-Watcher
+        watchers.extend(ConfigWatcher(Path(path), changed=changed) for path in configs)
+        while True:
+            try:
+                check_tenants(hub)
+                for tenant in tenants:
+                    maybe_compact(tenant.settings, tenant.ctx.storage, datetime.now(timezone.utc))
+            except Exception as e:
+                print(f"Fehler: {e}", file=sys.stderr)
+            now = time.time()
+            scheduler.observe(hub.last_cycle, now)
+            if changed.wait(max(0.0, scheduler.next_poll(now) - time.time())):
+                changed.clear()
+                for tenant, watcher in zip(tenants, watchers):
+                    new = watcher.take()
+                    if new is not None:
+                        hub.reload(tenant, new)
+                scheduler.settings = hub.scheduler_settings
+    finally:
+        for watcher in watchers:
+            watcher.close()
+        hub.close()
+
+
+PROFILE_PHASES = (
+    ("http", "HTTP"),
+    ("decode", "JSON-Decode"),
+    ("index", "Index"),
+    ("evaluate", "Auswertung"),
+    ("commit", "DB"),
+    ("send", "Mail"),
+)
+
+
+def _copy_db(src: Path, dst: Path) -> None:
+    """Konsistente Kopie der DB (auch im WAL-Betrieb) über die SQLite-Backup-API."""
+    if not src.exists():
+        return
+    with closing(sqlite3.connect(src)) as s, closing(sqlite3.connect(dst)) as d:
+        s.backup(d)
+
+
+def run_profile(settings: Settings, cycles: int, replay: Optional[List[Path]], out: Path, send_mail: bool) -> int:
+    """
+    --profile: cycles Zyklen check_once unter cProfile auf einer Kopie der DB (die echte DB und der
+    Alarm-Zustand bleiben unberührt). Mails nur mit send_mail, sonst wird E-Mail abgeschaltet.
+    Schreibt den pstats-Dump nach out und gibt Phasen-Zeiten je Zyklus sowie die teuersten Funktionen aus.
+    """
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as td:
+        db_copy = Path(td) / settings.db_path.name
+        _copy_db(settings.db_path, db_copy)
+        prof_settings = replace(
+            settings,
+            db_path=db_copy,
+            email_enabled=settings.email_enabled and send_mail,
+            metrics_json_path=None,
+        )
+        ctx = PollContext(prof_settings)
+        if replay:
+            ctx.fetcher.close()
+            ctx.fetcher = FileIndexFetcher(prof_settings, replay, ctx.metrics)
+        profiler = cProfile.Profile()
+        per_cycle: List[Tuple[float, Dict[str, float]]] = []
+        rc = 0
+        try:
+            for i in range(cycles):
+                t0 = time.perf_counter()
+                with redirect_stdout(io.StringIO()):
+                    profiler.enable()
+                    try:
+                        rc = max(rc, check_once(prof_settings, ctx))
+                    except Exception as e:
+                        rc = 1
+                        print(f"Zyklus {i + 1}: Fehler: {e}", file=sys.stderr)
+                    finally:
+                        profiler.disable()
+                per_cycle.append((time.perf_counter() - t0, dict(ctx.metrics.last_cycle_phases)))
+        finally:
+            ctx.close()
+
+    profiler.dump_stats(str(out))
+    source = ", ".join(p.name for p in replay) if replay else ctx.fetcher.url
+    print(f"Profil: {cycles} Zyklen, {len(settings.stations)} Stationen, Quelle: {source}")
+    header = f"{'Zyklus':>6} {'gesamt':>9}" + "".join(f" {label:>11}" for _, label in PROFILE_PHASES)
+    print(header)
+    print("-" * len(header))
+    for i, (total, phases) in enumerate(per_cycle, 1):
+        cols = "".join(f" {phases[k] * 1000:9.1f}ms" if k in phases else f" {'-':>11}" for k, _ in PROFILE_PHASES)
+        print(f"{i:>6} {total * 1000:7.1f}ms{cols}")
+    print()
+    stats = pstats.Stats(str(out), stream=sys.stdout)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(20)
+    print(f"pstats-Dump: {out}  (ansehen z.B. mit: python -m pstats {out.name})")
+    return rc
+
+
 def main() -> int:
     ap = argparse.ArgumentParser()
     ap.add_argument("--config", default="config-pegel.json", help="Pfad zur config-pegel.json (default: neben EXE/Script)")
+    ap.add_argument("--backfill", metavar="STATION", help="historische Werte nachladen (Name, station_no, station_id oder 'all')")
+    ap.add_argument("--from", dest="t_from", metavar="DATUM", help="Beginn für --backfill (ISO, z.B. 2026-02-01)")
+    ap.add_argument("--to", dest="t_to", metavar="DATUM", help="Ende für --backfill (ISO, default: jetzt)")
+    sub = ap.add_subparsers(dest="command")
+    for name, help_text in (
+        ("history", "gespeicherte Werte einer Station anzeigen"),
+        ("export", "gespeicherte Werte exportieren (csv, jsonl, parquet, arrow)"),
+    ):
+        sp = sub.add_parser(name, help=help_text)
+        sp.add_argument("--station", default="all" if name == "export" else None, required=name == "history",
+                        help="Name, station_no, station_id oder 'all'")
+        sp.add_argument("--param", help="Parameter, z.B. W (default: alle)")
+        sp.add_argument("--from", dest="t_from", metavar="DATUM", help="Beginn (ISO)")
+        sp.add_argument("--to", dest="t_to", metavar="DATUM", help="Ende, exklusiv (ISO, default: jetzt)")
+        sp.add_argument("--resolution", choices=tuple(HISTORY_TABLES), default="raw", help="raw | hourly | daily (UTC-Tage)")
+        sp.add_argument("--level", action="store_true", help="Warnstufe nach aktuellen Schwellen mit ausgeben")
+        if name == "export":
+            sp.add_argument("--format", choices=("csv", "jsonl", "parquet", "arrow"), default="csv")
+            sp.add_argument("--out", help="Ausgabedatei (default: stdout, nur csv/jsonl)")
+    ap.add_argument(
+        "--profile", type=int, nargs="?", const=1, metavar="N",
+        help="N Zyklen (default: 1) unter cProfile auf einer DB-Kopie ausführen und Phasen-Zeiten ausgeben",
+    )
+    ap.add_argument(
+        "--replay-index", action="append", type=Path, metavar="DATEI",
+        help="gespeicherte index.json statt HTTP-Abruf verwenden (mehrfach: der Reihe nach je Zyklus)",
+    )
+    ap.add_argument("--profile-out", type=Path, metavar="DATEI", help="Ziel des pstats-Dumps (default: neben EXE/Script)")
+    ap.add_argument("--profile-mail", action="store_true", help="beim Profilieren echte Mails versenden (default: aus)")
+    ap.add_argument(
+        "--tenants", nargs="+", type=Path, metavar="CONFIG",
+        help="Mehrmandanten-Betrieb: mehrere Configs (Dateien/Verzeichnisse), jede Quelle einmal pro Zyklus abrufen",
+    )
+    sp = sub.add_parser("replay", help="Alarme ausgeben, die für gespeicherte Messwerte ausgelöst worden wären")
+    sp.add_argument("--station", default="all", help="Name, station_no, station_id oder 'all'")
+    sp.add_argument("--from", dest="t_from", metavar="DATUM", help="Beginn (ISO)")
+    sp.add_argument("--to", dest="t_to", metavar="DATUM", help="Ende, exklusiv (ISO)")
+    sp.add_argument("--index", nargs="+", metavar="DATEI", help="index.json-Archiv (Dateien/Verzeichnisse) statt DB")
+    sp.add_argument("--cold-start", action="store_true", help="Zustand wie neue DB (alert_on_start gilt), sonst scharf")
+    sp.add_argument("--format", choices=("text", "jsonl"), default="text")
+    sp = sub.add_parser("tune", help="Schwellen und Re-Arm-Dauer einer Station auf ihrer Historie bewerten")
+    sp.add_argument("--station", required=True, help="Name, station_no oder station_id")
+    sp.add_argument("--from", dest="t_from", metavar="DATUM", help="Beginn (ISO)")
+    sp.add_argument("--to", dest="t_to", metavar="DATUM", help="Ende, exklusiv (ISO)")
+    sp.add_argument("--set", action="append", metavar="A,B,C", help="Schwellen-Satz in cm (mehrfach möglich)")
+    sp.add_argument("--offset", metavar="VON:BIS:SCHRITT", help="aktuelle Schwellen um diese cm verschieben, z.B. --offset=-20:20:5")
+    sp.add_argument("--scale", metavar="VON:BIS:SCHRITT", help="aktuelle Schwellen skalieren, z.B. 0.9:1.1:0.05")
+    sp.add_argument("--rearm", metavar="H,H,... | VON:BIS:SCHRITT", help="Re-Arm-Dauern in Stunden (default: Config)")
+    sp.add_argument("--event-level", type=float, help="Pegel (cm) für Ereignisse (default: höchste aktuelle Schwelle)")
+    sp.add_argument("--lookback", type=float, default=48.0, help="max. Vorlauf eines Alarms vor dem Hochwasserscheitel in h (default: 48)")
+    sp.add_argument("--flap", type=float, default=24.0, help="erneuter Alarm derselben Stufe innerhalb h = Flattern (default: 24)")
+    sp.add_argument("--workers", type=int, help="Worker-Prozesse (default: Anzahl CPU-Kerne)")
+    sp.add_argument("--top", type=int, default=20, help="nur die besten N Kombinationen ausgeben (default: 20)")
+    sp.add_argument("--format", choices=("text", "jsonl"), default="text")
+    sp = sub.add_parser("reclassify", help="Warnstufen gespeicherter Werte nach aktuellen Schwellen neu berechnen")
+    sp.add_argument("--station", default="all", help="Name, station_no, station_id oder 'all'")
+    sp.add_argument("--chunk", type=int, default=50000, help="Zeilen pro Block/Transaktion (default: 50000)")
+    sp.add_argument("--dry-run", action="store_true", help="nur zählen, nichts schreiben")
     args = ap.parse_args()
 
+    if args.tenants:
+        return run_tenants(args.tenants)
+
     app_dir = get_app_dir()
     cfg = Path(args.config)
     if not cfg.is_absolute():
@@ -799,16 +4579,85 @@ def main() -> int:
             f"alert_on_start={settings.alert_on_start} | alert_on_level_increase={settings.alert_on_level_increase}"
         )
 
-    if settings.mode == "daemon":
-        while True:
+    if args.profile is not None or args.replay_index:
+        if args.profile is None:
+            raise SystemExit("--replay-index nur zusammen mit --profile")
+        if args.profile < 1:
+            raise SystemExit("--profile N: N muss >= 1 sein")
+        out = args.profile_out or app_dir / f"pegel-profile-{datetime.now():%Y%m%d-%H%M%S}.pstats"
+        return run_profile(settings, args.profile, args.replay_index, out, args.profile_mail)
+
+    # Mails im Daemon-Betrieb aus eigenem Thread versenden (Abfrage wartet nicht auf SMTP)
+    ctx = PollContext(settings, background_dispatch=settings.mode == "daemon" and not args.command and not args.backfill)
+    try:
+        if args.command == "history":
+            return run_history(settings, ctx.storage, args)
+        if args.command == "export":
+            return run_export(settings, ctx.storage, args)
+        if args.command == "reclassify":
+            return run_reclassify(settings, ctx.storage, args)
+        if args.command == "tune":
+            return run_tune(settings, ctx.storage, args)
+        if args.command == "replay":
+            return run_replay(settings, None if args.index else ctx.storage, args)
+
+        if args.backfill:
+            if not args.t_from:
+                raise SystemExit("--backfill benötigt --from")
+            t_from = _parse_cli_time(args.t_from)
+            t_to = _parse_cli_time(args.t_to) if args.t_to else datetime.now(timezone.utc)
+            backfill(settings, ctx, [(st, t_from, t_to) for st in _select_stations(settings, args.backfill)])
+            return 0
+
+        # nur im Daemon: geplante once-Läufe würden sonst bei jedem Start alle Zeitreihen nachladen
+        if settings.mode == "daemon" and settings.backfill_on_start:
             try:
-                check_once(settings)
+                backfill(settings, ctx, detect_gaps(settings, ctx.storage, datetime.now(timezone.utc)))
             except Exception as e:
-                print(f"Fehler: {e}", file=sys.stderr)
-            time.sleep(settings.poll_interval_seconds)
-
-    return check_once(settings)
+                print(f"Backfill beim Start fehlgeschlagen: {e}", file=sys.stderr)
+
+        if settings.mode == "daemon":
+            if settings.metrics_listen:
+                try:
+                    server = MetricsServer(ctx.metrics, settings.metrics_listen)
+                    ctx.metrics_server = server
+                    print(f"Metriken: http://{server.address[0]}:{server.address[1]}/metrics")
+                except OSError as e:
+                    print(f"Metriken-Endpunkt konnte nicht gestartet werden: {e}", file=sys.stderr)
+            scheduler = PollScheduler(settings)
+            watcher = ConfigWatcher(cfg)
+            try:
+                while True:
+                    try:
+                        check_once(settings, ctx)
+                        maybe_compact(settings, ctx.storage, datetime.now(timezone.utc))
+                    except Exception as e:
+                        print(f"Fehler: {e}", file=sys.stderr)
+                    now = time.time()
+                    scheduler.observe(ctx.last_cycle, now)
+                    next_at = scheduler.next_poll(now)
+                    _debug_print(
+                        settings,
+                        f"[DEBUG] nächste Abfrage: {_format_local(datetime.fromtimestamp(next_at, timezone.utc))} "
+                        f"(Intervall {scheduler.interval(now)}s, Rhythmus {scheduler.cadence or '-'}s)",
+                    )
+                    # geänderte Config weckt vorzeitig: übernehmen und sofort abfragen (neue Stationen ohne Lücke)
+                    if watcher.changed.wait(max(0.0, next_at - time.time())):
+                        watcher.changed.clear()
+                        new = watcher.take()
+                        if new is not None:
+                            settings = apply_reload(ctx, new)
+                            scheduler.settings = settings
+            finally:
+                watcher.close()
+
+        rc = check_once(settings, ctx)
+        maybe_compact(settings, ctx.storage, datetime.now(timezone.utc))
+        return rc
+    finally:
+        ctx.close()
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # tune (ProcessPoolExecutor) in der PyInstaller-EXE
     raise SystemExit(main())
@@ -0,0 +1,985 @@
+#!/usr/bin/env python3
+# bench_pegelabfrage.py
+#
+# Benchmarks für pegelabfrage.py auf Basis des Test-Harness (test_pegelabfrage.py):
+# - synthetische HLNUG index.json-Payloads (bis 100k Einträge) und Configs mit bis zu 5000 Stationen
+# - gemockter HTTP-Abruf (FakeResponse) bzw. gespeicherte index.json, temporäre DBs (auch mit Jahren an Messwerten)
+# - Ergebnisse als JSON (mit Versions-/Umgebungsangaben) und Vergleich mit einem früheren Lauf
+#
+# Usage:
+#   python .\bench_pegelabfrage.py --main .\Pegelabfrage.py
+#   python .\bench_pegelabfrage.py --main .\Pegelabfrage.py --suite full --json bench-neu.json
+#   python .\bench_pegelabfrage.py --main .\Pegelabfrage.py --json bench-neu.json --compare bench-alt.json
+
+import argparse
+import contextlib
+import dataclasses
+import io
+import json
+import os
+import platform
+import random
+import re
+import signal
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from test_pegelabfrage import FakeSmtpServer, load_main_module, patch_requests, resolve_main_path, use_fake_smtp
+
+
+def make_bench_payload(n_stations: int, cycle: int = 0, changed: float = 1.0) -> List[Dict[str, Any]]:
+    """
+    Index mit n_stations Pegeln; die Werte wandern pro Zyklus über die Schwellen.
+    changed: Anteil der Stationen mit neuem Messwert je Zyklus (die übrigen bleiben auf Zyklus 0).
+    """
+    payload = []
+    n_changed = round(n_stations * changed)
+    for i in range(n_stations):
+        cycle_i = cycle if i < n_changed else 0
+        payload.append(
+            {
+                "station_id": 60000 + i,
+                "station_no": str(26000000 + i),
+                "station_name": f"Bench {i} - Fluss",
+                "stationparameter_name": "W",
+                "ts_unitsymbol": "cm",
+                "timestamp": f"2026-02-25T{(cycle_i // 4) % 24:02d}:{(cycle_i % 4) * 15:02d}:00+01:00",
+                "ts_value": float(100 + ((i + cycle_i * 37) % 150)),
+            }
+        )
+    return payload
+
+
+def make_index_entries(n_entries: int, n_stations: int, cycle: int = 0) -> List[Dict[str, Any]]:
+    """
+    Index mit n_entries Einträgen wie beim echten HLNUG-Index: die ersten n_stations gehören zur
+    Bench-Config, die übrigen sind fremde Pegel (W) und Abflüsse (Q), die nur geparst werden.
+    """
+    payload = make_bench_payload(min(n_stations, n_entries), cycle)
+    for j in range(len(payload), n_entries):
+        q = j % 3 == 0
+        payload.append(
+            {
+                "station_id": 90000 + j,
+                "station_no": str(30000000 + j),
+                "station_name": f"Fremd {j} - Bach",
+                "stationparameter_name": "Q" if q else "W",
+                "ts_unitsymbol": "m³/s" if q else "cm",
+                "timestamp": f"2026-02-25T{(cycle // 4) % 24:02d}:{(cycle % 4) * 15:02d}:00+01:00",
+                "ts_value": float(j % 400) / (10.0 if q else 1.0),
+            }
+        )
+    return payload
+
+
+def write_bench_config(cfg_path: Path, db_path: Path, n_stations: int) -> None:
+    cfg = {
+        "threshold": {"thresholds_cm": [150, 180, 200, 220]},
+        "storage": {"db_path": str(db_path)},
+        "runtime": {"mode": "once", "poll_interval_seconds": "60"},
+        "email": {"enabled": "false"},
+        "debug": {"enabled": "false"},
+        "stations": [
+            {
+                "name": f"Bench {i} - Fluss",
+                "station_id_public": str(60000 + i),
+                "station_no": str(26000000 + i),
+                "parameter": "W",
+                "thresholds_cm": [120, 150, 180, 220] if i % 2 else [130, 160, 190],
+            }
+            for i in range(n_stations)
+        ],
+    }
+    cfg_path.write_text(json.dumps(cfg), encoding="utf-8")
+
+
+@contextlib.contextmanager
+def count_statements(main_mod):
+    """Zählt execute()/executemany()-Aufrufe (= Roundtrips) aller Verbindungen des Hauptmoduls."""
+    counter = {"statements": 0}
+    real_connect = main_mod.sqlite3.connect
+
+    class CountingConnection(sqlite3.Connection):
+        def execute(self, *args, **kwargs):
+            counter["statements"] += 1
+            return super().execute(*args, **kwargs)
+
+        def executemany(self, *args, **kwargs):
+            counter["statements"] += 1
+            return super().executemany(*args, **kwargs)
+
+    def connect(*args, **kwargs):
+        kwargs.setdefault("factory", CountingConnection)
+        return real_connect(*args, **kwargs)
+
+    main_mod.sqlite3.connect = connect
+    try:
+        yield counter
+    finally:
+        main_mod.sqlite3.connect = real_connect
+
+
+def _db_bytes(con: sqlite3.Connection) -> int:
+    """Belegte DB-Größe inkl. noch nicht zurückgeschriebener WAL-Seiten."""
+    (pages,) = con.execute("PRAGMA page_count").fetchone()
+    (page_size,) = con.execute("PRAGMA page_size").fetchone()
+    return pages * page_size
+
+
+def bench_check_once_state(
+    main_mod, td_path: Path, index_url: str, n_stations: int, cycles: int, changed: float = 1.0,
+    n_entries: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    check_once mit n_stations im Daemon-Stil (ein Kontext über alle Zyklen): Statements, Laufzeit
+    und DB-Wachstum pro Zyklus.
+    changed: Anteil der Stationen mit neuem Messwert je Zyklus.
+    n_entries: Größe des Index (default: nur die konfigurierten Stationen). Große Indizes werden aus
+    vorab geschriebenen Dateien eingespielt (FileIndexFetcher), damit das Serialisieren der Fake-Antwort
+    nicht mitgemessen wird.
+    """
+    n_entries = n_entries or n_stations
+    cfg_path = td_path / f"bench-{n_stations}-{n_entries}-{changed}.json"
+    db_path = td_path / f"bench-{n_stations}-{n_entries}-{changed}.db"
+    write_bench_config(cfg_path, db_path, n_stations)
+    settings = main_mod.load_settings(cfg_path)
+
+    replay: List[Path] = []
+    file_fetcher = getattr(main_mod, "FileIndexFetcher", None)
+    if n_entries > n_stations and file_fetcher is not None:
+        for cycle in range(cycles):
+            path = td_path / f"bench-index-{n_entries}-{n_stations}-{cycle}.json"
+            path.write_text(json.dumps(make_index_entries(n_entries, n_stations, cycle)), encoding="utf-8")
+            replay.append(path)
+
+    per_cycle = []
+    sink = io.StringIO()
+    with count_statements(main_mod) as counter:
+        ctx = main_mod.PollContext(settings) if hasattr(main_mod, "PollContext") else None
+        if ctx is not None and replay:
+            ctx.fetcher.close()
+            ctx.fetcher = file_fetcher(settings, replay, getattr(ctx, "metrics", None))
+        try:
+            for cycle in range(cycles):
+                if not replay:
+                    if n_entries > n_stations:
+                        payload = make_index_entries(n_entries, n_stations, cycle)
+                    else:
+                        payload = make_bench_payload(n_stations, cycle, changed)
+                    patch_requests(main_mod, payload, index_url)
+                before = counter["statements"]
+                with contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+                    t0 = time.perf_counter()
+                    if ctx is not None:
+                        main_mod.check_once(settings, ctx)
+                    else:
+                        main_mod.check_once(settings)
+                    elapsed = time.perf_counter() - t0
+                statements = counter["statements"] - before
+                size = _db_bytes(ctx.storage.con) if ctx is not None else db_path.stat().st_size
+                per_cycle.append({"seconds": elapsed, "statements": statements, "db_bytes": size})
+        finally:
+            if ctx is not None:
+                ctx.close()
+
+    steady = per_cycle[1:] or per_cycle
+    steady_s = [c["seconds"] for c in steady]
+    mean_s = sum(steady_s) / len(steady_s)
+    median_s = statistics.median(steady_s)
+    return {
+        "name": "check_once_state",
+        "stations": n_stations,
+        "entries": n_entries,
+        "changed": changed,
+        "cycles": cycles,
+        "first_cycle_seconds": per_cycle[0]["seconds"],
+        "mean_seconds": mean_s,
+        "median_seconds": median_s,
+        "min_seconds": min(steady_s),
+        "stations_per_second": n_stations / median_s if median_s > 0 else None,
+        "mean_statements": sum(c["statements"] for c in steady) / len(steady),
+        "db_bytes": per_cycle[-1]["db_bytes"],
+        "db_growth_bytes_per_cycle": (per_cycle[-1]["db_bytes"] - per_cycle[0]["db_bytes"]) / max(1, len(per_cycle) - 1),
+        "per_cycle": per_cycle,
+    }
+
+
+def bench_load_settings(main_mod, td_path: Path, n_stations: int, repeat: int = 5) -> Dict[str, Any]:
+    """load_settings (JSON lesen + validieren) für eine Config mit n_stations Stationen, beste von repeat."""
+    cfg_path = td_path / f"bench-load-{n_stations}.json"
+    write_bench_config(cfg_path, td_path / "bench-load.db", n_stations)
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        main_mod.load_settings(cfg_path)
+        best = min(best, time.perf_counter() - t0)
+    return {"name": "load_settings", "stations": n_stations, "config_bytes": cfg_path.stat().st_size, "seconds": best}
+
+
+def bench_parse_index(main_mod, td_path: Path, n_entries: int, n_stations: int, repeat: int = 3) -> Dict[str, Any]:
+    """
+    fetch_index-Parse einer gespeicherten index.json mit n_entries Einträgen (Streaming mit Filter auf
+    n_stations vs. json.loads des ganzen Arrays) und build_index_map über alle bzw. die behaltenen Einträge.
+    """
+    res: Dict[str, Any] = {"name": "parse_index", "entries": n_entries, "stations": n_stations}
+    file_fetcher = getattr(main_mod, "FileIndexFetcher", None)
+    if file_fetcher is None:
+        return res  # ältere Version ohne Replay aus Datei
+    cfg_path = td_path / f"bench-parse-{n_stations}.json"
+    write_bench_config(cfg_path, td_path / "bench-parse.db", n_stations)
+    settings = main_mod.load_settings(cfg_path)
+    index_path = td_path / f"bench-index-{n_entries}.json"
+    index_path.write_text(json.dumps(make_index_entries(n_entries, n_stations)), encoding="utf-8")
+    res["bytes"] = index_path.stat().st_size
+
+    arrays: Dict[str, List[dict]] = {}
+    for label, stream in (("stream", True), ("json", False)):
+        st = dataclasses.replace(settings, stream_index=stream)
+        fetcher = file_fetcher(st, [index_path])
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            arrays[label] = main_mod.fetch_index(st, fetcher)
+            best = min(best, time.perf_counter() - t0)
+        res[f"{label}_seconds"] = best
+        res[f"{label}_kept"] = len(arrays[label])
+    for label, arr in (("full", arrays["json"]), ("kept", arrays["stream"])):
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            main_mod.build_index_map(arr)
+            best = min(best, time.perf_counter() - t0)
+        res[f"build_index_{label}_seconds"] = best
+    res["entries_per_second"] = n_entries / res["stream_seconds"]
+    return res
+
+
+def bench_history_db(main_mod, td_path: Path, index_url: str, n_stations: int, years: float) -> Dict[str, Any]:
+    """
+    DB mit years Jahren 15-Minuten-Werten für n_stations: Größe, Aufbau, erster Zyklus (Trendfenster und
+    Alarm-Zustand aus der großen DB laden), Folgezyklus und Wachstum pro Tag (gemittelt über 30 weitere Tage).
+    """
+    cfg_path = td_path / f"bench-hist-{n_stations}.json"
+    db_path = td_path / f"bench-hist-{n_stations}.db"
+    write_bench_config(cfg_path, db_path, n_stations)
+    settings = main_mod.load_settings(cfg_path)
+    n_values = int(years * 365 * 96)
+    start = int(datetime(2026, 2, 25, tzinfo=timezone.utc).timestamp()) - n_values * 900
+
+    storage = main_mod.Storage(db_path)
+    try:
+        con = storage.con
+        ppk = storage.param_pk("W", "cm")
+        t0 = time.perf_counter()
+        for i, st in enumerate(settings.stations):
+            spk = storage.station_pk(st.station_no, st.station_id_public, st.name, "bench")
+            con.executemany(
+                "INSERT INTO measurements(station_pk, param_pk, ts, value, level) VALUES (?, ?, ?, ?, 0)",
+                ((spk, ppk, start + k * 900, float(100 + (k + i) % 150)) for k in range(n_values)),
+            )
+        con.commit()
+        populate_s = time.perf_counter() - t0
+        con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        storage.close()
+    size = db_path.stat().st_size
+    rows = n_stations * n_values
+
+    sink = io.StringIO()
+    ctx = main_mod.PollContext(settings)
+    try:
+        times = []
+        with contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+            for cycle in range(2):
+                patch_requests(main_mod, make_bench_payload(n_stations, cycle), index_url)
+                t0 = time.perf_counter()
+                main_mod.check_once(settings, ctx)
+                times.append(time.perf_counter() - t0)
+        # weitere 30 Tage Messwerte, tageweise wie im Betrieb: Wachstum der DB (inkl. Rollup-Tabellen)
+        con = ctx.storage.con
+        before = _db_bytes(con)
+        spks = [ctx.storage.lookup_station_pk(st.station_no) for st in settings.stations]
+        day0 = int(datetime(2026, 2, 26, tzinfo=timezone.utc).timestamp())
+        for day in range(30):
+            con.executemany(
+                "INSERT INTO measurements(station_pk, param_pk, ts, value, level) VALUES (?, ?, ?, ?, 0)",
+                ((spk, ppk, day0 + day * 86400 + k * 900, 120.0) for k in range(96) for spk in spks),
+            )
+            con.commit()
+        growth_day = (_db_bytes(con) - before) / 30
+    finally:
+        ctx.close()
+
+    return {
+        "name": "history_db",
+        "stations": n_stations,
+        "years": years,
+        "rows": rows,
+        "populate_seconds": populate_s,
+        "db_bytes": size,
+        "bytes_per_row": size / rows,
+        "first_cycle_seconds": times[0],
+        "steady_cycle_seconds": times[1],
+        "db_growth_bytes_per_day": growth_day,
+    }
+
+
+def _create_legacy_measurements(db_path: Path, n_stations: int, days: int) -> int:
+    """Alte measurements-Tabelle (Text-Spalten, ISO-Zeitstempel) mit 15-Minuten-Werten füllen."""
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    n_values = days * 96
+    with contextlib.closing(sqlite3.connect(db_path)) as con:
+        con.execute(
+            """
+            CREATE TABLE measurements (
+                station_no TEXT NOT NULL, station_id_public TEXT, station_name TEXT,
+                parameter TEXT NOT NULL, ts TEXT NOT NULL, value REAL NOT NULL,
+                level INTEGER, source TEXT, unit TEXT,
+                PRIMARY KEY (station_no, parameter, ts)
+            )
+            """
+        )
+        stamps = [(start + timedelta(minutes=15 * k)).isoformat() for k in range(n_values)]
+        for i in range(n_stations):
+            no, sid, name = str(26000000 + i), str(60000 + i), f"Bench {i} - Fluss"
+            con.executemany(
+                "INSERT INTO measurements VALUES (?, ?, ?, 'W', ?, ?, 0, 'layers:10:index', 'cm')",
+                ((no, sid, name, ts, float(100 + (k + i) % 150)) for k, ts in enumerate(stamps)),
+            )
+        con.commit()
+    return n_stations * n_values
+
+
+def _time_range_queries(con: sqlite3.Connection, sql: str, params: List[tuple], repeat: int = 3) -> float:
+    """Beste von `repeat` Laufzeiten für alle Bereichsabfragen (Zeilen vollständig abgeholt)."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for p in params:
+            con.execute(sql, p).fetchall()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench_measurement_schema(main_mod, td_path: Path, n_stations: int, days: int) -> Dict[str, Any]:
+    """DB-Größe und Bereichsabfragen über ein Jahr: altes Text-Schema vs. kompaktes Schema (nach Migration)."""
+    db_path = td_path / f"bench-schema-{n_stations}x{days}.db"
+    rows = _create_legacy_measurements(db_path, n_stations, days)
+    size_before = db_path.stat().st_size
+
+    t_from, t_to = datetime(2025, 1, 1, tzinfo=timezone.utc), datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(days=days)
+    m_from, m_to = datetime(2025, 6, 1, tzinfo=timezone.utc), datetime(2025, 7, 1, tzinfo=timezone.utc)
+    with contextlib.closing(sqlite3.connect(db_path)) as con:
+        sql = "SELECT ts, value FROM measurements WHERE station_no = ? AND parameter = 'W' AND ts >= ? AND ts < ?"
+        year_before = _time_range_queries(con, sql, [(str(26000000 + i), t_from.isoformat(), t_to.isoformat()) for i in range(n_stations)])
+        month_before = _time_range_queries(con, sql, [(str(26000000 + i), m_from.isoformat(), m_to.isoformat()) for i in range(n_stations)])
+
+    t0 = time.perf_counter()
+    storage = main_mod.Storage(db_path)
+    migrate_seconds = time.perf_counter() - t0
+    try:
+        con = storage.con
+        con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        size_after = db_path.stat().st_size
+        param_pk = storage.lookup_param_pk("W")
+        pks = [storage.lookup_station_pk(str(26000000 + i)) for i in range(n_stations)]
+        sql = "SELECT ts, value FROM measurements WHERE station_pk = ? AND param_pk = ? AND ts >= ? AND ts < ?"
+        year_after = _time_range_queries(con, sql, [(pk, param_pk, int(t_from.timestamp()), int(t_to.timestamp())) for pk in pks])
+        month_after = _time_range_queries(con, sql, [(pk, param_pk, int(m_from.timestamp()), int(m_to.timestamp())) for pk in pks])
+    finally:
+        storage.close()
+
+    return {
+        "name": "measurement_schema",
+        "stations": n_stations,
+        "days": days,
+        "rows": rows,
+        "size_before_bytes": size_before,
+        "size_after_bytes": size_after,
+        "bytes_per_row_before": size_before / rows,
+        "bytes_per_row_after": size_after / rows,
+        "migrate_seconds": migrate_seconds,
+        "year_query_seconds_before": year_before,
+        "year_query_seconds_after": year_after,
+        "month_query_seconds_before": month_before,
+        "month_query_seconds_after": month_after,
+    }
+
+
+def bench_classify(main_mod, n_values: int, n_stations: int) -> Dict[str, Any]:
+    """Warnstufen für n_values Werte: _compute_level-Schleife vs. classify_levels_matrix (NumPy / bisect)."""
+    rnd = random.Random(1)
+    thresholds = [tuple(float(x) for x in sorted(rnd.sample(range(50, 400), 4 if i % 2 else 3))) for i in range(n_stations)]
+    idx = [rnd.randrange(n_stations) for _ in range(n_values)]
+    values = [rnd.uniform(0, 450) for _ in range(n_values)]
+    matrix = main_mod.threshold_matrix(thresholds)
+
+    t0 = time.perf_counter()
+    loop = [main_mod._compute_level(v, thresholds[i]) for v, i in zip(values, idx)]
+    loop_s = time.perf_counter() - t0
+
+    real_np = main_mod.np
+    timings: Dict[str, Any] = {}
+    for label, np_mod in (("numpy", real_np), ("bisect", None)):
+        if label == "numpy" and np_mod is None:
+            timings[label] = None
+            continue
+        main_mod.np = np_mod
+        try:
+            t0 = time.perf_counter()
+            levels = main_mod.classify_levels_matrix(values, idx, matrix)
+            timings[label] = time.perf_counter() - t0
+        finally:
+            main_mod.np = real_np
+        if levels != loop:
+            raise AssertionError(f"classify_levels_matrix ({label}) weicht von _compute_level ab")
+
+    return {
+        "name": "classify",
+        "values": n_values,
+        "stations": n_stations,
+        "loop_seconds": loop_s,
+        "numpy_seconds": timings["numpy"],
+        "bisect_seconds": timings["bisect"],
+    }
+
+
+def bench_reclassify(main_mod, td_path: Path, n_stations: int, days: int) -> Dict[str, Any]:
+    """reclassify (Blöcke, nur Änderungen) vs. Zeile-für-Zeile-UPDATE mit _compute_level auf gleicher DB."""
+    cfg_path = td_path / f"bench-reclassify-{n_stations}.json"
+    db_path = td_path / f"bench-reclassify-{n_stations}.db"
+    write_bench_config(cfg_path, db_path, n_stations)
+    settings = main_mod.load_settings(cfg_path)
+
+    storage = main_mod.Storage(db_path)
+    try:
+        con = storage.con
+        ppk = storage.param_pk("W", "cm")
+        n_values = days * 96
+        for i, st in enumerate(settings.stations):
+            spk = storage.station_pk(st.station_no, st.station_id_public, st.name, "bench")
+            con.executemany(
+                "INSERT INTO measurements VALUES (?, ?, ?, ?, 0)",
+                ((spk, ppk, k * 900, float(100 + (k + i) % 150)) for k in range(n_values)),
+            )
+        con.commit()
+        rows = n_stations * n_values
+
+        # Baseline: jede Zeile einzeln klassifizieren und schreiben
+        t0 = time.perf_counter()
+        for s in main_mod.history_series(settings, storage):
+            for ts, value in con.execute(
+                "SELECT ts, value FROM measurements WHERE station_pk = ? AND param_pk = ?", (s.station_pk, s.param_pk)
+            ).fetchall():
+                con.execute(
+                    "UPDATE measurements SET level = ? WHERE station_pk = ? AND param_pk = ? AND ts = ?",
+                    (main_mod._compute_level(value, s.thresholds_cm), s.station_pk, s.param_pk, ts),
+                )
+        con.commit()
+        loop_s = time.perf_counter() - t0
+
+        con.execute("UPDATE measurements SET level = 0")
+        con.commit()
+        t0 = time.perf_counter()
+        changed = main_mod.reclassify(settings, storage)
+        batch_s = time.perf_counter() - t0
+    finally:
+        storage.close()
+
+    return {
+        "name": "reclassify",
+        "stations": n_stations,
+        "rows": rows,
+        "changed_rows": sum(changed.values()),
+        "loop_seconds": loop_s,
+        "reclassify_seconds": batch_s,
+    }
+
+
+def bench_smtp(main_mod, td_path: Path, n_alerts: int, login_delay: float) -> Dict[str, Any]:
+    """
+    n_alerts gleichzeitige Alarme an lokalen SMTP-Ersatzserver (login_delay simuliert TLS+Login):
+    Einzelversand (Verbindung je Mail) vs. Outbox-Durchlauf mit einer Verbindung vs. Digest.
+    """
+    cfg_path = td_path / "bench-smtp.json"
+    db_path = td_path / "bench-smtp.db"
+    write_bench_config(cfg_path, db_path, 1)
+    cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+    cfg["email"] = {"enabled": "true", "to": "bench@example.org", "from": "pegel@example.org"}
+    cfg["smtp"] = {"user": "bench", "password": "bench"}
+    cfg_path.write_text(json.dumps(cfg), encoding="utf-8")
+    alerts = [
+        (0, "bench@example.org", f"Stufe1 Bench {i}: 155.0cm (>= 150.0cm)", f"Pegel-Meldung (HLNUG-Messdaten)\n\nStation: Bench {i}\n", 0)
+        for i in range(n_alerts)
+    ]
+    res: Dict[str, Any] = {"name": "smtp", "alerts": n_alerts, "login_delay_seconds": login_delay}
+    sink = io.StringIO()
+
+    for label in ("single", "pooled", "digest"):
+        with FakeSmtpServer(login_delay=login_delay) as smtp:
+            use_fake_smtp(cfg_path, smtp.port, digest=label == "digest")
+            settings = main_mod.load_settings(cfg_path)
+            t0 = time.perf_counter()
+            if label == "single":
+                for _, _, subject, body, _ in alerts:
+                    main_mod.send_email(settings, subject, body)
+            else:
+                storage = main_mod.Storage(db_path)
+                try:
+                    rows = main_mod.digest_outbox_rows(alerts) if settings.email_digest else alerts
+                    storage.con.executemany(
+                        "INSERT INTO outbox(created_at, recipients, subject, body, next_attempt_at) VALUES (?, ?, ?, ?, ?)", rows
+                    )
+                    storage.con.commit()
+                    with contextlib.redirect_stdout(sink):
+                        main_mod.drain_outbox(settings, storage.con)
+                finally:
+                    storage.close()
+            res[f"{label}_seconds"] = time.perf_counter() - t0
+            res[f"{label}_connections"] = smtp.connections
+            res[f"{label}_messages"] = len(smtp.messages)
+    return res
+
+
+def bench_metrics(
+    main_mod, td_path: Path, index_url: str, n_stations: int, cycles: int, scrape_interval: float
+) -> Dict[str, Any]:
+    """
+    check_once-Laufzeit ohne Metrik-Endpunkt vs. mit Endpunkt, den ein externer Prozess alle
+    scrape_interval Sekunden abfragt (0 = ohne Pause; Prometheus fragt typischerweise alle 15-60 s ab).
+    """
+    cfg_path = td_path / f"bench-metrics-{n_stations}.json"
+    write_bench_config(cfg_path, td_path / f"bench-metrics-{n_stations}.db", n_stations)
+    settings = main_mod.load_settings(cfg_path)
+    res: Dict[str, Any] = {"name": "metrics", "stations": n_stations, "cycles": cycles, "scrape_interval": scrape_interval}
+    sink = io.StringIO()
+    scrape_loop = (
+        "import sys, time, urllib.request\n"
+        "n = 0\n"
+        "try:\n"
+        "    while True:\n"
+        "        urllib.request.urlopen(sys.argv[1], timeout=5).read()\n"
+        "        n += 1\n"
+        "        time.sleep(float(sys.argv[2]))\n"
+        "except KeyboardInterrupt:\n"
+        "    print(n)\n"
+    )
+
+    for label in ("off", "scraped"):
+        ctx = main_mod.PollContext(settings)
+        server = main_mod.MetricsServer(ctx.metrics, "127.0.0.1:0") if label == "scraped" else None
+        scraper = None
+        try:
+            with contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+                patch_requests(main_mod, make_bench_payload(n_stations, 0), index_url)
+                main_mod.check_once(settings, ctx)  # Aufwärmen (Trendfenster, Zustand)
+                if server is not None:
+                    url = f"http://127.0.0.1:{server.address[1]}/metrics"
+                    scraper = subprocess.Popen([sys.executable, "-c", scrape_loop, url, str(scrape_interval)], stdout=subprocess.PIPE, text=True)
+                    time.sleep(0.5)
+                times = []
+                for cycle in range(1, cycles + 1):
+                    patch_requests(main_mod, make_bench_payload(n_stations, cycle), index_url)
+                    t0 = time.perf_counter()
+                    main_mod.check_once(settings, ctx)
+                    times.append(time.perf_counter() - t0)
+        finally:
+            if scraper is not None:
+                scraper.send_signal(signal.SIGINT)
+                res["scrapes"] = int(scraper.communicate()[0] or 0)
+            if server is not None:
+                server.close()
+                res["metrics_bytes"] = len(ctx.metrics.render())
+            ctx.close()
+        times.sort()
+        res[f"{label}_median_seconds"] = times[len(times) // 2]
+    return res
+
+def bench_replay(main_mod, td_path: Path, n_stations: int, years: float) -> Dict[str, Any]:
+    """
+    replay über years Jahre 15-Minuten-Werte für n_stations aus der DB (Hochwasser-Wellen mit schnellem
+    Anstieg): replay() gesamt vs. Wert-für-Wert-Referenz (_replay_loop) auf denselben Reihen.
+    """
+    res: Dict[str, Any] = {"name": "replay", "stations": n_stations, "years": years}
+    if not hasattr(main_mod, "replay"):
+        return res
+    cfg_path = td_path / f"bench-replay-{n_stations}.json"
+    db_path = td_path / f"bench-replay-{n_stations}.db"
+    write_bench_config(cfg_path, db_path, n_stations)
+    cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+    cfg["trend"] = {"rise_cm_per_hour": 20}
+    cfg_path.write_text(json.dumps(cfg), encoding="utf-8")
+    settings = main_mod.load_settings(cfg_path)
+    n_values = int(years * 365 * 96)
+    start = int(datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp())
+
+    storage = main_mod.Storage(db_path)
+    try:
+        ppk = storage.param_pk("W", "cm")
+        for i, st in enumerate(settings.stations):
+            rnd = random.Random(i)
+            spk = storage.station_pk(st.station_no, st.station_id_public, st.name, "bench")
+            values, v = [], 100.0
+            for k in range(n_values):
+                # Grundrauschen + alle ~3 Wochen eine Welle
+                v += rnd.gauss(0, 1.5) + (0.01 * (100 - v))
+                if k % 2000 == i % 2000:
+                    v += rnd.uniform(40, 140)
+                values.append(v)
+            storage.con.executemany(
+                "INSERT INTO measurements(station_pk, param_pk, ts, value, level) VALUES (?, ?, ?, ?, 0)",
+                ((spk, ppk, start + k * 900, values[k]) for k in range(n_values)),
+            )
+        storage.con.commit()
+
+        t0 = time.perf_counter()
+        events, n_rows = main_mod.replay(settings, storage)
+        res["replay_seconds"] = time.perf_counter() - t0
+        res["values"] = n_rows
+        res["alerts"] = len(events)
+
+        series = []
+        for st in settings.stations:
+            rows = storage.con.execute(
+                "SELECT ts, value FROM measurements WHERE station_pk = ? AND param_pk = ? ORDER BY ts",
+                (storage.lookup_station_pk(st.station_no), ppk),
+            ).fetchall()
+            series.append((st, [r[0] for r in rows], [r[1] for r in rows]))
+        t0 = time.perf_counter()
+        ref = sum(len(main_mod._replay_loop(settings, st, ts, vals, False)) for st, ts, vals in series)
+        res["loop_seconds"] = time.perf_counter() - t0
+        if ref != len(events):
+            raise AssertionError(f"replay: {len(events)} Alarme, Referenz: {ref}")
+    finally:
+        storage.close()
+    return res
+
+
+def bench_tune(main_mod, n_combos: int, years: float) -> Dict[str, Any]:
+    """tune: Raster mit ~n_combos Kombinationen auf years Jahren einer Station, ein Prozess vs. Prozess-Pool."""
+    res: Dict[str, Any] = {"name": "tune", "values": None, "years": years}
+    if not hasattr(main_mod, "tune"):
+        return res
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as td:
+        cfg_path = Path(td) / "bench-tune.json"
+        write_bench_config(cfg_path, Path(td) / "bench-tune.db", 1)
+        settings = main_mod.load_settings(cfg_path)
+    station = settings.stations[0]
+    rnd = random.Random(5)
+    n_values = int(years * 365 * 96)
+    ts, values, v = [], [], 100.0
+    for k in range(n_values):
+        v += rnd.gauss(0, 1.5) + 0.01 * (100 - v) + (rnd.uniform(40, 140) if k % 2000 == 0 else 0)
+        ts.append(k * 900)
+        values.append(v)
+    rearms = [1, 2, 3, 4, 6, 8, 12, 16, 24, 36, 48, 72]
+    offsets = range(-(n_combos // len(rearms)) // 2, (n_combos // len(rearms) + 1) // 2)
+    sets = [tuple(th + off for th in station.thresholds_cm) for off in offsets]
+    res.update(values=n_values, combos=len(sets) * len(rearms), cpus=os.cpu_count())
+    for label, workers in (("single", 1), ("pool", None)):
+        t0 = time.perf_counter()
+        main_mod.tune(settings, station, ts, values, sets, rearms, station.thresholds_cm[-1], workers=workers)
+        res[f"{label}_seconds"] = time.perf_counter() - t0
+    return res
+
+
+def bench_tenants(
+    main_mod, td_path: Path, n_tenants: int, per_tenant: int, n_distinct: int, n_entries: int,
+    cycles: int = 4, changed: float = 0.1,
+) -> Dict[str, Any]:
+    """
+    Mehrmandanten-Betrieb: n_tenants Configs mit je per_tenant Stationen aus n_distinct verschiedenen,
+    Index mit n_entries Einträgen (aus Dateien eingespielt). Verglichen wird ein Zyklus über alle
+    Mandanten als getrennte Prozesse (je Mandant Abruf + Parse + check_once) mit check_tenants.
+    changed: Anteil der Stationen mit neuem Messwert je Zyklus.
+    """
+    res: Dict[str, Any] = {
+        "name": "tenants", "tenants": n_tenants, "stations": n_distinct, "entries": n_entries, "changed": changed,
+    }
+    if not hasattr(main_mod, "TenantHub"):
+        return res
+    rnd = random.Random(11)
+    replay: List[Path] = []
+    for cycle in range(cycles):
+        payload = make_bench_payload(n_distinct, cycle, changed) + make_index_entries(n_entries, 0, cycle)[n_distinct:]
+        path = td_path / f"bench-tenants-index-{n_entries}-{cycle}.json"
+        path.write_text(json.dumps(payload), encoding="utf-8")
+        replay.append(path)
+    subsets = [set(rnd.sample(range(n_distinct), per_tenant)) for _ in range(n_tenants)]
+
+    def configs(label: str) -> List[Path]:
+        out = []
+        for k, subset in enumerate(subsets):
+            cfg_path = td_path / f"bench-tenant-{label}-{n_tenants}-{k}.json"
+            write_bench_config(cfg_path, td_path / f"bench-tenant-{label}-{n_tenants}-{k}.db", n_distinct)
+            cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+            cfg["stations"] = [st for i, st in enumerate(cfg["stations"]) if i in subset]
+            cfg_path.write_text(json.dumps(cfg), encoding="utf-8")
+            out.append(cfg_path)
+        return out
+
+    sink = io.StringIO()
+    times: Dict[str, List[float]] = {"separate": [], "hub": []}
+    contexts = []
+    for cfg_path in configs("separate"):
+        settings = main_mod.load_settings(cfg_path)
+        ctx = main_mod.PollContext(settings)
+        ctx.fetcher = main_mod.FileIndexFetcher(settings, replay, ctx.metrics)
+        contexts.append((settings, ctx))
+    hub = main_mod.TenantHub(main_mod.load_tenants(configs("hub")))
+    hub.sources.fetchers[main_mod.HLNUG_PROVIDER] = main_mod.FileIndexFetcher(hub.settings, replay, hub.metrics)
+    try:
+        with contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+            for _ in range(cycles):
+                t0 = time.perf_counter()
+                for settings, ctx in contexts:
+                    main_mod.check_once(settings, ctx)
+                times["separate"].append(time.perf_counter() - t0)
+                t0 = time.perf_counter()
+                main_mod.check_tenants(hub)
+                times["hub"].append(time.perf_counter() - t0)
+    finally:
+        hub.close()
+        for _, ctx in contexts:
+            ctx.close()
+    for label, values in times.items():
+        steady = values[1:] or values
+        res[f"{label}_first_seconds"] = values[0]
+        res[f"{label}_seconds"] = sum(steady) / len(steady)
+    res["subscriptions"] = n_tenants * per_tenant
+    return res
+
+
+# Größen je Suite: quick für den Alltag, full für Vorher/Nachher-Vergleiche vor einem Release
+SUITES: Dict[str, Dict[str, Any]] = {
+    "quick": {
+        "load_stations": [100, 1000],
+        "parse": [(1000, 100), (10000, 100)],
+        "state": [(300, None)],
+        "history": [(10, 1.0)],
+        "replay": [(20, 1.0)],
+        "tune": [(240, 1.0)],
+        "tenants": [(10, 30, 100, 3000)],
+    },
+    "full": {
+        "load_stations": [1, 100, 1000, 5000],
+        "parse": [(1000, 100), (10000, 100), (100000, 100), (100000, 5000)],
+        "state": [(1, 10000), (100, 10000), (1000, 10000), (5000, 100000)],
+        "history": [(10, 1.0), (100, 3.0)],
+        "replay": [(300, 1.0)],
+        "tune": [(2400, 3.0)],
+        "tenants": [(10, 30, 100, 20000), (50, 50, 300, 20000)],
+    },
+}
+BENCHES = ("load", "parse", "state", "history", "replay", "tune", "tenants", "schema", "classify", "reclassify", "smtp", "metrics")
+
+# Felder, die einen Messpunkt identifizieren (für --compare); Kennzahlen *_seconds: kleiner ist besser
+KEY_FIELDS = ("name", "tenants", "stations", "entries", "changed", "days", "years", "values", "combos", "alerts", "scrape_interval")
+
+
+def calibrate(repeat: int = 5) -> float:
+    """
+    Feste Referenzlast (JSON, Sortieren, SQLite im Speicher), beste von repeat. Misst die aktuelle
+    Geschwindigkeit der Maschine, damit --compare Läufe bei unterschiedlicher Last/Taktung vergleicht.
+    """
+    payload = [{"station_no": str(24810000 + i), "ts_value": float(i % 311), "timestamp": f"2026-02-25T{i % 24:02d}:00"} for i in range(3000)]
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        data = json.loads(json.dumps(payload))
+        data.sort(key=lambda e: (e["ts_value"], e["station_no"]))
+        con = sqlite3.connect(":memory:")
+        con.execute("CREATE TABLE t (k TEXT PRIMARY KEY, v REAL)")
+        con.executemany("INSERT INTO t VALUES (?, ?)", ((e["station_no"], e["ts_value"]) for e in data))
+        con.execute("SELECT SUM(v) FROM t").fetchone()
+        con.close()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def run_meta(main_path: Path, main_mod) -> Dict[str, Any]:
+    """Versions- und Umgebungsangaben, damit Ergebnisdateien verschiedener Stände vergleichbar bleiben."""
+    head = main_path.read_text(encoding="utf-8", errors="replace")[:500]
+    m = re.search(r"\bv\d+(?:\.\d+)*[\w.-]*", head)
+    commit = None
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=main_path.parent, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        pass
+    return {
+        "script": main_path.name,
+        "version": m.group(0) if m else None,
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": getattr(main_mod, "np", None) is not None,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def _result_key(res: Dict[str, Any]) -> Tuple[Any, ...]:
+    return tuple(res.get(k) for k in KEY_FIELDS)
+
+
+# nur zur Information verglichen: Einzelmessung des ersten Zyklus (Kaltstart), Mittelwert (empfindlich
+# für Ausreißer) und Minimum (neben dem Median nicht doppelt zählen); bewertet wird der Median
+UNGATED_METRICS = ("first_cycle_seconds", "mean_seconds", "min_seconds")
+
+
+def compare_results(
+    old: List[Dict[str, Any]], new: List[Dict[str, Any]], tolerance: float, min_delta: float = 0.01,
+    speed: float = 1.0,
+) -> int:
+    """
+    Vergleicht *_seconds-Kennzahlen gleicher Messpunkte. Langsamer um mehr als tolerance (relativ)
+    und mindestens min_delta Sekunden gilt als Regression (außer UNGATED_METRICS, mit "(info)"
+    markiert). speed: Referenzlast neu/alt (calibrate); die alten Werte werden damit skaliert.
+    Rückgabe: Anzahl Regressionen.
+    """
+    old_by_key = {_result_key(r): r for r in old}
+    regressions = 0
+    print(f"{'Messpunkt':<48} {'Kennzahl':<28} {'alt':>10} {'neu':>10} {'Faktor':>7}")
+    for res in new:
+        prev = old_by_key.get(_result_key(res))
+        if prev is None:
+            continue
+        label = " ".join(f"{k}={res[k]}" for k in KEY_FIELDS if res.get(k) is not None)
+        for metric, value in res.items():
+            if not metric.endswith("seconds") or not isinstance(value, (int, float)):
+                continue
+            before = prev.get(metric)
+            if not isinstance(before, (int, float)) or before <= 0:
+                continue
+            before *= speed
+            ratio = value / before
+            flag = ""
+            if metric in UNGATED_METRICS:
+                flag = "  (info)"
+            elif ratio > 1 + tolerance and value - before > min_delta:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{label[:48]:<48} {metric[:28]:<28} {before:10.4f} {value:10.4f} {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def print_result(res: Dict[str, Any]) -> None:
+    scalars = {k: v for k, v in res.items() if v is not None and not isinstance(v, (list, dict))}
+    print(" | ".join(f"{k}={v:.4f}" if isinstance(v, float) else f"{k}={v}" for k, v in scalars.items()))
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--main", default="pegelabfrage.py", help="Pfad zum Hauptscript (default: pegelabfrage.py)")
+    ap.add_argument("--suite", choices=tuple(SUITES), default="quick", help="Größen der Messpunkte (default: quick)")
+    ap.add_argument("--stations", type=int, help="Anzahl Stationen für state/classify/metrics (default: aus --suite bzw. 300)")
+    ap.add_argument("--cycles", type=int, default=10, help="Zyklen pro Messung (default: 10)")
+    ap.add_argument(
+        "--changed", type=float, action="append",
+        help="Anteil Stationen mit neuem Messwert je Zyklus, mehrfach möglich (default: 1.0)",
+    )
+    ap.add_argument("--schema-stations", type=int, default=10, help="Stationen für den Schema-Benchmark (default: 10)")
+    ap.add_argument("--schema-days", type=int, default=365, help="Tage 15-Minuten-Werte für den Schema-Benchmark (default: 365)")
+    ap.add_argument("--alerts", type=int, default=50, help="gleichzeitige Alarme für den SMTP-Benchmark (default: 50)")
+    ap.add_argument(
+        "--smtp-login-delay", type=float, default=0.05,
+        help="simulierte Dauer für Verbindungsaufbau/TLS/Login in Sekunden (default: 0.05)",
+    )
+    ap.add_argument(
+        "--scrape-interval", type=float, default=1.0,
+        help="Abstand der Abrufe des Metrik-Endpunkts im Metrik-Benchmark in Sekunden, 0 = ohne Pause (default: 1.0)",
+    )
+    ap.add_argument("--only", action="append", choices=BENCHES, help="nur ausgewählte Benchmarks ausführen (mehrfach möglich)")
+    ap.add_argument("--json", help="Ergebnisse zusätzlich als JSON in diese Datei schreiben")
+    ap.add_argument("--compare", metavar="ALT.json", help="mit Ergebnissen eines früheren Laufs (--json) vergleichen")
+    ap.add_argument(
+        "--tolerance", type=float, default=0.25,
+        help="erlaubte relative Verlangsamung für --compare, darüber Exit-Code 1 (default: 0.25)",
+    )
+    ap.add_argument(
+        "--min-delta", type=float, default=0.01,
+        help="Verlangsamung unter so vielen Sekunden ist keine Regression (Messrauschen, default: 0.01)",
+    )
+    args = ap.parse_args()
+
+    main_path = resolve_main_path(args.main)
+    if not main_path.exists():
+        raise SystemExit(f"Hauptscript nicht gefunden: {main_path}")
+    main_mod = load_main_module(main_path)
+    index_url = getattr(main_mod, "HLNUG_LASTVALUES_INDEX", "")
+    suite = SUITES[args.suite]
+    n_stations = args.stations or 300
+
+    results = []
+    calibration = calibrate()
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as td:
+        td_path = Path(td)
+        selected = set(args.only or BENCHES)
+        if "load" in selected:
+            for n in suite["load_stations"]:
+                results.append(bench_load_settings(main_mod, td_path, n))
+        if "parse" in selected:
+            for n_entries, n in suite["parse"]:
+                results.append(bench_parse_index(main_mod, td_path, n_entries, n))
+        if "state" in selected:
+            grid = [(args.stations, None)] if args.stations else suite["state"]
+            for n, n_entries in grid:
+                for changed in args.changed or [1.0]:
+                    results.append(
+                        bench_check_once_state(main_mod, td_path, index_url, n, args.cycles, changed, n_entries)
+                    )
+        if "history" in selected:
+            for n, years in suite["history"]:
+                results.append(bench_history_db(main_mod, td_path, index_url, n, years))
+        if "replay" in selected:
+            for n, years in suite["replay"]:
+                results.append(bench_replay(main_mod, td_path, n, years))
+        if "tune" in selected:
+            for n_combos, years in suite["tune"]:
+                results.append(bench_tune(main_mod, n_combos, years))
+        if "tenants" in selected:
+            for n_tenants, per_tenant, n_distinct, n_entries in suite["tenants"]:
+                results.append(bench_tenants(main_mod, td_path, n_tenants, per_tenant, n_distinct, n_entries))
+        if "schema" in selected:
+            results.append(bench_measurement_schema(main_mod, td_path, args.schema_stations, args.schema_days))
+        if "classify" in selected:
+            results.append(bench_classify(main_mod, 1_000_000, n_stations))
+        if "reclassify" in selected:
+            results.append(bench_reclassify(main_mod, td_path, args.schema_stations, args.schema_days))
+        if "smtp" in selected:
+            results.append(bench_smtp(main_mod, td_path, args.alerts, args.smtp_login_delay))
+        if "metrics" in selected:
+            results.append(
+                bench_metrics(main_mod, td_path, index_url, n_stations, max(args.cycles, 20), args.scrape_interval)
+            )
+
+    calibration = min(calibration, calibrate())  # vor und nach den Messungen: schnellerer Wert
+    for res in results:
+        print_result(res)
+    if args.json:
+        doc = {"meta": {**run_meta(main_path, main_mod), "calibration_seconds": calibration}, "suite": args.suite, "results": results}
+        Path(args.json).write_text(json.dumps(doc, indent=2), encoding="utf-8")
+    if args.compare:
+        old = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        old_results = old["results"] if isinstance(old, dict) else old  # ältere Dateien: nur die Liste
+        old_calibration = old.get("meta", {}).get("calibration_seconds") if isinstance(old, dict) else None
+        speed = calibration / old_calibration if old_calibration else 1.0
+        print()
+        if speed != 1.0:
+            print(f"Referenzlast: alt {old_calibration * 1000:.1f} ms, neu {calibration * 1000:.1f} ms – alte Werte x{speed:.2f}")
+        regressions = compare_results(old_results, results, args.tolerance, args.min_delta, speed)
+        print(f"{regressions} Regression(en) (Toleranz {args.tolerance:.0%}, mindestens {args.min_delta * 1000:g} ms)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -13,25 +13,47 @@
 
 import argparse
 import contextlib
+import copy
+import dataclasses
 import importlib.util
 import io
+import json
+import math
+import os
+import random
+import re
+import socketserver
+import sqlite3
 import sys
 import tempfile
+import threading
 import time
+import urllib.request
 import gc
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 
 
 class FakeResponse:
-    def __init__(self, status_code: int, payload: Any):
+    def __init__(self, status_code: int, payload: Any, headers: Optional[Dict[str, str]] = None):
         self.status_code = status_code
         self._payload = payload
+        self.headers = dict(headers or {})
         self.text = str(payload)[:500]
 
     def json(self) -> Any:
         return self._payload
 
+    def iter_content(self, chunk_size: int = 1, decode_unicode: bool = False):
+        raw = json.dumps(self._payload, ensure_ascii=False).encode("utf-8")
+        for i in range(0, len(raw), chunk_size):
+            yield raw[i : i + chunk_size]
+
+    def close(self) -> None:
+        pass
+
     def raise_for_status(self) -> None:
         if self.status_code >= 400:
             raise RuntimeError(f"HTTP {self.status_code}")
@@ -71,87 +93,277 @@ def make_index_payload() -> List[Dict[str, Any]]:
     ]
 
 
+def make_large_index_payload(extra: int) -> List[Dict[str, Any]]:
+    """Index mit den Test-Stationen plus `extra` fremden Stationen (Umlaute für Chunk-Grenzen)."""
+    payload = make_index_payload()
+    for i in range(extra):
+        payload.append(
+            {
+                "station_id": 50000 + i,
+                "station_no": str(25000000 + i),
+                "station_name": f"Gießen-Süd {i} - Lahn",
+                "stationparameter_name": "W" if i % 2 else "Q",
+                "ts_unitsymbol": "cm",
+                "timestamp": "2026-02-25T13:30:00+01:00",
+                "ts_value": float(i % 300),
+            }
+        )
+    return payload
+
+
 def write_temp_config(cfg_path: Path, db_path: Path) -> None:
     """
     Temp-Config für den Test.
     Wichtig:
     - email.enabled=false (keine Mails)
-    - [threshold].thresholds_cm ist gesetzt (dein Hauptscript verlangt das).
-    """
-    cfg = f"""\
-[threshold]
-thresholds_cm = 150,180,200,220
-level_names = OK,Stufe1,Stufe2,Stufe3
-
-[storage]
-db_path = {str(db_path)}
-
-[runtime]
-mode = once
-poll_interval_minutes = 15
-poll_interval_seconds = 0
-min_alert_interval_minutes = 180
-request_timeout_seconds = 20
-
-[email]
-enabled = false
-to = test@example.org
-from = test@example.org
-
-[smtp]
-host = smtp.example.org
-port = 465
-user = test
-password = test
-use_ssl = true
-use_starttls = false
-
-[debug]
-enabled = false
-
-[station:Unter-Schmitten - Nidda]
-station_id_public = 41806
-station_no = 24810600
-parameter = W
-thresholds_cm = 150,180,200,220
-level_names = OK,Stufe1,Stufe2,Stufe3
-
-[station:Ulfa - Ulfa]
-station_id_public = 41801
-station_no = 24810552
-parameter = W
-thresholds_cm = 60,70,80,90
-level_names = OK,Stufe1,Stufe2,Stufe3
-"""
-    cfg_path.write_text(cfg, encoding="utf-8")
-
-
-def patch_requests(main_mod, payload: Any, index_url: str):
+    - threshold.thresholds_cm ist gesetzt (das Hauptscript verlangt das).
+    """
+    cfg = {
+        "threshold": {
+            "thresholds_cm": [150, 180, 200, 220],
+            "level_names": ["OK", "Stufe1", "Stufe2", "Stufe3"],
+        },
+        "storage": {"db_path": str(db_path)},
+        "runtime": {
+            "mode": "once",
+            "poll_interval_minutes": "15",
+            "poll_interval_seconds": "0",
+            "min_alert_interval_minutes": "180",
+            "request_timeout_seconds": "20",
+        },
+        "email": {"enabled": "false", "to": "test@example.org", "from": "test@example.org"},
+        "smtp": {
+            "host": "smtp.example.org",
+            "port": "465",
+            "user": "test",
+            "password": "test",
+            "use_ssl": "true",
+            "use_starttls": "false",
+        },
+        "debug": {"enabled": "false"},
+        "stations": [
+            {
+                "name": "Unter-Schmitten - Nidda",
+                "station_id_public": "41806",
+                "station_no": "24810600",
+                "parameter": "W",
+                "thresholds_cm": [150, 180, 200, 220],
+                "level_names": ["OK", "Stufe1", "Stufe2", "Stufe3"],
+            },
+            {
+                "name": "Ulfa - Ulfa",
+                "station_id_public": "41801",
+                "station_no": "24810552",
+                "parameter": "W",
+                "thresholds_cm": [60, 70, 80, 90],
+                "level_names": ["OK", "Stufe1", "Stufe2", "Stufe3"],
+            },
+        ],
+    }
+    cfg_path.write_text(json.dumps(cfg, indent=2), encoding="utf-8")
+
+
+def patch_requests(main_mod, payload: Any, index_url: str, etag: Optional[str] = None) -> Dict[str, int]:
     """
     Patcht requests.Session.get (+ requests.get) im Hauptmodul,
     damit kein echter HTTP Call passiert.
+    Mit etag: antwortet auf passendes If-None-Match mit 304 (Conditional GET).
+    Rückgabe: Zähler (sessions/requests/not_modified) für Assertions.
     """
     if not hasattr(main_mod, "requests"):
         raise RuntimeError("Hauptscript importiert kein 'requests' – Harness kann nicht patchen.")
 
-    real_session_cls = main_mod.requests.Session
+    counters = {"sessions": 0, "requests": 0, "not_modified": 0}
+    real_session_cls = getattr(main_mod.requests.Session, "_harness_real_cls", main_mod.requests.Session)
+
+    def answer(url, headers: Optional[Dict[str, str]]) -> FakeResponse:
+        u = str(url)
+        counters["requests"] += 1
+        if u == index_url or u.endswith("/layers/10/index.json"):
+            if etag is not None and (headers or {}).get("If-None-Match") == etag:
+                counters["not_modified"] += 1
+                return FakeResponse(304, None, {"ETag": etag})
+            return FakeResponse(200, payload, {"ETag": etag} if etag else None)
+        return FakeResponse(404, {"error": f"Unexpected URL in test harness: {u}"})
 
     class PatchedSession(real_session_cls):
+        _harness_real_cls = real_session_cls
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            counters["sessions"] += 1
+
         def get(self, url, *args, **kwargs):
-            u = str(url)
-            if u == index_url or u.endswith("/layers/10/index.json"):
-                return FakeResponse(200, payload)
-            return FakeResponse(404, {"error": f"Unexpected URL in test harness: {u}"})
+            # immer die Antwort des letzten patch_requests-Aufrufs (auch für bereits offene Sessions)
+            return main_mod.requests._harness_answer(url, kwargs.get("headers"))
 
+    main_mod.requests._harness_answer = answer
     main_mod.requests.Session = PatchedSession
 
     def patched_get(url, *args, **kwargs):
-        u = str(url)
-        if u == index_url or u.endswith("/layers/10/index.json"):
-            return FakeResponse(200, payload)
-        return FakeResponse(404, {"error": f"Unexpected URL in test harness: {u}"})
+        return answer(url, kwargs.get("headers"))
 
     main_mod.requests.get = patched_get
+    return counters
+
+
+def unpatch_requests(main_mod) -> None:
+    """Stellt die echte requests.Session wieder her (für Szenarien mit lokalem HTTP-Server)."""
+    real_cls = getattr(main_mod.requests.Session, "_harness_real_cls", None)
+    if real_cls is not None:
+        main_mod.requests.Session = real_cls
+
+
+class FakeHttpServer:
+    """
+    Lokaler HTTP-Server (Thread) für Szenarien mit echtem HTTP:
+    routes: Pfad -> JSON-Payload (unbekannte Pfade: 404), optional mit Verzögerung.
+    trickle > 0: Body in 5 Teilen mit je trickle Sekunden Pause (langsamer Server unterhalb des Socket-Timeouts).
+    Zählt Anfragen und die maximale Zahl gleichzeitiger Anfragen.
+    """
+
+    def __init__(self, routes: Dict[str, Any], delay: float = 0.0):
+        self.routes = routes
+        self.delay = delay
+        self.trickle = 0.0
+        self.requests: List[str] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.requests.append(self.path)
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    time.sleep(server.delay)
+                    path = self.path.split("?", 1)[0]
+                    if path in server.routes:
+                        body = json.dumps(server.routes[path]).encode("utf-8")
+                        self.send_response(200)
+                    else:
+                        body = b'{"error": "not found"}'
+                        self.send_response(404)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    if server.trickle > 0:
+                        step = len(body) // 5 + 1
+                        for i in range(0, len(body), step):
+                            self.wfile.write(body[i:i + step])
+                            self.wfile.flush()
+                            time.sleep(server.trickle)
+                    else:
+                        self.wfile.write(body)
+                except ConnectionError:
+                    pass  # Client hat aufgegeben (Timeout-Szenarien)
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    def __enter__(self) -> "FakeHttpServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class FakeSmtpServer:
+    """
+    Minimaler lokaler SMTP-Server (Thread, ohne TLS) als Ersatz für den Mailserver:
+    EHLO/AUTH PLAIN/MAIL/RCPT/DATA/QUIT, optional mit Verzögerung für Verbindungsaufbau+Login
+    (simuliert TLS-Handshake/Auth) und Verbindungsabbruch nach max_per_connection Mails bzw.
+    (drop_before_reply) nach angenommenem DATA, aber vor der Antwort.
+    Zählt Verbindungen und speichert empfangene Nachrichten (Rohtext).
+    """
+
+    def __init__(self, login_delay: float = 0.0, max_per_connection: int = 0, drop_before_reply: bool = False):
+        self.login_delay = login_delay
+        self.max_per_connection = max_per_connection
+        self.drop_before_reply = drop_before_reply
+        self.connections = 0
+        self.messages: List[str] = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line: str) -> None:
+                self.wfile.write((line + "\r\n").encode("ascii"))
+
+            def handle(self):
+                with server._lock:
+                    server.connections += 1
+                n_messages = 0
+                self.reply("220 fake-smtp ESMTP")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    cmd = line.decode("ascii", "replace").strip().split(" ", 1)[0].upper()
+                    if cmd in ("EHLO", "HELO"):
+                        self.reply("250-fake-smtp")
+                        self.reply("250 AUTH PLAIN")
+                    elif cmd == "AUTH":
+                        time.sleep(server.login_delay)
+                        self.reply("235 2.7.0 Authentication successful")
+                    elif cmd in ("MAIL", "RCPT", "RSET", "NOOP"):
+                        self.reply("250 OK")
+                    elif cmd == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        data = []
+                        while True:
+                            dl = self.rfile.readline()
+                            if not dl or dl in (b".\r\n", b".\n"):
+                                break
+                            data.append(dl.decode("utf-8", "replace"))
+                        with server._lock:
+                            server.messages.append("".join(data))
+                        if server.drop_before_reply:
+                            return
+                        self.reply("250 OK queued")
+                        n_messages += 1
+                        if server.max_per_connection and n_messages >= server.max_per_connection:
+                            return  # Server trennt die Verbindung (Limit pro Verbindung)
+                    elif cmd == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("502 Command not implemented")
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._srv = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._srv.daemon_threads = True
+        self.port = self._srv.server_address[1]
+        self._thread = threading.Thread(target=self._srv.serve_forever, daemon=True)
+
+    def __enter__(self) -> "FakeSmtpServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._srv.shutdown()
+        self._srv.server_close()
+
+
+def use_fake_smtp(cfg_path: Path, port: int, digest: bool = False) -> None:
+    """Temp-Config auf den lokalen FakeSmtpServer umstellen (ohne SSL/STARTTLS)."""
+    cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+    cfg["email"]["enabled"] = "true"
+    cfg["email"]["digest"] = digest
+    cfg["smtp"].update({"host": "127.0.0.1", "port": str(port), "use_ssl": "false", "use_starttls": "false"})
+    cfg_path.write_text(json.dumps(cfg, indent=2), encoding="utf-8")
 
 
 def alignment_check(output: str) -> None:
@@ -175,6 +387,1613 @@ def resolve_main_path(p: str) -> Path:
     return cand.resolve()  # wird später als nicht vorhanden gemeldet
 
 
+def scenario_conditional_get(main_mod, td_path: Path, index_url: str) -> None:
+    """
+    Langlebiger PollContext: eine HTTP-Session und eine DB-Verbindung über mehrere Zyklen,
+    304 überspringt die Auswertung, Leser blockieren nicht (WAL).
+    """
+    cfg_path = td_path / "config-cond.json"
+    db_path = td_path / "pegel_cond.db"
+    write_temp_config(cfg_path, db_path)
+    counters = patch_requests(main_mod, make_index_payload(), index_url, etag='"v1"')
+
+    settings = main_mod.load_settings(cfg_path)
+    ctx = main_mod.PollContext(settings)
+    outputs = []
+    try:
+        for _ in range(3):
+            buf = io.StringIO()
+            with contextlib.redirect_stdout(buf):
+                rc = main_mod.check_once(settings, ctx)
+            if rc != 0:
+                raise AssertionError(f"check_once rc={rc} im Conditional-GET-Szenario")
+            outputs.append(buf.getvalue())
+
+        con = ctx.storage.con
+        if con.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+            raise AssertionError("DB läuft nicht im WAL-Modus")
+        # offene Schreib-Transaktion des Pollers darf Leser nicht blockieren
+        con.execute("INSERT INTO state(key, value) VALUES ('harness', 'x')")
+        with contextlib.closing(sqlite3.connect(db_path, timeout=0.5)) as reader:
+            reader.execute("SELECT COUNT(*) FROM measurements").fetchone()
+        con.rollback()
+    finally:
+        ctx.close()
+
+    if counters["sessions"] != 1:
+        raise AssertionError(f"Erwartet genau eine Session über alle Zyklen, erhalten: {counters['sessions']}")
+    if counters["not_modified"] != 2:
+        raise AssertionError(f"Erwartet 2x 304 Not Modified, erhalten: {counters['not_modified']}")
+    if "Ulfa" not in outputs[0] or "Ulfa" in outputs[1]:
+        raise AssertionError("304 darf keine Auswertung auslösen, der erste Zyklus muss auswerten")
+
+
+def scenario_stream_parse(main_mod, td_path: Path, index_url: str) -> None:
+    """Streaming-Parser: identisch zu json.loads, auch bei Chunk-Grenzen mitten in UTF-8-Zeichen."""
+    payload = make_large_index_payload(50)
+    raw = json.dumps(payload, ensure_ascii=False, indent=1).encode("utf-8")
+    for chunk_size in (1, 7, 4096):
+        chunks = [raw[i : i + chunk_size] for i in range(0, len(raw), chunk_size)]
+        parsed = list(main_mod.iter_json_array(chunks))
+        if parsed != payload:
+            raise AssertionError(f"iter_json_array weicht von json.loads ab (chunk_size={chunk_size})")
+    if list(main_mod.iter_json_array([b" [ ] "])) != []:
+        raise AssertionError("Leeres Array wird nicht erkannt")
+    # Zahlen und Literale auf Top-Level, an jeder Stelle zerschnitten
+    for doc in (b"[-2.5, 1e3, 12, true, null, -0.25E-2]", b"[1e3]", b"[-2.5 ]"):
+        for cut in range(1, len(doc)):
+            parsed = list(main_mod.iter_json_array([doc[:cut], doc[cut:]]))
+            if parsed != json.loads(doc):
+                raise AssertionError(f"Zahl an Chunk-Grenze falsch gelesen: {doc[:cut]!r} | {doc[cut:]!r} -> {parsed}")
+    for broken in (b'[{"a": 1}', b'{"a": 1}', b'[{"a": 1} {"b": 2}]'):
+        try:
+            list(main_mod.iter_json_array([broken]))
+        except (RuntimeError, ValueError):
+            continue
+        raise AssertionError(f"Kaputtes JSON nicht erkannt: {broken!r}")
+
+    cfg_path = td_path / "config-stream.json"
+    write_temp_config(cfg_path, td_path / "pegel_stream.db")
+    patch_requests(main_mod, payload, index_url)
+    settings = main_mod.load_settings(cfg_path)
+    if not settings.stream_index:
+        raise AssertionError("stream_index sollte Standard sein")
+    kept = main_mod.fetch_index(settings)
+    if sorted(item["station_no"] for item in kept) != ["24810552", "24810600"]:
+        raise AssertionError(f"Streaming-Filter behält falsche Einträge: {[i['station_no'] for i in kept]}")
+
+
+def scenario_station_index(main_mod) -> None:
+    """StationIndex: Lookup über station_no, station_id und Name; Mehrdeutigkeit wird gemeldet."""
+    def station(name: str, no: str, sid: str = ""):
+        return main_mod.StationConfig(
+            name=name, station_id_public=sid, station_no=no, parameter="W",
+            thresholds_cm=(1.0, 2.0, 3.0), level_names=("a", "b", "c"),
+        )
+
+    payload = make_index_payload()
+    payload.append(dict(payload[0]))  # exaktes Duplikat: kein Problem
+    payload.append(dict(payload[1], ts_value=96.0, station_id=99999))  # gleiche station_no, anderer Eintrag
+    payload.append({"station_id": 42000, "station_no": "X1", "station_name": "Bad  Vilbel – Nidda",
+                    "stationparameter_name": "W", "timestamp": "2026-02-25T13:30:00+01:00", "ts_value": 5})
+    index = main_mod.build_index_map(payload)
+
+    if index.lookup(station("Unter-Schmitten - Nidda", "24810600"))["ts_value"] != 110.0:
+        raise AssertionError("Lookup über station_no fehlgeschlagen")
+    if index.lookup(station("x", "", "41806"))["station_no"] != "24810600":
+        raise AssertionError("Lookup über station_id fehlgeschlagen")
+    if index.lookup(station("bad vilbel - nidda", ""))["station_no"] != "X1":
+        raise AssertionError("Lookup über normalisierten Namen fehlgeschlagen")
+    # station_no konfiguriert, aber (z.B. bei Ausfall) nicht im Index: kein gleichnamiger anderer Pegel
+    if index.lookup(station("Bad Vilbel - Nidda", "24810999", "42000")) is not None:
+        raise AssertionError("Fallback über ID/Name darf keinen Eintrag mit anderer station_no liefern")
+    try:
+        main_mod.latest_for_station(index, station("Bad Vilbel - Nidda", "24810999"))
+    except RuntimeError as e:
+        if "nicht im index.json" not in str(e):
+            raise
+    else:
+        raise AssertionError("Fehlende station_no muss als 'nicht im index.json' gemeldet werden")
+    if index.lookup(station("unbekannt", "0")) is not None:
+        raise AssertionError("Unbekannte Station muss None liefern")
+    try:
+        index.lookup(station("Ulfa - Ulfa", "24810552"))
+    except RuntimeError as e:
+        if "Mehrdeutig" not in str(e):
+            raise
+    else:
+        raise AssertionError("Mehrdeutiger station_no-Treffer wurde nicht gemeldet")
+    if len(index.duplicates()) != 2:  # station_no und Name von Ulfa
+        raise AssertionError(f"Erwartet zwei mehrdeutige Schlüssel: {index.duplicates()}")
+
+
+def enable_fake_email(cfg_path: Path) -> None:
+    """Aktiviert E-Mail in einer Temp-Config (Versand wird im Szenario gepatcht)."""
+    cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+    cfg["email"]["enabled"] = "true"
+    cfg_path.write_text(json.dumps(cfg, indent=2), encoding="utf-8")
+
+
+def ulfa_payload(ts: str, value: float) -> List[Dict[str, Any]]:
+    payload = make_index_payload()
+    payload[1] = dict(payload[1], timestamp=ts, ts_value=value)
+    return payload
+
+
+def scenario_rearm(main_mod, td_path: Path, index_url: str) -> None:
+    """Alarm-Flanke + Re-Arm erst nach rearm_below_hours (Default 6 h) durchgehend unterhalb."""
+    cfg_path = td_path / "config-rearm.json"
+    db_path = td_path / "pegel_rearm.db"
+    write_temp_config(cfg_path, db_path)
+    enable_fake_email(cfg_path)
+    settings = main_mod.load_settings(cfg_path)
+
+    sent: List[str] = []
+    real_send = main_mod.send_email
+    main_mod.send_email = lambda _settings, subject, _body, *_args: sent.append(subject)
+    try:
+        # Ulfa: Schwellen 60/70/80/90
+        steps = [
+            ("2026-02-25T00:00:00+01:00", 65.0),  # Stufe1 -> Alarm
+            ("2026-02-25T01:00:00+01:00", 50.0),  # unterhalb seit 01:00
+            ("2026-02-25T02:00:00+01:00", 65.0),  # zu früh wieder oberhalb -> kein Alarm
+            ("2026-02-25T03:00:00+01:00", 50.0),  # unterhalb seit 03:00
+            ("2026-02-25T10:00:00+01:00", 50.0),  # 7 h unterhalb -> re-armed
+            ("2026-02-25T11:00:00+01:00", 65.0),  # erneuter Alarm
+        ]
+        for ts, value in steps:
+            patch_requests(main_mod, ulfa_payload(ts, value), index_url)
+            with contextlib.redirect_stdout(io.StringIO()):
+                main_mod.check_once(settings)
+    finally:
+        main_mod.send_email = real_send
+
+    ulfa = [subj for subj in sent if "Ulfa" in subj]
+    if len(ulfa) != 2 or not all(subj.startswith("OK ") for subj in ulfa):
+        raise AssertionError(f"Erwartet 2 Alarme für Ulfa/Stufe 1, erhalten: {ulfa}")
+
+    with sqlite3.connect(db_path) as con:
+        armed, below_since, last_alert_at, last_level = con.execute(
+            "SELECT armed, below_since, last_alert_at, last_level FROM alert_state "
+            "WHERE station_no = '24810552' AND parameter = 'W' AND threshold_idx = 0"
+        ).fetchone()
+    if armed != 0 or below_since is not None or last_alert_at is None or last_level != 1:
+        raise AssertionError(f"alert_state unerwartet: {(armed, below_since, last_alert_at, last_level)}")
+
+
+def scenario_state_migration(main_mod, td_path: Path) -> None:
+    """init_db übernimmt alte Key/Value-Zeilen aus state nach alert_state."""
+    db_path = td_path / "pegel_legacy_state.db"
+    with sqlite3.connect(db_path) as con:
+        con.execute("CREATE TABLE state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        con.executemany(
+            "INSERT INTO state(key, value) VALUES (?, ?)",
+            [
+                ("armed:24810552:W:0", "0"),
+                ("below_since:24810552:W:0", "2026-02-25T01:00:00+01:00"),
+                ("armed:24810552:W:1", "1"),
+                ("below_since:24810552:W:1", ""),
+                ("last_level:24810552:W", "1"),
+                ("last_level:24810600:W", "0"),
+                ("other", "keep"),
+            ],
+        )
+    con.close()
+
+    main_mod.init_db(db_path)
+
+    with sqlite3.connect(db_path) as con:
+        rows = con.execute(
+            "SELECT station_no, threshold_idx, armed, below_since, last_level FROM alert_state "
+            "ORDER BY station_no, threshold_idx"
+        ).fetchall()
+        left = con.execute("SELECT key FROM state").fetchall()
+    con.close()
+    expected = [
+        ("24810552", 0, 0, 1771977600, 1),
+        ("24810552", 1, 1, None, 1),
+        ("24810600", 0, None, None, 0),
+    ]
+    if rows != expected:
+        raise AssertionError(f"Migration state -> alert_state unerwartet: {rows}")
+    if left != [("other",)]:
+        raise AssertionError(f"Alte state-Zeilen nicht entfernt: {left}")
+
+
+def scenario_measurement_migration(main_mod, td_path: Path) -> None:
+    """Alte measurements-Tabelle (Text/ISO) wird beim Öffnen ins kompakte Schema überführt."""
+    db_path = td_path / "pegel_legacy_meas.db"
+    with contextlib.closing(sqlite3.connect(db_path)) as con:
+        con.execute(
+            """
+            CREATE TABLE measurements (
+                station_no TEXT NOT NULL, station_id_public TEXT, station_name TEXT,
+                parameter TEXT NOT NULL, ts TEXT NOT NULL, value REAL NOT NULL,
+                level INTEGER, source TEXT, unit TEXT,
+                PRIMARY KEY (station_no, parameter, ts)
+            )
+            """
+        )
+        con.executemany(
+            "INSERT INTO measurements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                ("24810552", "41801", "Ulfa - Ulfa", "W", "2026-02-25T13:30:00+01:00", 95.0, 4, "layers:10:index", "cm"),
+                ("24810552", "41801", "Ulfa - Ulfa", "W", "2026-02-25T13:45:00+01:00", 96.0, 4, "layers:10:index", "cm"),
+                ("24810600", "41806", "Unter-Schmitten - Nidda", "W", "2026-02-25T05:45:00+01:00", 110.0, 0, "layers:10:index", "cm"),
+            ],
+        )
+        con.commit()
+
+    storage = main_mod.Storage(db_path)
+    try:
+        con = storage.con
+        if "station_no" in main_mod._table_columns(con, "measurements"):
+            raise AssertionError("measurements wurde nicht migriert")
+        rows = con.execute(
+            "SELECT station_no, parameter, ts, value, level, unit FROM measurements_view ORDER BY station_no, ts"
+        ).fetchall()
+        expected = [
+            ("24810552", "W", 1772022600, 95.0, 4, "cm"),
+            ("24810552", "W", 1772023500, 96.0, 4, "cm"),
+            ("24810600", "W", 1771994700, 110.0, 0, "cm"),
+        ]
+        if rows != expected:
+            raise AssertionError(f"Migrierte Messwerte unerwartet: {rows}")
+        if storage.lookup_station_pk("24810552") is None or main_mod._table_exists(con, "measurements_legacy"):
+            raise AssertionError("Dimensionen/Aufräumen nach Migration unvollständig")
+        hourly = con.execute("SELECT n, v_min, v_max, v_last FROM measurements_hourly ORDER BY station_pk").fetchall()
+        if sorted(hourly) != [(1, 110.0, 110.0, 110.0), (2, 95.0, 96.0, 96.0)]:
+            raise AssertionError(f"Rollups wurden bei der Migration nicht aufgebaut: {hourly}")
+    finally:
+        storage.close()
+
+
+def scenario_backfill(main_mod, td_path: Path) -> None:
+    """Backfill gegen lokalen Fake-WISKI-Server: begrenzte Parallelität, Dedupe, Gap-Erkennung."""
+    cfg_path = td_path / "config-backfill.json"
+    db_path = td_path / "pegel_backfill.db"
+    write_temp_config(cfg_path, db_path)
+    cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+    cfg["backfill"] = {"workers": 1, "initial_days": 3}
+    cfg_path.write_text(json.dumps(cfg), encoding="utf-8")
+    settings = main_mod.load_settings(cfg_path)
+
+    now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    data = []
+    for k in range(96):
+        ts = (now - timedelta(minutes=15 * k)).astimezone(timezone(timedelta(hours=1)))
+        data.append([ts.isoformat(timespec="milliseconds"), None if k % 10 == 5 else 50.0 + k % 40])
+    routes = {
+        "/stations/0/24810552/W/week.json": [{"ts_name": "15min", "columns": "Timestamp,Value", "data": data}],
+        "/layers/10/index.json": make_index_payload(),
+    }
+
+    unpatch_requests(main_mod)
+    real_url = main_mod.HLNUG_STATION_TS_URL
+    with FakeHttpServer(routes, delay=0.05) as server:
+        main_mod.HLNUG_STATION_TS_URL = server.base_url + "/stations/0/{station_no}/{parameter}/{period}.json"
+        ctx = main_mod.PollContext(settings)
+        try:
+            ranges = [(st, now - timedelta(days=2), now) for st in settings.stations]
+            err = io.StringIO()
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(err):
+                first = main_mod.backfill(settings, ctx, ranges)
+                second = main_mod.backfill(settings, ctx, ranges)
+            gaps = main_mod.detect_gaps(settings, ctx.storage, now)
+        finally:
+            ctx.close()
+        # once-Lauf (geplanter Aufruf): kein Nachladen beim Start, nur der Index-Abruf
+        n_requests = len(server.requests)
+        cfg["providers"] = {"hlnug": {"url": server.base_url + "/layers/10/index.json"}}
+        cfg["storage"]["db_path"] = str(td_path / "pegel_backfill_once.db")
+        cfg_path.write_text(json.dumps(cfg), encoding="utf-8")
+        try:
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                run_main(main_mod, ["--config", str(cfg_path)])
+        finally:
+            main_mod.HLNUG_STATION_TS_URL = real_url
+        once_requests = server.requests[n_requests:]
+
+    expected = sum(1 for _, v in data if v is not None)
+    if first.get("Ulfa - Ulfa") != expected or second.get("Ulfa - Ulfa") != 0:
+        raise AssertionError(f"Backfill: erwartet {expected} neue, dann 0 Werte, erhalten {first} / {second}")
+    if "Unter-Schmitten - Nidda" in first or "Unter-Schmitten" not in err.getvalue():
+        raise AssertionError("Fehler einer Station (404) muss gemeldet werden, ohne die anderen zu stoppen")
+    if once_requests != ["/layers/10/index.json"]:
+        raise AssertionError(f"once-Modus darf beim Start nicht nachladen: {once_requests}")
+    if server.max_in_flight != 1 or n_requests != 4:
+        raise AssertionError(f"Parallelität nicht begrenzt: max={server.max_in_flight}, requests={server.requests}")
+    gap_names = [(st.name, round((t_to - t_from).total_seconds() / 86400)) for st, t_from, t_to in gaps]
+    if gap_names != [("Unter-Schmitten - Nidda", 3)]:
+        raise AssertionError(f"Gap-Erkennung unerwartet: {gap_names}")
+
+
+def scenario_rollups_retention(main_mod, td_path: Path) -> None:
+    """Stunden-/Tages-Rollups per Trigger; Kompaktierung löscht nur abgelaufene Zeilen je Tabelle."""
+    cfg_path = td_path / "config-retention.json"
+    db_path = td_path / "pegel_retention.db"
+    write_temp_config(cfg_path, db_path)
+    cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+    cfg["storage"].update({"raw_retention_days": 30, "hourly_retention_days": 90, "compact_interval_hours": 24})
+    cfg_path.write_text(json.dumps(cfg), encoding="utf-8")
+    settings = main_mod.load_settings(cfg_path)
+
+    now = datetime(2026, 3, 1, tzinfo=timezone.utc)
+    storage = main_mod.Storage(db_path)
+    try:
+        con = storage.con
+        spk = storage.station_pk("24810552", "41801", "Ulfa - Ulfa", "layers:10:index")
+        ppk = storage.param_pk("W", "cm")
+        day = 86400
+        t_old = int(now.timestamp()) - 200 * day
+        t_mid = int(now.timestamp()) - 60 * day
+        t_new = int(now.timestamp()) - 1 * day
+        rows = []
+        for base in (t_old, t_mid, t_new):
+            rows += [(spk, ppk, base + k * 900, 50.0 + k, 0) for k in range(4)]  # eine Stunde, 4 Werte
+        rows.append((spk, ppk, t_new, 999.0, 0))  # Dublette -> ignoriert, kein Rollup-Effekt
+        con.executemany("INSERT OR IGNORE INTO measurements VALUES (?, ?, ?, ?, ?)", rows)
+        con.commit()
+
+        hour = con.execute(
+            "SELECT n, v_min, v_max, v_sum / n, v_last FROM measurements_hourly WHERE bucket = ?", (t_new - t_new % 3600,)
+        ).fetchone()
+        if hour != (4, 50.0, 53.0, 51.5, 53.0):
+            raise AssertionError(f"Stunden-Rollup unerwartet: {hour}")
+
+        deleted = main_mod.compact_storage(settings, storage, now)
+        if deleted != {"measurements": 8, "measurements_hourly": 1}:
+            raise AssertionError(f"Kompaktierung unerwartet: {deleted}")
+        counts = [con.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                  for t in ("measurements", "measurements_hourly", "measurements_daily")]
+        if counts != [4, 2, 3]:
+            raise AssertionError(f"Zeilen nach Kompaktierung unerwartet: {counts}")
+        if con.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            raise AssertionError("auto_vacuum sollte nach der ersten Kompaktierung INCREMENTAL sein")
+
+        # innerhalb compact_interval_hours: kein erneuter Lauf
+        con.executemany("INSERT INTO measurements VALUES (?, ?, ?, ?, ?)", [(spk, ppk, t_old - 3600, 1.0, 0)])
+        con.commit()
+        main_mod.maybe_compact(settings, storage, now + timedelta(hours=1))
+        if con.execute("SELECT COUNT(*) FROM measurements").fetchone()[0] != 5:
+            raise AssertionError("maybe_compact darf vor Ablauf des Intervalls nicht löschen")
+        main_mod.maybe_compact(settings, storage, now + timedelta(hours=25))
+        if con.execute("SELECT COUNT(*) FROM measurements").fetchone()[0] != 4:
+            raise AssertionError("maybe_compact hat nach Ablauf des Intervalls nicht gelöscht")
+
+        # Tageswerte kürzer aufbewahrt als Rohwerte: Station ohne Tageswerte wird trotzdem bereinigt
+        short_daily = dataclasses.replace(settings, raw_retention_days=30, hourly_retention_days=30, daily_retention_days=10)
+        main_mod.compact_storage(short_daily, storage, now)
+        con.execute("INSERT INTO measurements VALUES (?, ?, ?, ?, ?)", (spk, ppk, t_mid, 1.0, 0))
+        con.execute("DELETE FROM measurements_daily")
+        con.commit()
+        deleted = main_mod.compact_storage(short_daily, storage, now)
+        if deleted.get("measurements") != 1:
+            raise AssertionError(f"Rohwerte ohne Tageswerte nicht bereinigt: {deleted}")
+    finally:
+        storage.close()
+
+    # erstmaliges Verdichten vorhandener Messwerte: v_last ist der Wert mit dem größten ts
+    seed_db = td_path / "pegel_rollup_seed.db"
+    con = sqlite3.connect(str(seed_db))
+    main_mod._create_measurement_tables(con)
+    t_day = int(datetime(2026, 2, 1, tzinfo=timezone.utc).timestamp())
+    con.executemany(
+        "INSERT INTO measurements VALUES (1, 1, ?, ?, 0)",
+        [(t_day + 3600 * h, v) for h, v in ((5, 10.0), (23, 42.0), (0, 99.0), (12, 1.0))],
+    )
+    con.commit()
+    con.close()
+    storage = main_mod.Storage(seed_db)
+    try:
+        daily = storage.con.execute("SELECT n, v_min, v_max, last_ts, v_last FROM measurements_daily").fetchall()
+    finally:
+        storage.close()
+    if daily != [(4, 1.0, 99.0, t_day + 23 * 3600, 42.0)]:
+        raise AssertionError(f"Tages-Rollup beim ersten Anlegen unerwartet: {daily}")
+
+
+def run_main(main_mod, argv: List[str]) -> int:
+    """Ruft main() des Hauptscripts mit den angegebenen Argumenten auf."""
+    old_argv = sys.argv
+    sys.argv = [str(getattr(main_mod, "__file__", "pegelabfrage.py"))] + argv
+    try:
+        return main_mod.main()
+    finally:
+        sys.argv = old_argv
+
+
+def scenario_history_export(main_mod, td_path: Path) -> None:
+    """history/export: Bereichsabfrage, berechnete Warnstufe, CSV/JSONL (+ Parquet, wenn pyarrow vorhanden)."""
+    cfg_path = td_path / "config-export.json"
+    db_path = td_path / "pegel_export.db"
+    write_temp_config(cfg_path, db_path)
+    settings = main_mod.load_settings(cfg_path)
+
+    t0 = int(datetime(2026, 2, 1, tzinfo=timezone.utc).timestamp())
+    storage = main_mod.Storage(db_path)
+    try:
+        spk = storage.station_pk("24810552", "41801", "Ulfa - Ulfa", "layers:10:index")
+        other = storage.station_pk("99999999", "", "Altstation", "layers:10:index")
+        ppk = storage.param_pk("W", "cm")
+        storage.con.executemany(
+            "INSERT INTO measurements VALUES (?, ?, ?, ?, ?)",
+            [(spk, ppk, t0 + k * 900, 55.0 + k, None) for k in range(8)] + [(other, ppk, t0, 1.0, None)],
+        )
+        storage.con.commit()
+
+        series = main_mod.history_series(settings, storage, "Ulfa - Ulfa")
+        rows = list(main_mod.iter_history(storage.con, series, t0 + 900, t0 + 4 * 900, "raw", with_level=True))
+        if [(r[4] - t0, r[5], r[6]) for r in rows] != [(900, 56.0, 0), (1800, 57.0, 0), (2700, 58.0, 0)]:
+            raise AssertionError(f"iter_history raw unerwartet: {rows}")
+        hourly = list(main_mod.iter_history(storage.con, series, t0, t0 + 86400, "hourly", with_level=True))
+        if [r[5:] for r in hourly] != [(4, 55.0, 58.0, 56.5, 58.0, 0), (4, 59.0, 62.0, 60.5, 62.0, 1)]:
+            raise AssertionError(f"iter_history hourly unerwartet: {hourly}")
+        if len(main_mod.history_series(settings, storage, "all")) != 2:
+            raise AssertionError("history_series('all') muss auch Stationen außerhalb der Config liefern")
+    finally:
+        storage.close()
+
+    out_csv = td_path / "export.csv"
+    out_jsonl = td_path / "export.jsonl"
+    with contextlib.redirect_stderr(io.StringIO()):
+        run_main(main_mod, ["--config", str(cfg_path), "export", "--station", "24810552", "--level", "--out", str(out_csv)])
+        run_main(main_mod, ["--config", str(cfg_path), "export", "--format", "jsonl", "--out", str(out_jsonl)])
+    lines = out_csv.read_text(encoding="utf-8").splitlines()
+    if lines[0] != "station_no,station_name,parameter,unit,ts,value,level" or len(lines) != 9:
+        raise AssertionError(f"CSV-Export unerwartet: {lines[:2]} ({len(lines)} Zeilen)")
+    if not lines[1].startswith("24810552,Ulfa - Ulfa,W,cm,2026-02-01T01:00:00+01:00,55.0,0"):
+        raise AssertionError(f"CSV-Zeile unerwartet: {lines[1]}")
+
+    # Tages-Rollups sind UTC-Tage und werden als UTC-Datum ausgegeben, nicht als "01:00" Ortszeit
+    out_daily = td_path / "export-daily.csv"
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf), contextlib.redirect_stderr(io.StringIO()):
+        run_main(main_mod, ["--config", str(cfg_path), "export", "--station", "24810552", "--resolution", "daily",
+                            "--out", str(out_daily)])
+        run_main(main_mod, ["--config", str(cfg_path), "history", "--station", "24810552", "--resolution", "daily",
+                            "--from", "2026-02-01T00:00:00+00:00", "--to", "2026-02-02T00:00:00+00:00"])
+    daily = out_daily.read_text(encoding="utf-8").splitlines()
+    if len(daily) != 2 or ",2026-02-01,8," not in daily[1]:
+        raise AssertionError(f"Tages-Export unerwartet: {daily}")
+    if "| 01.02.2026 (UTC) |" not in buf.getvalue():
+        raise AssertionError(f"history daily ohne UTC-Datum: {buf.getvalue()!r}")
+    recs = [json.loads(ln) for ln in out_jsonl.read_text(encoding="utf-8").splitlines()]
+    if len(recs) != 9 or {r["station_no"] for r in recs} != {"24810552", "99999999"}:
+        raise AssertionError(f"JSONL-Export unerwartet: {len(recs)} Zeilen")
+
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        return
+    out_pq = td_path / "export.parquet"
+    with contextlib.redirect_stderr(io.StringIO()):
+        run_main(main_mod, ["--config", str(cfg_path), "export", "--format", "parquet", "--resolution", "hourly",
+                            "--level", "--out", str(out_pq)])
+    table = pq.read_table(out_pq)
+    if table.num_rows != 3 or table.column("level").to_pylist() != [None, 0, 1]:
+        raise AssertionError(f"Parquet-Export unerwartet: {table.to_pylist()}")
+
+
+def scenario_classify(main_mod, td_path: Path) -> None:
+    """Batch-Klassifikation == _compute_level (mit und ohne NumPy); reclassify schreibt nur Änderungen."""
+    rnd = random.Random(42)
+    station_thresholds = [(60.0, 70.0, 80.0, 90.0), (150.0, 180.0, 200.0), (5.0,)]
+    values = [rnd.uniform(0, 250) for _ in range(3000)] + [60.0, 70.0, 89.999, 90.0, float("nan")]
+    idx = [rnd.randrange(len(station_thresholds)) for _ in values]
+    expected = [main_mod._compute_level(v, station_thresholds[i]) for v, i in zip(values, idx)]
+    matrix = main_mod.threshold_matrix(station_thresholds)
+
+    real_np = main_mod.np
+    for np_mod in ([real_np, None] if real_np is not None else [None]):
+        main_mod.np = np_mod
+        try:
+            if main_mod.classify_levels_matrix(values, idx, matrix) != expected:
+                raise AssertionError(f"classify_levels_matrix weicht ab (numpy={np_mod is not None})")
+            single = main_mod.classify_levels(values, station_thresholds[0])
+            if single != [main_mod._compute_level(v, station_thresholds[0]) for v in values]:
+                raise AssertionError(f"classify_levels weicht ab (numpy={np_mod is not None})")
+        finally:
+            main_mod.np = real_np
+
+    cfg_path = td_path / "config-reclassify.json"
+    db_path = td_path / "pegel_reclassify.db"
+    write_temp_config(cfg_path, db_path)
+    settings = main_mod.load_settings(cfg_path)
+    storage = main_mod.Storage(db_path)
+    try:
+        spk = storage.station_pk("24810552", "41801", "Ulfa - Ulfa", "layers:10:index")
+        ppk = storage.param_pk("W", "cm")
+        # gespeichert mit alten Schwellen 100/110/120 -> alles Stufe 0
+        storage.con.executemany(
+            "INSERT INTO measurements VALUES (?, ?, ?, ?, 0)", [(spk, ppk, k * 900, 50.0 + k) for k in range(50)]
+        )
+        storage.con.commit()
+        dry = main_mod.reclassify(settings, storage, chunk_size=7, dry_run=True)
+        first = main_mod.reclassify(settings, storage, chunk_size=7)
+        second = main_mod.reclassify(settings, storage, chunk_size=7)
+        levels = [r[0] for r in storage.con.execute("SELECT level FROM measurements ORDER BY ts")]
+    finally:
+        storage.close()
+    # Ulfa 60/70/80/90: Werte 50..99 -> 10x0, 10x1, 10x2, 10x3, 10x4
+    if levels != [k // 10 for k in range(50)]:
+        raise AssertionError(f"reclassify: Stufen unerwartet: {levels}")
+    if dry != {"Ulfa - Ulfa": 40} or first != dry or second != {"Ulfa - Ulfa": 0}:
+        raise AssertionError(f"reclassify: Änderungen unerwartet: {dry} / {first} / {second}")
+
+
+def _lsq_slope(points: List[Tuple[float, float]]) -> float:
+    """Referenz: Steigung der Ausgleichsgeraden (Einheit/Stunde), direkt berechnet."""
+    xs = [t / 3600.0 for t, _ in points]
+    ys = [v for _, v in points]
+    mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sum((x - mx) ** 2 for x in xs)
+
+
+def scenario_trend(main_mod, td_path: Path, index_url: str) -> None:
+    """Trendfenster (O(1)-Summen, Ringpuffer) == direkte Regression; Alarm 'schneller Anstieg' mit Re-Arm."""
+    rnd = random.Random(7)
+    window = main_mod.TrendWindow(12)
+    points: List[Tuple[float, float]] = []
+    t = 1_772_000_000
+    for _ in range(500):
+        t += rnd.choice((600, 900, 900, 1800))
+        v = rnd.uniform(50, 400)
+        if not window.push(t, v):
+            raise AssertionError("TrendWindow: neuer Wert abgelehnt")
+        points = (points + [(t, v)])[-12:]
+        if len(points) >= 2 and abs(window.slope() - _lsq_slope(points)) > 1e-6:
+            raise AssertionError(f"TrendWindow: Steigung {window.slope()} != {_lsq_slope(points)}")
+    if window.push(t, 1.0) or window.count != 12:
+        raise AssertionError("TrendWindow: doppelter Zeitstempel darf nicht übernommen werden")
+    rise = (points[-1][1] - points[-2][1]) * 3600.0 / (points[-1][0] - points[-2][0])
+    if abs(window.rise_rate() - rise) > 1e-9:
+        raise AssertionError("TrendWindow: rise_rate weicht ab")
+
+    cfg_path = td_path / "config-trend.json"
+    db_path = td_path / "pegel_trend.db"
+    write_temp_config(cfg_path, db_path)
+    enable_fake_email(cfg_path)
+    cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+    cfg["trend"] = {"rise_cm_per_hour": 10, "window_size": 6, "min_samples": 3}
+    cfg["stations"][0]["rise_cm_per_hour"] = 0  # Unter-Schmitten: Trendalarm aus
+    cfg_path.write_text(json.dumps(cfg, indent=2), encoding="utf-8")
+    settings = main_mod.load_settings(cfg_path)
+    if settings.stations[0].rise_cm_per_hour != 0 or settings.stations[1].rise_cm_per_hour != 10:
+        raise AssertionError("trend.rise_cm_per_hour / Stations-Override falsch gelesen")
+
+    sent: List[str] = []
+    real_send = main_mod.send_email
+    main_mod.send_email = lambda _settings, subject, _body, *_args: sent.append(subject)
+    start = datetime(2026, 2, 25, tzinfo=timezone.utc)
+    # Ulfa (Schwellen 60/70/80/90, hier immer darunter): flach, +20 cm/h, 7 h flach, erneut +20 cm/h
+    values = [20.0] * 3 + [25.0, 30.0, 35.0] + [35.0] * 29 + [40.0, 45.0, 50.0]
+    out = io.StringIO()
+    try:
+        # jeder Lauf ohne Kontext = Neustart: Fenster wird aus measurements neu aufgebaut
+        for k, value in enumerate(values):
+            ts = (start + timedelta(minutes=15 * k)).isoformat()
+            patch_requests(main_mod, ulfa_payload(ts, value), index_url)
+            with contextlib.redirect_stdout(out):
+                main_mod.check_once(settings)
+    finally:
+        main_mod.send_email = real_send
+
+    rapid = [subj for subj in sent if subj.startswith("Schneller Anstieg Ulfa")]
+    if len(rapid) != 2 or len(sent) != 2:
+        raise AssertionError(f"Erwartet 2 Anstiegsalarme für Ulfa, erhalten: {sent}")
+    if "Trend: +" not in out.getvalue():
+        raise AssertionError("Trend fehlt in der Konsolenausgabe")
+
+    with sqlite3.connect(db_path) as con:
+        armed = con.execute(
+            "SELECT armed FROM alert_state WHERE station_no = '24810552' AND parameter = 'W' AND threshold_idx = ?",
+            (main_mod.TREND_ALERT_IDX,),
+        ).fetchone()
+    if armed != (0,):
+        raise AssertionError(f"alert_state Trend-Zeile unerwartet: {armed}")
+
+
+def scenario_forecast(main_mod, td_path: Path, index_url: str) -> None:
+    """Zeit bis zur Schwelle (linear/exponentiell) aus dem Trendfenster; Prognose in Mail und Konsole."""
+    lin = main_mod.TrendWindow(8)
+    expo = main_mod.TrendWindow(8)
+    for k in range(10):
+        lin.push(k * 900, 100.0 + 2.5 * k)  # +10 cm/h
+        expo.push(k * 900, 50.0 * math.exp(0.1 * k / 4))  # +10 %/h (stetig)
+    if abs(lin.hours_to(150.0) - (150.0 - 122.5) / 10.0) > 1e-9 or lin.hours_to(100.0) != 0.0:
+        raise AssertionError(f"hours_to linear unerwartet: {lin.hours_to(150.0)}")
+    v_last = 50.0 * math.exp(0.1 * 9 / 4)
+    if abs(expo.hours_to(100.0, "exponential") - math.log(100.0 / v_last) / 0.1) > 1e-6:
+        raise AssertionError(f"hours_to exponentiell unerwartet: {expo.hours_to(100.0, 'exponential')}")
+    flat = main_mod.TrendWindow(4)
+    for k in range(4):
+        flat.push(k * 900, 80.0)
+    if flat.hours_to(90.0) is not None:
+        raise AssertionError("hours_to: ohne Anstieg keine Prognose erwartet")
+
+    cfg_path = td_path / "config-forecast.json"
+    db_path = td_path / "pegel_forecast.db"
+    write_temp_config(cfg_path, db_path)
+    enable_fake_email(cfg_path)
+    cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+    cfg["trend"] = {"min_samples": 3}
+    cfg["forecast"] = {"method": "linear", "max_hours": 1.2}
+    cfg_path.write_text(json.dumps(cfg, indent=2), encoding="utf-8")
+    settings = main_mod.load_settings(cfg_path)
+
+    bodies: List[str] = []
+    real_send = main_mod.send_email
+    main_mod.send_email = lambda _settings, _subject, body, *_args: bodies.append(body)
+    start = datetime(2026, 2, 25, tzinfo=timezone.utc)
+    out = io.StringIO()
+    ctx = main_mod.PollContext(settings)
+    try:
+        # Ulfa (60/70/80/90): +20 cm/h, bei 60 cm Meldestufe 1
+        for k, value in enumerate((50.0, 55.0, 60.0)):
+            patch_requests(main_mod, ulfa_payload((start + timedelta(minutes=15 * k)).isoformat(), value), index_url)
+            with contextlib.redirect_stdout(out):
+                main_mod.check_once(settings, ctx)
+    finally:
+        ctx.close()
+        main_mod.send_email = real_send
+
+    if len(bodies) != 1:
+        raise AssertionError(f"Erwartet genau eine Mail (Meldestufe 1), erhalten: {len(bodies)}")
+    body = bodies[0]
+    # Stufe 2 (70) in 30 min, Stufe 3 (80) in 1 h, Stufe 4 (90) nach 1.5 h > max_hours
+    if "Meldestufe 2 (Stufe1, 70.0cm): in ca. 30 min" not in body or "Meldestufe 3" not in body or "Meldestufe 4" in body:
+        raise AssertionError(f"Prognose im Mail-Text unerwartet:\n{body}")
+    if "Prognose: Stufe 2 in 30 min" not in out.getvalue():
+        raise AssertionError("Prognose fehlt in der Konsolenausgabe")
+
+
+def scenario_outbox(main_mod, td_path: Path, index_url: str) -> None:
+    """Alarme landen in der outbox; Fehlversand mit Backoff, übersteht Neustart; Versand-Thread blockiert Abfrage nicht."""
+    cfg_path = td_path / "config-outbox.json"
+    db_path = td_path / "pegel_outbox.db"
+    write_temp_config(cfg_path, db_path)
+    enable_fake_email(cfg_path)
+    settings = main_mod.load_settings(cfg_path)
+
+    def failing_send(_settings, _subject, _body, *_args):
+        raise OSError("SMTP nicht erreichbar")
+
+    real_send = main_mod.send_email
+    sent: List[str] = []
+    try:
+        # 1) Mailserver gestört: Alarm bleibt in der outbox, Zustand ist trotzdem disarmed
+        main_mod.send_email = failing_send
+        patch_requests(main_mod, ulfa_payload("2026-02-25T00:00:00+01:00", 65.0), index_url)
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            main_mod.check_once(settings)
+        with contextlib.closing(sqlite3.connect(db_path)) as con:
+            pending = con.execute("SELECT attempts, next_attempt_at - created_at, last_error FROM outbox").fetchall()
+            armed = con.execute(
+                "SELECT armed FROM alert_state WHERE station_no = '24810552' AND threshold_idx = 0"
+            ).fetchone()
+        if pending != [(1, 60, "SMTP nicht erreichbar")] or armed != (0,):
+            raise AssertionError(f"outbox nach Fehlversand unerwartet: {pending} / armed={armed}")
+
+        # 2) Neustart: neue Verbindung, Backoff abgelaufen -> Versand, Zeile gelöscht
+        main_mod.send_email = lambda _settings, subject, _body, *_args: sent.append(subject)
+        storage = main_mod.Storage(db_path)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                early = main_mod.drain_outbox(settings, storage.con, now=time.time())
+                late = main_mod.drain_outbox(settings, storage.con, now=time.time() + 61)
+            left = storage.con.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        finally:
+            storage.close()
+        if early[0] != 0 or late[:2] != (1, False) or left != 0 or len(sent) != 1:
+            raise AssertionError(f"outbox nach Neustart unerwartet: {early} / {late} / left={left} / {sent}")
+        if [main_mod._outbox_backoff(settings, n) for n in (1, 2, 3, 10)] != [60, 120, 240, 3600]:
+            raise AssertionError("Backoff nicht exponentiell/begrenzt")
+
+        # 3) Daemon: langsamer Mailserver hält den Zyklus nicht auf
+        slow_sent = threading.Event()
+
+        def slow_send(_settings, subject, _body, *_args):
+            time.sleep(0.5)
+            sent.append(subject)
+            slow_sent.set()
+
+        main_mod.send_email = slow_send
+        ctx = main_mod.PollContext(settings, background_dispatch=True)
+        try:
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                patch_requests(main_mod, ulfa_payload("2026-02-25T01:00:00+01:00", 75.0), index_url)
+                t0 = time.perf_counter()
+                main_mod.check_once(settings, ctx)
+                elapsed = time.perf_counter() - t0
+                if not slow_sent.wait(5):
+                    raise AssertionError("Versand-Thread hat die Mail nicht versendet")
+        finally:
+            ctx.close()
+        if elapsed >= 0.5:
+            raise AssertionError(f"check_once wartet auf SMTP ({elapsed:.2f}s)")
+        if not sent[-1].startswith("Stufe1 Ulfa"):
+            raise AssertionError(f"Unerwartete Mail: {sent}")
+    finally:
+        main_mod.send_email = real_send
+
+
+def scenario_smtp_pool(main_mod, td_path: Path, index_url: str) -> None:
+    """Eine SMTP-Verbindung pro Outbox-Durchlauf, Reconnect bei Abbruch; Digest = eine Mail pro Zyklus."""
+    cfg_path = td_path / "config-smtp.json"
+    db_path = td_path / "pegel_smtp.db"
+    write_temp_config(cfg_path, db_path)
+    with FakeSmtpServer(max_per_connection=2) as smtp:
+        use_fake_smtp(cfg_path, smtp.port)
+        settings = main_mod.load_settings(cfg_path)
+        storage = main_mod.Storage(db_path)
+        try:
+            now = int(time.time())
+            storage.con.executemany(
+                "INSERT INTO outbox(created_at, recipients, subject, body, next_attempt_at) VALUES (?, ?, ?, ?, ?)",
+                [(now, settings.mail_to, f"Meldung {k}", f"Text {k}", now) for k in range(5)],
+            )
+            storage.con.commit()
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = main_mod.drain_outbox(settings, storage.con)
+        finally:
+            storage.close()
+        # Server trennt nach je 2 Mails -> 3 Verbindungen für 5 Mails, keine verloren
+        if result != (5, False, None) or len(smtp.messages) != 5 or smtp.connections != 3:
+            raise AssertionError(f"SMTP-Pool: {result}, Mails={len(smtp.messages)}, Verbindungen={smtp.connections}")
+
+    # Abbruch nach angenommenem DATA: nicht sofort erneut senden (doppelte Mail), Outbox-Backoff übernimmt
+    with FakeSmtpServer(drop_before_reply=True) as smtp:
+        use_fake_smtp(cfg_path, smtp.port)
+        settings = main_mod.load_settings(cfg_path)
+        storage = main_mod.Storage(db_path)
+        try:
+            now = int(time.time())
+            storage.con.execute(
+                "INSERT INTO outbox(created_at, recipients, subject, body, next_attempt_at) VALUES (?, ?, ?, ?, ?)",
+                (now, settings.mail_to, "Meldung", "Text", now),
+            )
+            storage.con.commit()
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                sent, failed, _ = main_mod.drain_outbox(settings, storage.con)
+        finally:
+            storage.close()
+        if sent != 0 or not failed or len(smtp.messages) != 1:
+            raise AssertionError(f"Abbruch nach DATA: versendet={sent}, Fehler={failed}, Mails={len(smtp.messages)}")
+
+    # Digest: beide Stationen überschreiten im selben Zyklus Schwellen -> eine Mail
+    cfg_path = td_path / "config-digest.json"
+    db_path = td_path / "pegel_digest.db"
+    write_temp_config(cfg_path, db_path)
+    with FakeSmtpServer() as smtp:
+        use_fake_smtp(cfg_path, smtp.port, digest=True)
+        settings = main_mod.load_settings(cfg_path)
+        payload = ulfa_payload("2026-02-25T00:00:00+01:00", 85.0)  # Ulfa: 3 Schwellen
+        payload[0] = dict(payload[0], ts_value=190.0)  # Unter-Schmitten: 2 Schwellen
+        patch_requests(main_mod, payload, index_url)
+        with contextlib.redirect_stdout(io.StringIO()):
+            main_mod.check_once(settings)
+        if smtp.connections != 1 or len(smtp.messages) != 1:
+            raise AssertionError(f"Digest: Verbindungen={smtp.connections}, Mails={len(smtp.messages)}")
+        if "5 Pegel-Meldungen" not in smtp.messages[0] or smtp.messages[0].count("Pegel-Meldung (HLNUG-Messdaten)") != 5:
+            raise AssertionError(f"Digest-Inhalt unerwartet:\n{smtp.messages[0][:500]}")
+
+
+def scenario_scheduler(main_mod, td_path: Path) -> None:
+    """PollScheduler mit simulierter Uhr: ausgerichtete Takte, gelernter Rhythmus, schneller bei Stufe >= 1, Backoff."""
+    cfg_path = td_path / "config-scheduler.json"
+    write_temp_config(cfg_path, td_path / "pegel_scheduler.db")
+    cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+    cfg["runtime"].update(
+        {"mode": "daemon", "poll_interval_seconds": 900, "fast_poll_interval_seconds": 60,
+         "calm_poll_interval_seconds": 3600, "calm_after_hours": 3}
+    )
+    cfg_path.write_text(json.dumps(cfg, indent=2), encoding="utf-8")
+    if main_mod.load_settings(cfg_path).adaptive_schedule:
+        raise AssertionError("adaptive_schedule muss opt-in sein (fester Takt für bestehende Installationen)")
+    cfg["runtime"]["adaptive_schedule"] = True
+    cfg_path.write_text(json.dumps(cfg, indent=2), encoding="utf-8")
+    settings = main_mod.load_settings(cfg_path)
+    sched = main_mod.PollScheduler(settings)
+
+    # ohne Wissen: nächstes Vielfaches des Intervalls (Uhrzeit-ausgerichtet, unabhängig von der Zyklusdauer)
+    t0 = 1_772_000_000 - 1_772_000_000 % 900
+    if sched.next_poll(t0 + 17.3) != t0 + 900 or sched.next_poll(t0 + 899.9) != t0 + 900:
+        raise AssertionError("PollScheduler: Takt nicht an Intervallgrenzen ausgerichtet")
+
+    # Index: Werte alle 15 min (ts = k*900), veröffentlicht 200 s später
+    lag = 200
+
+    def visible(t: float) -> int:
+        return int((t - lag) // 900 * 900)
+
+    polls: List[Tuple[float, int, int]] = []
+    t = t0 + 5.0
+    while t < t0 + 14 * 3600:
+        level = 1 if t0 + 7 * 3600 <= t < t0 + 9 * 3600 else 0  # Hochwasser von 7 bis 9 Uhr
+        newest = visible(t)
+        polls.append((t, newest, level))
+        sched.observe(main_mod.CycleSummary(newest, level, False), t)
+        nt = sched.next_poll(t)
+        if nt <= t:
+            raise AssertionError("PollScheduler: nächster Termin liegt nicht in der Zukunft")
+        t = nt
+
+    def trace(sel):
+        return [(round(pt - t0), n - t0) for pt, n, _ in sel]
+
+    if sched.cadence != 900:
+        raise AssertionError(f"PollScheduler: Rhythmus nicht gelernt ({sched.cadence})")
+    # Stunde 2-3 (normal, Verzögerung eingegrenzt): genau ein Abruf je neuem Wert, kurz nach Veröffentlichung
+    normal = [p for p in polls if t0 + 2 * 3600 <= p[0] < t0 + 3 * 3600]
+    if len(normal) != 4 or any(not (0 <= pt - (n + lag) <= 60) for pt, n, _ in normal):
+        raise AssertionError(f"PollScheduler: normale Abrufe unerwartet: {trace(normal)}")
+    # ab 3 h ruhig: Backoff auf calm_poll_interval_seconds (Termine übersprungen)
+    calm = [p for p in polls if t0 + 3.5 * 3600 <= p[0] < t0 + 7 * 3600]
+    if len(calm) > 4 or any(b[0] - a[0] < 3600 - 900 for a, b in zip(calm, calm[1:])):
+        raise AssertionError(f"PollScheduler: kein Backoff in ruhigen Phasen: {trace(calm)}")
+    # Stufe >= 1 erkannt: jeder neue Wert, spätestens 60 s nach Veröffentlichung
+    flood = [p for p in polls if p[2] >= 1]
+    flood = [p for p in polls if flood[0][0] < p[0] < t0 + 9 * 3600]
+    if len(flood) < 6 or any(not (0 <= pt - (n + lag) <= 60) for pt, n, _ in flood):
+        raise AssertionError(f"PollScheduler: Abrufe bei Stufe >= 1 unerwartet: {trace(flood)}")
+    if any(b[1] - a[1] != 900 for a, b in zip(flood, flood[1:])):
+        raise AssertionError(f"PollScheduler: Werte bei Stufe >= 1 ausgelassen: {trace(flood)}")
+
+    # erwarteter Wert bleibt aus: bei Stufe >= 1 dauerhaft alle 60 s nachfragen, sonst verdoppelnd
+    last_t = polls[-1][0]
+    for summary, limits in ((main_mod.CycleSummary(polls[-1][1], 1, False), (60, 60, 60, 60)),
+                            (main_mod.CycleSummary(polls[-1][1], 0, False), (60, 120, 240, 480))):
+        sched_k = copy.deepcopy(sched)
+        retries = []
+        base = last_t + 4000 - (last_t + 4000) % 960 + 1  # Vielfaches aller Nachfrage-Abstände + 1 s
+        for k in range(len(limits)):
+            now = base + 960 * k
+            sched_k.observe(summary, now)
+            retries.append(sched_k.next_poll(now) - now + 1)
+        if retries != list(limits):
+            raise AssertionError(f"PollScheduler: überfälliger Wert (Stufe {summary.max_level}), Nachfragen {retries}")
+
+
+def scenario_last_seen(main_mod, td_path: Path, index_url: str) -> None:
+    """Daemon-Kontext: unveränderte Messwerte werden übersprungen (keine Schreibzugriffe), Re-Arm bleibt korrekt."""
+    cfg_path = td_path / "config-seen.json"
+    db_path = td_path / "pegel_seen.db"
+    write_temp_config(cfg_path, db_path)
+    enable_fake_email(cfg_path)
+    settings = main_mod.load_settings(cfg_path)
+
+    sent: List[str] = []
+    real_send = main_mod.send_email
+    main_mod.send_email = lambda _settings, subject, _body, *_args: sent.append(subject)
+    ctx = main_mod.PollContext(settings)
+    writes: List[str] = []
+    try:
+        steps = [
+            ("2026-02-25T00:00:00+01:00", 65.0),  # Alarm
+            ("2026-02-25T00:00:00+01:00", 65.0),  # unverändert
+            ("2026-02-25T01:00:00+01:00", 50.0),  # unterhalb seit 01:00
+            ("2026-02-25T01:00:00+01:00", 50.0),  # unverändert
+            ("2026-02-25T08:00:00+01:00", 50.0),  # 7 h unterhalb -> re-armed
+            ("2026-02-25T08:00:00+01:00", 50.0),  # unverändert
+            ("2026-02-25T09:00:00+01:00", 65.0),  # erneuter Alarm
+        ]
+        per_cycle: List[List[str]] = []
+        for ts, value in steps:
+            patch_requests(main_mod, ulfa_payload(ts, value), index_url)
+            writes.clear()
+            ctx.storage.con.set_trace_callback(
+                lambda sql: writes.append(sql) if sql.lstrip().split(" ", 1)[0].upper() in ("INSERT", "UPDATE", "DELETE") else None
+            )
+            with contextlib.redirect_stdout(io.StringIO()):
+                main_mod.check_once(settings, ctx)
+            ctx.storage.con.set_trace_callback(None)
+            per_cycle.append(list(writes))
+    finally:
+        ctx.close()
+        main_mod.send_email = real_send
+
+    ulfa = [subj for subj in sent if "Ulfa" in subj]
+    if len(ulfa) != 2:
+        raise AssertionError(f"Erwartet 2 Alarme für Ulfa trotz übersprungener Zyklen, erhalten: {ulfa}")
+    for k in (1, 3, 5):
+        if per_cycle[k]:
+            raise AssertionError(f"Zyklus {k} ohne neue Messwerte schreibt trotzdem: {per_cycle[k][:3]}")
+    if not any("measurements" in sql for sql in per_cycle[2]):
+        raise AssertionError("Neuer Messwert wurde nicht gespeichert")
+
+
+def scenario_metrics(main_mod, td_path: Path, index_url: str) -> None:
+    """Metriken: Phasen-Histogramme, Zähler und Datenalter über /metrics und als JSON-Zeile pro Zyklus."""
+    cfg_path = td_path / "config-metrics.json"
+    db_path = td_path / "pegel_metrics.db"
+    json_path = td_path / "metrics.jsonl"
+    write_temp_config(cfg_path, db_path)
+    enable_fake_email(cfg_path)
+    cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+    cfg["metrics"] = {"listen": "127.0.0.1:0", "json_path": str(json_path)}
+    # Abfluss derselben Station: gleicher Name wie der Wasserstand, eigene Gauges
+    cfg["stations"].append(dict(cfg["stations"][1], parameter="Q", thresholds_cm=[10, 20, 30, 40]))
+    cfg_path.write_text(json.dumps(cfg, indent=2), encoding="utf-8")
+    settings = main_mod.load_settings(cfg_path)
+
+    real_send = main_mod.send_email
+    main_mod.send_email = lambda *_args: None
+    ctx = main_mod.PollContext(settings)
+    server = main_mod.MetricsServer(ctx.metrics, settings.metrics_listen)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            payload = ulfa_payload("2026-02-25T00:00:00+01:00", 65.0)
+            payload.append(dict(payload[1], stationparameter_name="Q", ts_unitsymbol="m³/s", ts_value=2.0))
+            patch_requests(main_mod, payload, index_url, etag='"m1"')
+            main_mod.check_once(settings, ctx)
+            main_mod.check_once(settings, ctx)  # 304
+            main_mod.requests._harness_answer = lambda url, headers: FakeResponse(503, None)
+            with contextlib.redirect_stderr(io.StringIO()):
+                try:
+                    main_mod.check_once(settings, ctx)
+                except Exception:
+                    pass
+                else:
+                    raise AssertionError("HTTP 503 beim Index-Abruf wurde nicht als Fehler gemeldet")
+        host, port = server.address[:2]
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics", timeout=5) as resp:
+            ctype = resp.headers.get("Content-Type", "")
+            text = resp.read().decode("utf-8")
+    finally:
+        server.close()
+        ctx.close()
+        main_mod.send_email = real_send
+
+    if not ctype.startswith("text/plain"):
+        raise AssertionError(f"Unerwarteter Content-Type des Metrik-Endpunkts: {ctype}")
+    samples: Dict[str, float] = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    expected = {
+        'pegel_cycles_total{status="ok"}': 1,
+        'pegel_cycles_total{status="not_modified"}': 1,
+        'pegel_cycles_total{status="error"}': 1,
+        'pegel_fetch_failures_total{provider="hlnug"}': 1,
+        'pegel_alerts_total{kind="threshold"}': 1,
+        "pegel_mails_sent_total": 1,
+        'pegel_phase_seconds_count{phase="fetch"}': 3,
+        'pegel_phase_seconds_count{phase="evaluate"}': 1,
+        'pegel_phase_seconds_count{phase="commit"}': 1,
+        'pegel_phase_seconds_count{phase="send"}': 1,
+        'pegel_station_level{parameter="W",station="Ulfa - Ulfa",station_no="24810552"}': 1,
+        'pegel_station_level{parameter="Q",station="Ulfa - Ulfa",station_no="24810552"}': 0,
+    }
+    for key, value in expected.items():
+        if samples.get(key) != value:
+            raise AssertionError(f"Metrik {key}: erwartet {value}, erhalten {samples.get(key)}")
+    if samples.get('pegel_phase_seconds_bucket{phase="fetch",le="+Inf"}') != 3:
+        raise AssertionError("Histogramm-Bucket +Inf fehlt oder ist falsch")
+    age = samples.get('pegel_data_age_seconds{parameter="W",station="Ulfa - Ulfa",station_no="24810552"}')
+    if age is None or age < 0:
+        raise AssertionError(f"Datenalter für Ulfa fehlt/negativ: {age}")
+
+    lines = [json.loads(line) for line in json_path.read_text(encoding="utf-8").splitlines()]
+    if [line["status"] for line in lines] != ["ok", "not_modified", "error"]:
+        raise AssertionError(f"JSON-Zeilen pro Zyklus unerwartet: {lines}")
+    first = lines[0]
+    if first["new_samples"] != 3 or first["alerts"] != 1 or not {"fetch", "index", "evaluate", "commit", "send"} <= set(first["phases"]):
+        raise AssertionError(f"JSON-Zeile des ersten Zyklus unvollständig: {first}")
+
+
+def scenario_profile(main_mod, td_path: Path) -> None:
+    """--profile mit --replay-index: kein Netz, echte DB unberührt, pstats-Dump + Phasen-Zeiten je Zyklus."""
+    cfg_path = td_path / "config-profile.json"
+    db_path = td_path / "pegel_profile.db"
+    write_temp_config(cfg_path, db_path)
+    replay = []
+    for i, (ts, value) in enumerate((("2026-02-25T00:00:00+01:00", 65.0), ("2026-02-25T00:15:00+01:00", 72.0))):
+        path = td_path / f"index-{i}.json"
+        path.write_text(json.dumps(ulfa_payload(ts, value)), encoding="utf-8")
+        replay += ["--replay-index", str(path)]
+    out_path = td_path / "profile.pstats"
+
+    # jeder HTTP-Abruf wäre hier ein Fehler
+    main_mod.requests._harness_answer = lambda url, headers: FakeResponse(500, None)
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        rc = run_main(main_mod, ["--config", str(cfg_path), "--profile", "2", "--profile-out", str(out_path)] + replay)
+    out = buf.getvalue()
+
+    if rc != 0:
+        raise AssertionError(f"--profile rc={rc}: {out[-500:]}")
+    if db_path.exists():
+        raise AssertionError("--profile hat die echte DB angelegt/verändert")
+    rows = [line.split() for line in out.splitlines() if line.strip()[:1] in ("1", "2") and "ms" in line]
+    # HTTP (hier: Datei lesen), JSON-Decode, Index, Auswertung, DB gemessen; Mail ohne --profile-mail aus
+    if len(rows) != 2 or any(len(r) != 8 or not all(c.endswith("ms") for c in r[1:7]) or r[7] != "-" for r in rows):
+        raise AssertionError(f"Phasen-Tabelle unvollständig:\n{out[:1500]}")
+    if "index-0.json, index-1.json" not in out or "check_once" not in out:
+        raise AssertionError(f"Profil-Ausgabe unerwartet:\n{out[:1500]}")
+    import pstats
+
+    stats = pstats.Stats(str(out_path))
+    if not any(func[2] == "check_once" for func in stats.stats):
+        raise AssertionError("pstats-Dump enthält check_once nicht")
+
+
+def scenario_replay(main_mod, td_path: Path, index_url: str) -> None:
+    """replay: gleiche Alarme wie check_once; schneller Pfad (Läufe/NumPy) == Wert-für-Wert-Referenz."""
+    cfg_path = td_path / "config-replay.json"
+    db_path = td_path / "pegel_replay.db"
+    write_temp_config(cfg_path, db_path)
+    enable_fake_email(cfg_path)
+    settings = main_mod.load_settings(cfg_path)
+
+    sent: List[str] = []
+    real_send = main_mod.send_email
+    main_mod.send_email = lambda _settings, subject, _body, *_args: sent.append(subject)
+    ctx = main_mod.PollContext(settings)
+    try:
+        steps = [
+            ("2026-02-25T00:00:00+01:00", 65.0),
+            ("2026-02-25T01:00:00+01:00", 50.0),
+            ("2026-02-25T02:00:00+01:00", 85.0),  # zu früh für Stufe1, aber Stufe2/3 erstmals
+            ("2026-02-25T03:00:00+01:00", 50.0),
+            ("2026-02-25T10:00:00+01:00", 50.0),  # re-armed
+            ("2026-02-25T11:00:00+01:00", 72.0),
+        ]
+        for ts, value in steps:
+            patch_requests(main_mod, ulfa_payload(ts, value), index_url)
+            with contextlib.redirect_stdout(io.StringIO()):
+                main_mod.check_once(settings, ctx)
+        fired_at = {r[0] for r in ctx.storage.con.execute(
+            "SELECT last_alert_at FROM alert_state WHERE last_alert_at IS NOT NULL"
+        )}
+    finally:
+        ctx.close()
+        main_mod.send_email = real_send
+    # last_alert_at wie bei replay: Messzeitpunkt, nicht Uhrzeit des Zyklus
+    sample_ts = {int(datetime.fromisoformat(ts).timestamp()) for ts, _ in steps}
+    if not fired_at or not fired_at <= sample_ts:
+        raise AssertionError(f"last_alert_at ist nicht der Messzeitpunkt: {fired_at}")
+
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf), contextlib.redirect_stderr(io.StringIO()):
+        rc = run_main(main_mod, ["--config", str(cfg_path), "replay", "--cold-start", "--format", "jsonl"])
+    events = [json.loads(line) for line in buf.getvalue().splitlines()]
+    replayed = [f"{e['alert']} {e['station']}" for e in events]
+    live = [subj.split(":", 1)[0] for subj in sent]
+    if rc != 0 or sorted(replayed) != sorted(live):
+        raise AssertionError(f"replay weicht von check_once ab:\n  replay: {replayed}\n  live:   {live}")
+
+    # Textausgabe mit der gespeicherten Einheit (parameters.unit), nicht fest "cm"
+    con = sqlite3.connect(str(db_path))
+    con.execute("UPDATE parameters SET unit = 'm³/s' WHERE name = 'W'")
+    con.commit()
+    con.close()
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf), contextlib.redirect_stderr(io.StringIO()):
+        run_main(main_mod, ["--config", str(cfg_path), "replay", "--cold-start"])
+    lines = buf.getvalue().splitlines()
+    if not lines or any(" cm" in line or not line.endswith(" m³/s") for line in lines):
+        raise AssertionError(f"replay: Einheit nicht aus parameters.unit: {lines}")
+
+    # schneller Pfad gegen Referenz auf Zufallsreihen (mit Lücken, Plateaus und schnellem Anstieg)
+    if main_mod.np is None:
+        return
+    rnd = random.Random(7)
+    station = main_mod.StationConfig("Zufall", "1", "1", "W", (100.0, 130.0, 160.0), ("A", "B", "C"), 12.0)
+    for rearm, on_start, cold in ((6, True, False), (0, False, True), (2, True, True), (24, False, False)):
+        st = dataclasses.replace(settings, rearm_below_hours=rearm, alert_on_start=on_start, trend_min_samples=3)
+        ts, values, t, v = [], [], 1_700_000_000, 90.0
+        for _ in range(5000):
+            t += 900 * rnd.choice((1, 1, 1, 2, 8))
+            v = max(0.0, v + rnd.gauss(0, 6) + (25 if rnd.random() < 0.01 else 0))
+            ts.append(t)
+            values.append(round(v, 1))
+        fast = [(e.ts, e.th_idx) for e in main_mod.replay_series(st, station, ts, values, cold)]
+        ref = [(e.ts, e.th_idx) for e in main_mod._replay_loop(st, station, ts, values, cold)]
+        if fast != ref:
+            diff = next(i for i, (a, b) in enumerate(zip(fast + [None], ref + [None])) if a != b)
+            raise AssertionError(
+                f"replay_series != Referenz (rearm={rearm}, cold={cold}): {len(fast)} vs {len(ref)} Alarme, "
+                f"erste Abweichung bei #{diff}: {fast[diff:diff + 2]} / {ref[diff:diff + 2]}"
+            )
+        if not any(th == main_mod.TREND_ALERT_IDX for _, th in ref):
+            raise AssertionError("Zufallsreihe ohne Anstiegs-Alarm – Test prüft den Trendpfad nicht")
+
+
+def scenario_tune(main_mod, td_path: Path) -> None:
+    """tune: Raster über Schwellen/Re-Arm, Prozess-Pool liefert dasselbe wie der Lauf im Prozess."""
+    cfg_path = td_path / "config-tune.json"
+    db_path = td_path / "pegel_tune.db"
+    write_temp_config(cfg_path, db_path)
+    settings = main_mod.load_settings(cfg_path)
+    ulfa = next(st for st in settings.stations if st.name.startswith("Ulfa"))
+
+    # 60 Tage 15-Minuten-Werte mit drei Hochwasserwellen (Ulfa: Schwellen 60/70/80/90)
+    start = int(datetime(2026, 1, 1, tzinfo=timezone.utc).timestamp())
+    rnd = random.Random(3)
+    ts, values = [], []
+    for k in range(60 * 96):
+        wave = sum(45.0 * math.exp(-(((k - c) / 40.0) ** 2)) for c in (1500, 3000, 4200))
+        ts.append(start + k * 900)
+        values.append(round(50.0 + wave + rnd.gauss(0, 1.5), 1))
+    storage = main_mod.Storage(db_path)
+    try:
+        spk = storage.station_pk(ulfa.station_no, ulfa.station_id_public, ulfa.name, "test")
+        ppk = storage.param_pk(ulfa.parameter, "cm")
+        storage.con.executemany(
+            "INSERT INTO measurements(station_pk, param_pk, ts, value, level) VALUES (?, ?, ?, ?, 0)",
+            [(spk, ppk, t, v) for t, v in zip(ts, values)],
+        )
+        storage.con.commit()
+    finally:
+        storage.close()
+
+    buf = io.StringIO()
+    argv = ["--config", str(cfg_path), "tune", "--station", "24810552", "--offset=-10:10:5", "--rearm", "1,6,24",
+            "--workers", "2", "--format", "jsonl", "--top", "100"]
+    with contextlib.redirect_stdout(buf), contextlib.redirect_stderr(io.StringIO()):
+        rc = run_main(main_mod, argv)
+    pooled = [json.loads(line) for line in buf.getvalue().splitlines()]
+    if rc != 0 or len(pooled) != 15:
+        raise AssertionError(f"tune: rc={rc}, {len(pooled)} Kombinationen statt 15")
+
+    sets = [tuple(th + off for th in ulfa.thresholds_cm) for off in (-10, -5, 0, 5, 10)]
+    local = main_mod.tune(settings, ulfa, ts, values, sets, [1, 6, 24], ulfa.thresholds_cm[-1], workers=1)
+    key = lambda r: (tuple(r["thresholds"]), r["rearm_h"])  # noqa: E731
+    if sorted(map(json.dumps, pooled)) != sorted(json.dumps(r) for r in local):
+        raise AssertionError("tune im Prozess-Pool weicht vom Lauf im Prozess ab")
+
+    cur = next(r for r in pooled if key(r) == (tuple(ulfa.thresholds_cm), 6.0))
+    if cur["events"] != 3 or cur["missed"] != 0 or cur["per_level"] != [3, 3, 3, 3] or cur["flapping"] != 0:
+        raise AssertionError(f"tune: Kennzahlen der aktuellen Config unerwartet: {cur}")
+    if not cur["lead_median_h"] or cur["lead_median_h"] <= 0:
+        raise AssertionError(f"tune: kein Vorlauf vor den Ereignissen: {cur}")
+    high = next(r for r in pooled if key(r) == (tuple(th + 10 for th in ulfa.thresholds_cm), 6.0))
+    if high["lead_median_h"] is None or high["lead_median_h"] >= cur["lead_median_h"]:
+        raise AssertionError(f"tune: höhere Schwellen sollten später alarmieren: {high} / {cur}")
+
+    # Vorlauf zählt bis zum Scheitel: ein Alarm nach Ereignisbeginn, aber vor dem Scheitel ist ein Treffer
+    ev = main_mod.FloodEvent(start=10 * 3600, peak=16 * 3600, end=20 * 3600, peak_value=95.0)
+    late = main_mod.score_alerts([main_mod.AlertEvent(ts=12 * 3600, station=ulfa, th_idx=3, value=92.0, level=4)], [ev], 48 * 3600, 3600)
+    if late["hit"] != 1 or late["lead_median_h"] != 4.0 or late["lead_min_h"] != 4.0:
+        raise AssertionError(f"tune: Vorlauf nicht bis zum Scheitel gemessen: {late}")
+
+
+def scenario_providers(main_mod, td_path: Path) -> None:
+    """
+    Zwei Quellen gegen lokale Fake-Server: HLNUG (schnell) und eine generische JSON-Quelle (langsam,
+    verschachteltes Layout). Beide werden gleichzeitig abgerufen; überschreitet die langsame ihr
+    Timeout, wird HLNUG trotzdem ausgewertet und gespeichert.
+    """
+    cfg_path = td_path / "config-providers.json"
+    db_path = td_path / "pegel_providers.db"
+    write_temp_config(cfg_path, db_path)
+    feed = {
+        "data": {
+            "items": [
+                {
+                    "number": "2730010",
+                    "longname": "GRENZPEGEL",
+                    "ts": [{"shortname": "W", "unit": "cm", "current": {"timestamp": "2026-02-25T13:45:00+01:00", "value": 212.0}}],
+                },
+                {"number": "2730020", "longname": "ANDERER", "ts": []},
+            ]
+        }
+    }
+    unpatch_requests(main_mod)
+    with FakeHttpServer({"/layers/10/index.json": make_index_payload()}) as fast, FakeHttpServer({"/api/stations": feed}) as slow:
+        cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+        cfg["providers"] = {
+            "hlnug": {"url": fast.base_url + "/layers/10/index.json"},
+            "wsv": {
+                "type": "json",
+                "url": slow.base_url + "/api/stations",
+                "timeout_seconds": 1,
+                "items": "data.items",
+                "fields": {
+                    "station_no": "number",
+                    "station_name": "longname",
+                    "parameter": "ts.0.shortname",
+                    "timestamp": "ts.0.current.timestamp",
+                    "value": "ts.0.current.value",
+                    "unit": "ts.0.unit",
+                },
+            },
+        }
+        cfg["stations"].append(
+            {"name": "Grenzpegel - Main", "station_no": "2730010", "source": "wsv", "thresholds_cm": [150, 180, 200, 220]}
+        )
+        cfg_path.write_text(json.dumps(cfg), encoding="utf-8")
+        settings = main_mod.load_settings(cfg_path)
+
+        # 1) beide Quellen rechtzeitig: alle drei Stationen ausgewertet, HLNUG zuerst
+        slow.delay = 0.3
+        ctx = main_mod.PollContext(settings)
+        try:
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(io.StringIO()):
+                rc = main_mod.check_once(settings, ctx)
+            lines = [line for line in out.getvalue().splitlines() if line.startswith("Station: ")]
+            names = [line.split("|")[0][len("Station: "):].strip() for line in lines]
+            if rc != 0 or names != ["Unter-Schmitten - Nidda", "Ulfa - Ulfa", "Grenzpegel - Main"]:
+                raise AssertionError(f"Mehrere Quellen: rc={rc}, Reihenfolge {names}")
+            if "212.0" not in lines[-1] or "Pegel-Stufe: 3" not in lines[-1]:
+                raise AssertionError(f"JSON-Quelle falsch abgebildet: {lines[-1]}")
+            rows = dict(ctx.storage.con.execute(
+                "SELECT s.station_no, s.source FROM measurements m JOIN stations s USING (station_pk)"
+            ).fetchall())
+            if rows != {"24810600": "layers:10:index", "24810552": "layers:10:index", "2730010": "wsv"}:
+                raise AssertionError(f"Gespeicherte Quellen unerwartet: {rows}")
+        finally:
+            ctx.close()
+
+        # 2) JSON-Quelle zu langsam: HLNUG wird nach Sekundenbruchteilen ausgewertet, Fehler nur für "wsv"
+        slow.delay = 2.5
+        settings = dataclasses.replace(settings, db_path=td_path / "pegel_providers_timeout.db")
+        ctx = main_mod.PollContext(settings)
+        try:
+            out, err = io.StringIO(), io.StringIO()
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+                rc = main_mod.check_once(settings, ctx)
+                elapsed = time.perf_counter() - t0
+                # der verspätete Abruf läuft noch: kein zweiter Abruf derselben Quelle
+                rc2 = main_mod.check_once(settings, ctx)
+            n_ulfa = ctx.storage.con.execute("SELECT COUNT(*) FROM measurements").fetchone()[0]
+            failures = ctx.metrics.render()
+        finally:
+            ctx.close()
+        if rc != 1 or rc2 != 1 or not (1.0 <= elapsed < 2.0):
+            raise AssertionError(f"Timeout der JSON-Quelle: rc={rc}/{rc2}, Dauer {elapsed:.2f}s")
+        if "Grenzpegel" in out.getvalue() or n_ulfa != 2 or "Ulfa - Ulfa" not in out.getvalue():
+            raise AssertionError("HLNUG-Stationen müssen trotz langsamer JSON-Quelle ausgewertet werden")
+        if "Quelle 'wsv'" not in err.getvalue() or "läuft noch" not in err.getvalue():
+            raise AssertionError(f"Fehlermeldung zur Quelle fehlt: {err.getvalue()!r}")
+        if 'pegel_fetch_failures_total{provider="wsv"} 2' not in failures:
+            raise AssertionError("Fehlgeschlagene Abrufe je Quelle nicht gezählt")
+        if slow.requests.count("/api/stations") != 2:
+            raise AssertionError(f"JSON-Quelle unerwartet oft abgerufen: {slow.requests}")
+
+        # 3) nur HLNUG, Server tröpfelt (jede Pause unter dem Socket-Timeout): Zeitlimit gilt für den ganzen Abruf
+        fast.trickle = 0.5
+        settings = dataclasses.replace(
+            settings,
+            db_path=td_path / "pegel_providers_trickle.db",
+            stations=settings.stations[:2],
+            providers={"hlnug": dataclasses.replace(settings.providers["hlnug"], timeout_seconds=1)},
+        )
+        ctx = main_mod.PollContext(settings)
+        try:
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                main_mod.check_once(settings, ctx)
+        except TimeoutError as e:
+            elapsed = time.perf_counter() - t0
+            if not (1.0 <= elapsed < 2.0) or "innerhalb von 1 s" not in str(e):
+                raise AssertionError(f"Zeitlimit bei einer Quelle: Dauer {elapsed:.2f}s, {e}")
+        else:
+            raise AssertionError("Tröpfelnder Server muss das Zeitlimit der Quelle auslösen")
+        finally:
+            ctx.close()
+            fast.trickle = 0.0
+
+    cfg["stations"][-1]["source"] = "unbekannt"
+    cfg_path.write_text(json.dumps(cfg), encoding="utf-8")
+    try:
+        main_mod.load_settings(cfg_path)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Station mit unbekannter source muss abgelehnt werden")
+
+    # gleiche station_no/parameter in zwei Quellen würde eine Messreihe und einen Alarmzustand teilen
+    cfg["stations"][-1].update({"source": "wsv", "station_no": "24810552"})
+    cfg_path.write_text(json.dumps(cfg), encoding="utf-8")
+    try:
+        main_mod.load_settings(cfg_path)
+    except ValueError as e:
+        if "24810552" not in str(e):
+            raise AssertionError(f"Fehlermeldung nennt die doppelte station_no nicht: {e}")
+    else:
+        raise AssertionError("Gleiche station_no/parameter in zwei Quellen muss abgelehnt werden")
+
+
+def scenario_tenants(main_mod, td_path: Path) -> None:
+    """
+    Mehrmandanten-Betrieb: drei Configs mit überlappenden Stationen, eigenen Schwellen, Empfängern und DBs.
+    Der Index wird pro Zyklus einmal abgerufen; ausgewertet werden nur Mandanten mit neuen Messwerten.
+    """
+    tenant_dir = td_path / "tenants"
+    tenant_dir.mkdir()
+    payload = make_index_payload()
+    unpatch_requests(main_mod)
+    with FakeHttpServer({"/layers/10/index.json": payload}) as server, FakeSmtpServer() as smtp:
+        paths = []
+        for name, stations, mail_to, thresholds in (
+            ("kunde-a", ("24810600", "24810552"), "a@example.org", None),
+            ("kunde-b", ("24810552",), "b@example.org", [60, 65, 70, 75]),
+            ("kunde-c", ("24810600",), "", None),
+        ):
+            cfg_path = tenant_dir / f"{name}.json"
+            write_temp_config(cfg_path, td_path / f"pegel_{name}.db")
+            if mail_to:
+                use_fake_smtp(cfg_path, smtp.port)
+            cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+            cfg["providers"] = {"hlnug": {"url": server.base_url + "/layers/10/index.json"}}
+            cfg["stations"] = [st for st in cfg["stations"] if st["station_no"] in stations]
+            if thresholds:
+                cfg["stations"][0]["thresholds_cm"] = thresholds
+            cfg["email"]["to"] = mail_to
+            cfg["backfill"] = {"on_start": False}
+            cfg_path.write_text(json.dumps(cfg), encoding="utf-8")
+            paths.append(cfg_path)
+
+        hub = main_mod.TenantHub(main_mod.load_tenants(paths))
+        try:
+            subs = hub.subscribers["hlnug"]
+            if sorted(t.name for t, _ in subs[("24810552", "W")]) != ["kunde-a", "kunde-b"] or len(hub.settings.stations) != 2:
+                raise AssertionError(f"Reverse-Index Station -> Mandanten unerwartet: {subs}")
+
+            def cycle() -> List[str]:
+                out = io.StringIO()
+                with contextlib.redirect_stdout(out), contextlib.redirect_stderr(io.StringIO()):
+                    rc = main_mod.check_tenants(hub)
+                if rc != 0:
+                    raise AssertionError(f"check_tenants rc={rc}: {out.getvalue()}")
+                return [line for line in out.getvalue().splitlines() if line.startswith("[")]
+
+            first = cycle()
+            second = cycle()
+            payload[1] = dict(payload[1], timestamp="2026-02-25T13:45:00+01:00", ts_value=96.0)
+            real_latest, lookups = main_mod.latest_for_station, []
+            main_mod.latest_for_station = lambda index, st: lookups.append(st.station_no) or real_latest(index, st)
+            try:
+                third = cycle()
+            finally:
+                main_mod.latest_for_station = real_latest
+            if sorted(lookups) != ["24810552", "24810600"]:
+                raise AssertionError(f"Einträge müssen einmal je Station aufgelöst werden, nicht je Mandant: {lookups}")
+            counts = {
+                t.name: t.ctx.storage.con.execute("SELECT COUNT(*) FROM measurements").fetchone()[0] for t in hub.tenants
+            }
+            levels = {
+                t.name: t.ctx.storage.con.execute("SELECT MAX(level) FROM measurements").fetchone()[0] for t in hub.tenants
+            }
+            # Hot-Reload eines Mandanten: Abonnements werden neu verteilt
+            # (Station schon von kunde-a abonniert, Empfänger geändert: gemeinsamer Abruf samt ETag bleibt)
+            tenant_a, tenant_c = hub.tenants[0], hub.tenants[2]
+            sources = hub.sources
+            with contextlib.redirect_stdout(io.StringIO()):
+                hub.reload(tenant_c, dataclasses.replace(tenant_c.settings, stations=tenant_a.settings.stations))
+                hub.reload(tenant_a, dataclasses.replace(tenant_a.settings, mail_to="neu@example.org"))
+            subs = hub.subscribers["hlnug"]
+            if sorted(t.name for t, _ in subs[("24810552", "W")]) != ["kunde-a", "kunde-b", "kunde-c"]:
+                raise AssertionError(f"Abonnements nach Reload unerwartet: {subs}")
+            if hub.sources is not sources:
+                raise AssertionError("Reload ohne geänderte Quellen/Stationen darf den Abruf nicht neu aufbauen")
+            # längeres Zeitlimit der gemeinsamen Quelle: Abruf wird neu aufgebaut
+            hlnug = dataclasses.replace(tenant_c.settings.providers["hlnug"], timeout_seconds=45)
+            with contextlib.redirect_stdout(io.StringIO()):
+                hub.reload(tenant_c, dataclasses.replace(tenant_c.settings, providers={"hlnug": hlnug}))
+            if hub.sources is sources or hub.settings.providers["hlnug"].timeout_seconds != 45:
+                raise AssertionError("Geänderte Quelle muss den gemeinsamen Abruf neu aufbauen")
+        finally:
+            hub.close()
+
+        if first != ["[kunde-a]", "[kunde-b]", "[kunde-c]"] or second != [] or third != ["[kunde-a]", "[kunde-b]"]:
+            raise AssertionError(f"Betroffene Mandanten je Zyklus unerwartet: {first} / {second} / {third}")
+        if len(server.requests) != 3:
+            raise AssertionError(f"Index muss einmal pro Zyklus geladen werden, nicht je Mandant: {server.requests}")
+        if counts != {"kunde-a": 3, "kunde-b": 2, "kunde-c": 1} or levels != {"kunde-a": 4, "kunde-b": 4, "kunde-c": 0}:
+            raise AssertionError(f"Mandanten-DBs unerwartet: {counts} / {levels}")
+        recipients = [re.search(r"^To: (.*)$", m, re.M).group(1).strip() for m in smtp.messages]
+        # Ulfa: 4 Schwellen je Mandant (a: 60..90, b: 60..75), kunde-c ohne Mail
+        if sorted(recipients) != ["a@example.org"] * 4 + ["b@example.org"] * 4:
+            raise AssertionError(f"Empfänger je Mandant unerwartet: {recipients}")
+
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            rc = run_main(main_mod, ["--tenants", str(tenant_dir)])
+        if rc != 0 or len(server.requests) != 4:
+            raise AssertionError(f"--tenants: rc={rc}, Abrufe={len(server.requests)}")
+
+    cfg = json.loads(paths[1].read_text(encoding="utf-8"))
+    cfg["storage"]["db_path"] = str(td_path / "pegel_kunde-a.db")
+    paths[1].write_text(json.dumps(cfg), encoding="utf-8")
+    try:
+        main_mod.load_tenants(paths)
+    except SystemExit:
+        pass
+    else:
+        raise AssertionError("Zwei Mandanten mit derselben DB müssen abgelehnt werden")
+
+    # gleichnamige Configs in verschiedenen Verzeichnissen (eine config-pegel.json je Kunde)
+    with FakeHttpServer({"/layers/10/index.json": make_index_payload()}) as server:
+        paths = []
+        for customer, station_no in (("acme", "24810552"), ("globex", "24810600")):
+            (tenant_dir / customer).mkdir()
+            cfg_path = tenant_dir / customer / "config-pegel.json"
+            write_temp_config(cfg_path, tenant_dir / customer / "pegel.db")
+            cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+            cfg["providers"] = {"hlnug": {"url": server.base_url + "/layers/10/index.json"}}
+            cfg["stations"] = [st for st in cfg["stations"] if st["station_no"] == station_no]
+            cfg_path.write_text(json.dumps(cfg), encoding="utf-8")
+            paths.append(cfg_path)
+        hub = main_mod.TenantHub(main_mod.load_tenants(paths))
+        try:
+            with contextlib.redirect_stdout(io.StringIO()) as out, contextlib.redirect_stderr(io.StringIO()):
+                main_mod.check_tenants(hub)
+            stored = {
+                t.name: [r[0] for r in t.ctx.storage.con.execute(
+                    "SELECT DISTINCT s.station_no FROM measurements m JOIN stations s USING (station_pk)"
+                )]
+                for t in hub.tenants
+            }
+        finally:
+            hub.close()
+        if stored != {"acme/config-pegel": ["24810552"], "globex/config-pegel": ["24810600"]}:
+            raise AssertionError(f"Gleichnamige Mandanten vermischt: {stored} / {out.getvalue()}")
+        try:
+            main_mod.load_tenants([paths[0], paths[0]])
+        except SystemExit:
+            pass
+        else:
+            raise AssertionError("Dieselbe Config zweimal muss abgelehnt werden")
+
+    # gleichnamige, aber unterschiedliche JSON-Quellen: im Hub umbenannt, in der Mandanten-DB der eigene Name
+    feeds = {
+        f"/{customer}/stations": [
+            {"no": station_no, "name": customer.upper(), "ts": "2026-02-25T13:45:00+01:00", "value": 120.0}
+        ]
+        for customer, station_no in (("initech", "2730010"), ("umbrella", "2730020"))
+    }
+    with FakeHttpServer({"/layers/10/index.json": make_index_payload(), **feeds}) as server:
+        paths = []
+        for customer, station_no in (("initech", "2730010"), ("umbrella", "2730020")):
+            (tenant_dir / customer).mkdir()
+            cfg_path = tenant_dir / customer / "config-pegel.json"
+            write_temp_config(cfg_path, tenant_dir / customer / "pegel.db")
+            cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+            cfg["providers"] = {
+                "hlnug": {"url": server.base_url + "/layers/10/index.json"},
+                "pegelonline": {
+                    "type": "json",
+                    "url": f"{server.base_url}/{customer}/stations",
+                    "parameter": "W",
+                    "unit": "cm",
+                    "fields": {"station_no": "no", "station_name": "name", "timestamp": "ts", "value": "value"},
+                },
+            }
+            cfg["stations"] = [
+                {"name": customer, "station_no": station_no, "source": "pegelonline", "thresholds_cm": [150, 180, 200, 220]}
+            ]
+            cfg["backfill"] = {"on_start": False}
+            cfg_path.write_text(json.dumps(cfg), encoding="utf-8")
+            paths.append(cfg_path)
+        hub = main_mod.TenantHub(main_mod.load_tenants(paths))
+        try:
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                main_mod.check_tenants(hub)
+            hub_names = sorted(hub.subscribers)
+            sources = {
+                t.name: [r[0] for r in t.ctx.storage.con.execute("SELECT DISTINCT source FROM stations")]
+                for t in hub.tenants
+            }
+        finally:
+            hub.close()
+        if len(hub_names) != 2 or sources != {"initech/config-pegel": ["pegelonline"], "umbrella/config-pegel": ["pegelonline"]}:
+            raise AssertionError(f"Quellenname aus dem Hub in Mandanten-DB übernommen: {hub_names} / {sources}")
+
+
+def scenario_reload(main_mod, td_path: Path, index_url: str) -> None:
+    """
+    Hot-Reload im Daemon: ConfigWatcher übernimmt eine geänderte Config erst, wenn sie eine Runde stabil
+    war, ungültige Configs lassen die alte aktiv. PollContext.reload setzt nur den Zustand geänderter
+    Schwellen und entfernter Stationen zurück; db_path gilt erst nach einem Neustart.
+    """
+    cfg_path = td_path / "config-reload.json"
+    db_path = td_path / "pegel_reload.db"
+    write_temp_config(cfg_path, db_path)
+    enable_fake_email(cfg_path)
+    base = json.loads(cfg_path.read_text(encoding="utf-8"))
+
+    def write_cfg(cfg: Any) -> None:
+        text = cfg if isinstance(cfg, str) else json.dumps(cfg, indent=2)
+        cfg_path.write_text(text, encoding="utf-8")
+        st = cfg_path.stat()
+        os.utime(cfg_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))  # grobe mtime-Auflösung (FAT/NTFS)
+
+    def take_reload(watcher) -> Any:
+        if watcher.poll():
+            raise AssertionError("Config darf erst nach einer stabilen Runde übernommen werden")
+        if not watcher.poll():
+            raise AssertionError("Geänderte Config wurde nicht übernommen")
+        return watcher.take()
+
+    sent: List[str] = []
+    real_send = main_mod.send_email
+    main_mod.send_email = lambda _settings, subject, _body, *_args: sent.append(subject)
+    ctx = main_mod.PollContext(main_mod.load_settings(cfg_path))
+    watcher = main_mod.ConfigWatcher(cfg_path, interval=0.05, start=False)
+    nidda, ulfa = ("24810600", "W"), ("24810552", "W")
+    try:
+        def cycle() -> str:
+            patch_requests(main_mod, ulfa_payload("2026-02-25T13:30:00+01:00", 95.0), index_url)
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(io.StringIO()):
+                main_mod.check_once(ctx.settings, ctx)
+            return out.getvalue()
+
+        cycle()
+        if len(sent) != 4:
+            raise AssertionError(f"Erster Zyklus: 4 Alarme für Ulfa erwartet, erhalten: {sent}")
+        ctx.trends  # Trendfenster aufbauen (wie im Daemon nach dem ersten Zyklus)
+        if watcher.poll() or watcher.poll():
+            raise AssertionError("Unveränderte Config darf nicht neu geladen werden")
+
+        # Ulfa: nur Schwelle 4 geändert, Nidda entfernt, db_path geändert (erst nach Neustart)
+        old_db = ctx.settings.db_path
+        cfg = json.loads(json.dumps(base))
+        cfg["stations"] = [dict(cfg["stations"][1], thresholds_cm=[60, 70, 80, 94])]
+        cfg["storage"]["db_path"] = str(td_path / "pegel_reload_other.db")
+        write_cfg(cfg)
+        err = io.StringIO()
+        with contextlib.redirect_stdout(io.StringIO()) as out, contextlib.redirect_stderr(err):
+            settings = main_mod.apply_reload(ctx, take_reload(watcher))
+        log = out.getvalue()
+        for expected in ("db_path", "Neustart", "- Station Unter-Schmitten", "Schwellen 60/70/80/90 -> 60/70/80/94"):
+            if expected not in log:
+                raise AssertionError(f"Änderungsprotokoll ohne '{expected}': {log}")
+        if settings is not ctx.settings or settings.db_path != old_db:
+            raise AssertionError(f"db_path darf erst nach Neustart wechseln: {settings.db_path}")
+        rows = ctx.storage.con.execute(
+            "SELECT station_no, threshold_idx FROM alert_state ORDER BY station_no, threshold_idx"
+        ).fetchall()
+        if [r for r in rows if r[0] == nidda[0]] or [r[1] for r in rows if r[0] == ulfa[0]] != [0, 1, 2]:
+            raise AssertionError(f"alert_state nach Reload unerwartet: {rows}")
+        if nidda in ctx.last_seen or ulfa in ctx.last_seen:
+            raise AssertionError(f"last_seen nach Reload unerwartet: {ctx.last_seen}")
+        if "Unter-Schmitten" in ctx.metrics.render() or nidda in ctx.trends._windows:
+            raise AssertionError("Gauges/Trendfenster der entfernten Station müssen verworfen werden")
+
+        sent.clear()
+        out2 = cycle()
+        if len(sent) != 1 or "Unter-Schmitten" in out2:
+            raise AssertionError(f"Nach Reload nur die geänderte Schwelle erneut alarmieren: {sent}")
+
+        # ungültige Config: alte bleibt aktiv, Fehler auf stderr
+        write_cfg("{ kaputt")
+        with contextlib.redirect_stderr(err):
+            if watcher.poll() or watcher.poll() or watcher.take() is not None:
+                raise AssertionError("Ungültige Config darf nicht übernommen werden")
+        if "alte Config bleibt aktiv" not in err.getvalue() or ctx.settings is not settings:
+            raise AssertionError(f"Ungültige Config: {err.getvalue()!r}")
+
+        # Station wieder hinzufügen: wird sofort ausgewertet, Ulfa-Zustand bleibt
+        cfg["stations"] = [base["stations"][0], cfg["stations"][0]]
+        write_cfg(cfg)
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            main_mod.apply_reload(ctx, take_reload(watcher))
+        if "+ Station Unter-Schmitten" not in out.getvalue() or "Ulfa" in out.getvalue():
+            raise AssertionError(f"Änderungsprotokoll unerwartet: {out.getvalue()}")
+        sent.clear()
+        out3 = cycle()
+        if "Unter-Schmitten" not in out3 or sent or nidda not in ctx.trends._windows:
+            raise AssertionError(f"Hinzugefügte Station nicht ausgewertet: {out3} / {sent}")
+
+        # neu gespeichert ohne Änderung: nur der Hinweis auf db_path, Zustand bleibt
+        write_cfg(cfg)
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            main_mod.apply_reload(ctx, take_reload(watcher))
+        if out.getvalue().count("\n") != 2 or "Neustart" not in out.getvalue() or len(ctx.last_seen) != 2:
+            raise AssertionError(f"Neu gespeicherte Config ohne Änderung: {out.getvalue()!r}")
+    finally:
+        main_mod.send_email = real_send
+        watcher.close()
+        ctx.close()
+
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--main", default="pegelabfrage.py", help="Pfad zum Hauptscript (default: pegelabfrage.py)")
@@ -203,7 +2022,7 @@ def main():
     # Wichtig: ignore_cleanup_errors=True verhindert WinError 32 beim Löschen (Windows DB-Lock)
     with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as td:
         td_path = Path(td)
-        cfg_path = td_path / "config.ini"
+        cfg_path = td_path / "config.json"
         db_path = td_path / "pegel_test.db"
 
         write_temp_config(cfg_path, db_path)
@@ -226,6 +2045,30 @@ def main():
         if args.align_check:
             alignment_check(out)
 
+        scenario_conditional_get(main_mod, td_path, index_url)
+        scenario_stream_parse(main_mod, td_path, index_url)
+        scenario_station_index(main_mod)
+        scenario_rearm(main_mod, td_path, index_url)
+        scenario_state_migration(main_mod, td_path)
+        scenario_measurement_migration(main_mod, td_path)
+        scenario_backfill(main_mod, td_path)
+        scenario_rollups_retention(main_mod, td_path)
+        scenario_history_export(main_mod, td_path)
+        scenario_classify(main_mod, td_path)
+        scenario_trend(main_mod, td_path, index_url)
+        scenario_forecast(main_mod, td_path, index_url)
+        scenario_outbox(main_mod, td_path, index_url)
+        scenario_smtp_pool(main_mod, td_path, index_url)
+        scenario_scheduler(main_mod, td_path)
+        scenario_last_seen(main_mod, td_path, index_url)
+        scenario_metrics(main_mod, td_path, index_url)
+        scenario_profile(main_mod, td_path)
+        scenario_replay(main_mod, td_path, index_url)
+        scenario_tune(main_mod, td_path)
+        scenario_providers(main_mod, td_path)
+        scenario_tenants(main_mod, td_path)
+        scenario_reload(main_mod, td_path, index_url)
+
         print("TEST OK – Szenarien erfolgreich durchgelaufen.")
         print("---- Beispielausgabe ----")
         print(out.rstrip())